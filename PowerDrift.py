@@ -1,11 +1,4 @@
-# "Rice Racer" - A tribute to Sega's 1988 Arcade Game "Power Drift"
-#
-# I was trying to think of which classic arcade game would be a good match for the tools provided
-# by CodeSkulptor and SimpleGUI. SimpleGUI's most exciting graphical feature is the ability to
-# scale and rotate images, so I started thinking of the sprite-scalers from the mid-80's, like
-# Space Harrier, Out Run and Afterburner. However, the one I remember most vividly is an outrageous
-# driving game called Power Drift, which challenged the player to race around tracks that resembled
-# roller coasters more than motor racing circuits.
+# "Rice Racer" - A tribute to Sega's 1988 Arcade Game "Power Drift" (v1.4 - 11th July 2013)
 #
 # Programming - Steven Knock
 # Music       - Andy Denton
@@ -14,48 +7,62 @@
 #             - Horizon, http://en.wikipedia.org/wiki/File:Spitzkoppe_360_Panorama.jpg
 #             - Track, generated using Paint Shop Pro
 #
-# Current Version (v1.4 - 11th July 2013):
-#   in which I updated the code to work with CodeSkulptor's new integer and float rules.
-#
-# Earlier versions:
-# v1.3 - 13th March 2013:
-#   in which I added the horizon, music, sound effects, player images, new track, new car images
-#   and increased the difficulty.
-#
-# v1.2: http://www.codeskulptor.org/#user8-gRnuT0e3vD-0.py
-#   in which I updated the code to work with the latest version of CodeSkulptor.
-#
-# v1.1: http://www.codeskulptor.org/#user6-UbZVApbT6ahIJnI.py
-#   in which I added a mini-map and increased the frame rate.
-#
-# v1.0: http://www.codeskulptor.org/#user6-oD2uRenZ5yXlpWp.py
-#
-# There are a few important points:
-#
-# The game requires a moderately quick computer to run at an acceptable rate, and I strongly recommend
-# running it in Chrome rather than Firefox. In Chrome, I get a steady 20fps (v1.1), which is fine,
-# whereas in Firefox I get 5fps which is unplayable.
-#
-# To add additional opponents, simply add names to the PLAYERS array defined at the top of the code.
-#
-# It's also straightforward to create your own tracks. The pre-defined tracks are defined inside a
-# routine called _define_tracks() and consist of pairs of coordinates and tangent vectors, collectively
-# called "control points". Search the web for "Hermite Curves" for more information.
+# See README.md for the history of the game and notes on playing it, adding players and creating tracks.
 #
 # Apologies for the single character indents, but this was necessary to reduce code size since I
 # exceeded CodeSkulptor's 64k limit.
 #
-# The game loads several images when it starts. Sometimes, an image inexplicably doesn't get loaded
-# and so the game will keep telling you that it is waiting for images to load. If this happens, the
-# easiest thing is just to restart the game.
-#
 # Burn rubber!
 
 import math
 import random
-import simplegui
 import time
 
+try:
+ get_time = time.perf_counter
+except AttributeError:
+ get_time = time.time
+
+# Without simplegui, races can still be run - see headless.py
+try:
+ import simplegui
+except ImportError:
+ simplegui = None
+
+backend = simplegui
+
+# Optional modules, which CodeSkulptor can't import
+try:
+ from track_cache import CachingTrackBuilder
+except ImportError:
+ CachingTrackBuilder = None
+try:
+ from replay import Replay
+except ImportError:
+ Replay = None
+try:
+ from render_depth import RenderDepthController
+except ImportError:
+ RenderDepthController = None
+try:
+ from culling import TrackCuller
+except ImportError:
+ TrackCuller = None
+try:
+ from sprite_cache import SpriteCache
+except ImportError:
+ SpriteCache = None
+try:
+ from profiler import Profiler
+except ImportError:
+ class Profiler:
+  def start_frame(self):
+   pass
+  end_frame = start_frame
+  def end_phase(self, *args):
+   pass
+  render = end_phase
+
 # Player Roster - Feel free to add more names to this list.
 # You always control the first player, and they are always placed last on the starting grid.
 PLAYERS = (
@@ -107,6 +114,12 @@ IMG_BANNER = 13
 IMG_TREE = 14
 IMG_CAR = 20
 
+# Texture Atlas - Opt-in and currently unused: both tables are empty, so every image is loaded separately. To use it,
+#   upload the sheets made by atlas.py and paste in the tables that it prints. Each entry of ATLAS_RECTS is
+#   (IMG_ constant, index into ATLAS_SHEETS, x, y, width, height).
+ATLAS_SHEETS = ()
+ATLAS_RECTS = ()
+
 # Music Constants
 MUSIC_TRACKS = (
  ('menu', 75),
@@ -146,18 +159,18 @@ def is_tuple(x):
 # Classes
 
 class Sort:
- # Quicksort a list of tuples whose first element is the sorted key
- def quick_sort(list):
-  if list == []:
-   return []
-  else:
-   pivot = list[0]
-   pivot_value = pivot[0]
-   lesser = Sort.quick_sort([x for x in list[1 :] if x[0] < pivot_value])
-   greater = Sort.quick_sort([x for x in list[1 :] if x[0] >= pivot_value])
-   return lesser + [pivot] + greater
-
-# A class to keep track of time intervals and provide an average of them
+ # Insertion sort, in place, of lists by their first element, which is quick when nearly sorted already
+ def insertion_sort(list):
+  for i in range(1, len(list)):
+   item = list[i]
+   key = item[0]
+   j = i - 1
+   while j >= 0 and list[j][0] > key:
+    list[j + 1] = list[j]
+    j -= 1
+   list[j + 1] = item
+
+# Keeps track of the time between frames
 class TimeCounter:
  MAX_INTERVALS = 5
 
@@ -168,7 +181,7 @@ class TimeCounter:
   return str(self.intervals)
 
  def record_time(self):
-  current_time = time.time()
+  current_time = get_time()
   if self.last_time > 0:
    interval = current_time - self.last_time
    if len(self.intervals) < TimeCounter.MAX_INTERVALS:
@@ -181,21 +194,12 @@ class TimeCounter:
   self.last_average_time = 0
 
  def get_average_time(self):
-  if self.last_average_time != 0:
-   return self.last_average_time
+  if self.last_average_time == 0 and self.intervals:
+   self.last_average_time = sum(self.intervals) / len(self.intervals)
+  return self.last_average_time
 
-  total = 0
-  l = len(self.intervals)
-  if l > 0:
-   for interval in self.intervals:
-    total += interval
-   total /= l
-
-  self.last_average_time = total
-  return total
-
- def get_current_time(self):
-  return self.last_time
+ def get_last_interval(self):
+  return self.intervals[self.index - 1] if self.intervals else 0
 
  def get_total_time(self):
   return self.last_time - self.initial_time
@@ -217,8 +221,8 @@ class Math:
 
  # Normalises a 3d vector
  def normalise(v):
-  magnitude = math.sqrt((v[X] ** 2) + (v[Y] ** 2) + (v[Z] ** 2))
-  return [v[0] / magnitude, v[1] / magnitude, v[2] / magnitude]
+  magnitude = math.sqrt(v[X] ** 2 + v[Y] ** 2 + v[Z] ** 2)
+  return [a / magnitude for a in v]
 
  # Returns the squared distance between two points
  def distance_sq(p1, p2):
@@ -250,86 +254,122 @@ class BoundingBox:
 
  def add(self, point):
   if self.box == None:
-   # If this is the first point to be added to the box, then initialise the box extents based on it
-   self.box = []
-   for i in range(2):
-    self.box.append(list(point))
-   return
-
-  # Grow the box to accommodate the new point
-  min_pt = self.box[0]
-  for a in range(3):
-   if point[a] < min_pt[a]:
-    min_pt[a] = point[a]
-  max_pt = self.box[1]
+   self.box = [list(point), list(point)]
   for a in range(3):
-   if point[a] > max_pt[a]:
-    max_pt[a] = point[a]
+   self.box[0][a] = min(self.box[0][a], point[a])
+   self.box[1][a] = max(self.box[1][a], point[a])
 
  def get_centre(self):
-  b = self.box
-  return ((b[1][X] + b[0][X]) / 2.0, (b[1][Y] + b[0][Y]) / 2.0, (b[1][Z] + b[0][Z]) / 2.0)
+  return tuple([(self.box[1][a] + self.box[0][a]) / 2.0 for a in range(3)])
 
  def get_extent(self, axis):
   return self.box[1][axis] - self.box[0][axis]
 
+# sources holds the (image, centre, size) to draw each IMG_ constant with, once it has loaded
 class ImageManager:
  def __init__(self):
-  self.images = []
-  for image_data in IMAGES:
-   image_name = image_data[0] if is_tuple(image_data) else image_data
-   image_url = IMAGE_BASE + image_name
-   if '.' not in image_name:
-    image_url += IMAGE_TYPE
-   self.images.append(simplegui.load_image(image_url))
+  self.images = [None] * len(IMAGES)
+  self.sources = [None] * len(IMAGES)
+  self.sprite_cache = SpriteCache(backend.scale_image) if SpriteCache and getattr(backend, 'scale_image', None) else None
+  self._pending = []
+  sheets = [ImageManager._load_image(name) for name in ATLAS_SHEETS]
+  for index, sheet, x, y, w, h in ATLAS_RECTS:
+   self.images[index] = sheets[sheet]
+   self._pending.append((index, sheets[sheet], (x + w / 2.0, y + h / 2.0), (w, h)))
+  for index in range(len(IMAGES)):
+   if self.images[index] == None:
+    name = IMAGES[index]
+    self.images[index] = ImageManager._load_image(name[0] if is_tuple(name) else name)
+    self._pending.append((index, self.images[index], None, None))
+  self._notified = getattr(backend, 'add_load_callback', None) != None
+  if self._notified:
+   for entry in self._pending:
+    backend.add_load_callback(entry[1], self._on_image_loaded)
+
+ def _load_image(image_name):
+  image_url = IMAGE_BASE + image_name
+  if '.' not in image_name:
+   image_url += IMAGE_TYPE
+  return backend.load_image(image_url)
 
  def get_number_of_pending_images(self):
-  count = 0
-  for image in self.images:
-   if image.get_width() == 0:
-    count += 1
-  return count
+  if not self._notified:
+   for entry in self._pending[:]:
+    if entry[1].get_width() != 0:
+     self._on_image_loaded(entry[1])
+  return len(self._pending)
+
+ def _on_image_loaded(self, image):
+  for entry in self._pending[:]:
+   index, entry_image, centre, size = entry
+   if entry_image == image:
+    if size == None:
+     size = (image.get_width(), image.get_height())
+     centre = (size[0] / 2.0, size[1] / 2.0)
+    self.sources[index] = (image, centre, size)
+    self._pending.remove(entry)
+
+# Calls functions at the times they are scheduled for, such as when a sound needs to loop
+class AudioScheduler:
+ def __init__(self):
+  self.events = []      # [time, order scheduled, function]
+  self.scheduled = 0
+
+ def schedule(self, delay, function):
+  event = [get_time() + delay, self.scheduled, function]
+  self.scheduled += 1
+  self.events.append(event)
+  self.events.sort()
+  return event
+
+ def cancel(self, event):
+  if event != None:
+   event[2] = None
+
+ def process(self):
+  events = self.events
+  current_time = get_time()
+  while events and events[0][0] <= current_time:
+   function = events.pop(0)[2]
+   if function != None:
+    function()
 
 class MusicTrack:
  def __init__(self, name, length):
   self.name = name
   self.length = length
-  self.sound = simplegui.load_sound(MUSIC_BASE + name + MUSIC_TYPE);
+  self.sound = backend.load_sound(MUSIC_BASE + name + MUSIC_TYPE);
 
 class MusicManager:
- def __init__(self, time_counter):
-  self.time_counter = time_counter
+ def __init__(self, scheduler):
+  self.scheduler = scheduler
   self.active_track = -1
   self.selected_track = -1
-  self.tracks = []
+  self.tracks = [MusicTrack(track[0], track[1]) if is_tuple(track) else MusicTrack(track, 0) for track in MUSIC_TRACKS]
   self.mute = False
-  for track in MUSIC_TRACKS:
-   name = track[0] if is_tuple(track) else track
-   length = track[1] if is_tuple(track) else 0
-   self.tracks.append(MusicTrack(name, length))
+  self.loop_event = None
 
  def play(self, track_index):
   self.stop()
-  self.active_track = track_index;
-  self.selected_track = track_index;
-  self.sound_start_time = self.time_counter.get_current_time()
-  track = self.tracks[track_index];
+  self.active_track = track_index
+  self.selected_track = track_index
+  track = self.tracks[track_index]
   track.sound.rewind()
   if not self.mute:
    track.sound.play()
+   if track.length > 0:
+    self.loop_event = self.scheduler.schedule(track.length, self._loop)
 
  def stop(self):
+  self.scheduler.cancel(self.loop_event)
+  self.loop_event = None
   if self.active_track >= 0:
    self.tracks[self.active_track].sound.rewind()
   self.active_track = -1
 
- def process_sound(self):
-  if self.active_track >= 0:
-   track = self.tracks[self.active_track]
-   if track.length > 0:
-    current_time = self.time_counter.get_current_time()
-    if current_time - self.sound_start_time >= track.length:
-     self.play(self.active_track)
+ def _loop(self):
+  self.loop_event = None
+  self.play(self.active_track)
 
  def toggle(self):
   self.mute = not self.mute
@@ -338,52 +378,63 @@ class MusicManager:
   else:
    self.play(self.selected_track)
 
+# A backend that can change the pitch of a sound provides create_engine_sound() - see engine_synth.py
 class EngineManager:
  INTERVALS = 12
  SAMPLE_LENGTH_S = 11.436
  FUDGE_FACTOR_S = 0.2
+ PITCH_HYSTERESIS = 0.25
+ PITCH_HOLD_S = 0.1
 
- def __init__(self, time_counter):
-  self.time_counter = time_counter
+ def __init__(self, scheduler):
+  self.scheduler = scheduler
   self.active_sound = -1
-  self.desired_sound = -1
   self.sounds = []
   self.sound_lengths = []
   self.mute = False
-  length = EngineManager.SAMPLE_LENGTH_S
-  factor = 2.0 ** (1.0 / 12.0)
-  for i in range(1, EngineManager.INTERVALS + 1):
-   sound_url = SFX_BASE + 'engine-' + str(i) + SFX_TYPE
-   sound = simplegui.load_sound(sound_url)
+  self.loop_event = None
+  self.change_time = 0
+  create_engine_sound = getattr(backend, 'create_engine_sound', None)
+  self.engine_sound = create_engine_sound and create_engine_sound(SFX_BASE + 'engine-1' + SFX_TYPE, EngineManager.INTERVALS)
+  if self.engine_sound != None:
+   self.engine_sound.set_volume(SFX_VOLUME)
+   return
+  for i in range(EngineManager.INTERVALS):
+   sound = backend.load_sound(SFX_BASE + 'engine-' + str(i + 1) + SFX_TYPE)
    sound.set_volume(SFX_VOLUME)
    self.sounds.append(sound)
-   self.sound_lengths.append(length)
-   length /= factor
+   self.sound_lengths.append(EngineManager.SAMPLE_LENGTH_S / 2.0 ** (i / 12.0))
 
- def process_sound(self):
+ def set_pitch(self, pitch):
   if self.mute:
    return
-  has_active_sound = self.active_sound >= 0
-  current_time = self.time_counter.get_current_time()
-  if self.desired_sound != self.active_sound:
-   self.sounds[self.desired_sound].play()
-   if has_active_sound:
-    self.sounds[self.active_sound].rewind()
-   self.active_sound = self.desired_sound
-   self.sound_start_time = current_time
-  elif has_active_sound:
-   elapsed = current_time - self.sound_start_time
-   if elapsed + EngineManager.FUDGE_FACTOR_S >= self.sound_lengths[self.active_sound]:
-    self.sounds[self.active_sound].rewind()
-    self.sounds[self.active_sound].play()
-    self.sound_start_time = current_time
-
- def set_pitch(self, pitch):
-  intervals = EngineManager.INTERVALS
-  self.desired_sound = int(max(0, min(pitch * intervals, intervals - 1)))
+  if self.engine_sound != None:
+   self.engine_sound.set_pitch(pitch)
+   self.engine_sound.play()
+   return
+  position = max(0, min(pitch * EngineManager.INTERVALS, EngineManager.INTERVALS - 1))
+  active = self.active_sound
+  if active >= 0:
+   h = EngineManager.PITCH_HYSTERESIS
+   if active - h <= position < active + 1 + h or get_time() - self.change_time < EngineManager.PITCH_HOLD_S:
+    return
+   self.sounds[active].rewind()
+   self.scheduler.cancel(self.loop_event)
+  self.active_sound = int(position)
+  self.change_time = get_time()
+  self._loop()
+
+ def _loop(self):
+  sound = self.sounds[self.active_sound]
+  sound.rewind()
+  sound.play()
+  self.loop_event = self.scheduler.schedule(self.sound_lengths[self.active_sound] - EngineManager.FUDGE_FACTOR_S, self._loop)
 
  def stop(self):
-  self.desired_sound = -1
+  self.scheduler.cancel(self.loop_event)
+  self.loop_event = None
+  if self.engine_sound != None:
+   self.engine_sound.rewind()
   if self.active_sound >= 0:
    self.sounds[ self.active_sound ].rewind()
    self.active_sound = -1
@@ -421,6 +472,9 @@ class Sprite:
   self.orientation = orientation
   self.image = image
 
+  self.sine_orientation = math.sin(orientation)
+  self.cosine_orientation = math.cos(orientation)
+
 class HermiteCurve:
  HERMITE_BASE = ((2, -3, 0, 1), (-2, 3, 0, 0), (1, -2, 1, 0), (1, -1, 0, 0))
  HERMITE_DERIVATIVE = ((6, -6, 0, 0), (-6, 6, 0, 0), (3, -4, 1, 0), (3, -2, 0, 0))
@@ -430,40 +484,19 @@ class HermiteCurve:
  #      : t1, t2 - Tangent Vectors at the start and end of the curve
  def __init__(self, p1, p2, t1, t2):
   geometry = (p1, p2, t1, t2)
-  self.coefs = []
-  self.deriv_coefs = []
-  for axis in range(3):
-   coef = []
-   deriv_coef = []
-   for j in range(4):
-    tot = 0
-    deriv_tot = 0
-    for k in range(4):
-     tot += HermiteCurve.HERMITE_BASE[k][j] * geometry[k][axis]
-     deriv_tot += HermiteCurve.HERMITE_DERIVATIVE[k][j] * geometry[k][axis]
-    coef.append(tot)
-    deriv_coef.append(deriv_tot)
-   self.coefs.append(coef)
-   self.deriv_coefs.append(deriv_coef)
+  self.coefs = [[sum([HermiteCurve.HERMITE_BASE[k][j] * geometry[k][axis] for k in range(4)]) for j in range(4)] for axis in range(3)]
+  self.deriv_coefs = [[sum([HermiteCurve.HERMITE_DERIVATIVE[k][j] * geometry[k][axis] for k in range(4)]) for j in range(4)] for axis in range(3)]
 
  # Calculate a point on a 3d-curve using the coefficients previously calculated and t, where 0 <= t <= 1
  def calculate_point(self, t):
   t2 = t * t
   t3 = t2 * t
-  p = []
-  for i in range(3):
-   c = self.coefs[i]
-   p.append(c[0] * t3 + c[1] * t2 + c[2] * t + c[3])
-  return p
+  return [c[0] * t3 + c[1] * t2 + c[2] * t + c[3] for c in self.coefs]
 
  # Calculate the tangent vector at a point on the 3d-curve
  def calculate_tangent(self, t):
   t2 = t * t
-  p = []
-  for i in range(3):
-   c = self.deriv_coefs[i]
-   p.append(c[0] * t2 + c[1] * t + c[2])
-  return p
+  return [c[0] * t2 + c[1] * t + c[2] for c in self.deriv_coefs]
 
 class TrackSegment:
  def __init__(self, position, orientation, image_name):
@@ -483,6 +516,7 @@ class TrackDef:
  DEFAULT_ELEVATED_IMAGE = IMG_LOG
 
  DISTANCE_BETWEEN_SEGMENTS_M = 0.4
+ GROUND_LEVEL_M = 0.02
 
  TRACK_SIZE_M = (5, 0.7, DISTANCE_BETWEEN_SEGMENTS_M)
 
@@ -498,81 +532,118 @@ class TrackDef:
 
  # Returns the angle of the bend of the track at the specified position, in radians.
  def get_track_angle(self, position):
-  track_index = int(position)
-  track_length = len(self.track)
-  track1 = self.track[track_index % track_length]
-  track2 = self.track[(track_index + 1) % track_length]
-  return Math.get_angle_between_orientations(track1.orientation, track2.orientation)
+  i = int(position)
+  track = self.track
+  return Math.get_angle_between_orientations(track[i % len(track)].orientation, track[(i + 1) % len(track)].orientation)
 
  def get_length_m(self):
   return len(self.track) * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
 
  # Create Track
  # Takes the control points specified in the track_def array and creates curves from them.
+ # It is only assigned once complete, as it may be built on another thread.
  def create_track(self):
-  self.track = []
+  track = []
   track_def = self.control_points
-
-  ground_level = 0.02
+  self._create_curves()
 
   # Store the starting point
   current_point = track_def[0].position
 
   # Distance in metres between each step on the curve
   max_distance = TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
+  ground_image = TrackDef.DEFAULT_GROUND_IMAGE
+  elevated_image = TrackDef.DEFAULT_ELEVATED_IMAGE
 
-  current_ground_image = TrackDef.DEFAULT_GROUND_IMAGE
-  current_elevated_image = TrackDef.DEFAULT_ELEVATED_IMAGE
-
-  i = 0
   l = len(track_def)
-  while i < l:
+  for i in range(l):
    # cp1 = Start Control Point. cp2 = End Control Point
    cp1 = track_def[i]
-   i += 1
-   cp2 = track_def[i % l]
+   cp2 = track_def[(i + 1) % l]
 
    # Apply image for this track section
    if cp1.image_name != None:
-    if cp1.position[Y] <= ground_level:
-     current_ground_image = cp1.image_name
+    if cp1.position[Y] <= TrackDef.GROUND_LEVEL_M:
+     ground_image = cp1.image_name
     else:
-     current_elevated_image = cp1.image_name
-
-   # Initialise object for curve calculations
-   cp1.curve = HermiteCurve(cp1.position, cp2.position, cp1.vector, cp2.vector)
+     elevated_image = cp1.image_name
 
    # Estimate roughly how many line segments to break the curve into
    lines = Math.distance(cp1.position, cp2.position) * math.pi / (4 * max_distance)
 
    j = 1.0
    while j <= lines:
-    t = j / lines
-    next_point = cp1.curve.calculate_point(t)
-    current_distance = Math.distance(current_point, next_point)
-    if current_distance >= max_distance:
-     dt = max_distance / current_distance
-     vector = []
-     new_point = []
-     for a in range(3):
-      vector.append(next_point[a] - current_point[a])
-      new_point.append(current_point[a] + vector[a] * dt)
-     orientation = Math.get_orientation_from_tangent_vector(vector)
-
-     current_point = tuple(new_point)
-
-     # Calculate track image
-     if len(self.track) == 0:
-      image_name = IMG_START_LINE
-     elif current_point[Y] <= ground_level:
-      image_name = current_ground_image
-     else:
-      image_name = current_elevated_image
-
-     self.track.append(TrackSegment(current_point, orientation, image_name))
+    next_point = cp1.curve.calculate_point(j / lines)
+    j += 1
+    vector = [next_point[a] - current_point[a] for a in range(3)]
+    current_distance = Math.distance(next_point, current_point)
+    steps = int(current_distance // max_distance)
+    if steps == 0:
+     continue
+
+    orientation = Math.get_orientation_from_tangent_vector(vector)
+    start_point = current_point
+    for step in range(1, steps + 1):
+     dt = step * max_distance / current_distance
+     current_point = tuple([start_point[a] + vector[a] * dt for a in range(3)])
+
+     image_name = ground_image if current_point[Y] <= TrackDef.GROUND_LEVEL_M else elevated_image
+     track.append(TrackSegment(current_point, orientation, image_name if track else IMG_START_LINE))
      self.bounding_box.add(current_point)
-    else:
-     j += 1
+  self.track = track
+
+ # Initialise the objects for curve calculations
+ def _create_curves(self):
+  track_def = self.control_points
+  l = len(track_def)
+  for i in range(l):
+   cp1 = track_def[i]
+   cp2 = track_def[(i + 1) % l]
+   cp1.curve = HermiteCurve(cp1.position, cp2.position, cp1.vector, cp2.vector)
+
+ # See track_cache.py
+ def get_cache_key(self):
+  control_points = [(cp.position, cp.vector, cp.image_name) for cp in self.control_points]
+  return repr((control_points, TrackDef.DISTANCE_BETWEEN_SEGMENTS_M, TrackDef.GROUND_LEVEL_M, TrackDef.DEFAULT_GROUND_IMAGE, TrackDef.DEFAULT_ELEVATED_IMAGE, IMG_START_LINE))
+
+ def restore_track(self, segments, box):
+  self._create_curves()
+  self.bounding_box.box = box
+  self.track = [TrackSegment(s[0], s[1], s[2]) for s in segments]
+
+ # Estimated from the curves if the track hasn't been built yet
+ def get_bounding_box(self):
+  if self.track != None:
+   return self.bounding_box
+  self._create_curves()
+  bounding_box = BoundingBox()
+  for cp in self.control_points:
+   for j in range(8):
+    bounding_box.add(cp.curve.calculate_point(j / 8.0))
+  return bounding_box
+
+# Builds the track needed now immediately, and those that may be needed soon one per frame
+class TrackBuilder:
+ def __init__(self, track_defs):
+  self.track_defs = track_defs
+  self._queue = []
+
+ def build(self, index):
+  track_def = self.track_defs[index]
+  if track_def.track == None:
+   track_def.create_track()
+  return track_def
+
+ def prefetch(self, indices):
+  self._queue = [index % len(self.track_defs) for index in indices]
+  self.process()
+
+ def process(self):
+  while self._queue:
+   track_def = self.track_defs[self._queue.pop(0)]
+   if track_def.track == None:
+    track_def.create_track()
+    return
 
 class Camera:
  def __init__(self):
@@ -580,7 +651,6 @@ class Camera:
   self.set_yaw(0)
   self.set_pitch(0)
   self.set_roll(0)
-  self._vbuff = [[0, 0, 0], [0, 0, 0]]
 
  def __str__(self):
   return str(self.position) + " [Yaw=" + str(round(self.yaw, 3)) + ", Roll=" + str(round(self.roll, 3)) + "]"
@@ -602,17 +672,14 @@ class Camera:
 
  # Transformations
  def world_to_view(self, pos):
-  # Translate pos from world coordinates into view coordinates (relative to camera)
+  # Translate pos from world coordinates into view coordinates (relative to camera), then rotate by the camera's yaw
   vbx = pos[0] - self.position[0]
   vby = pos[1] - self.position[1]
   vbz = pos[2] - self.position[2]
-
-  # Rotate the view coordinates according to the camera's yaw
   vbx, vbz = vbx * self.cosine_yaw - vbz * self.sine_yaw, vbx * self.sine_yaw + vbz * self.cosine_yaw
 
-  # This saves a bit of time during the game when pitch isn't used
+  # Then by its pitch, which is often 0
   if self.pitch != 0:
-   # Rotate the view coordinates according to the camera's pitch
    vby, vbz = vby * self.cosine_pitch - vbz * self.sine_pitch, vby * self.sine_pitch + vbz * self.cosine_pitch
 
   return (vbx, vby, vbz)
@@ -630,19 +697,17 @@ class Mechanics:
 
  def __init__(self, race):
   self.race = race
+  self._sweep_order = [[0, i] for i in range(len(race.players))]
+  self.collisions = 0
 
  # Simulate centrifugal force being applied to the human player as they take corners
  def apply_force(self):
   player = self.race.players[Player.HUMAN]
-  vel = player.velocity
-  acc = player.acceleration
-  track_angle = self.race.track_def.get_track_angle(player.position[1])
-  acc[0] -= vel[1] * track_angle * Mechanics.CAR_CENTRIFUGAL_MSS
+  player.acceleration[0] -= player.velocity[1] * self.race.track_def.get_track_angle(player.position[1]) * Mechanics.CAR_CENTRIFUGAL_MSS
 
  def move_players(self, delta):
   position_along_track_factor = delta / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
   car_vel_max = Mechanics.CAR_VELOCITY_MAX_MS
-  acc_factor = [0, 0]
   for player in self.race.players:
    pos = player.position
    vel = player.velocity
@@ -652,28 +717,14 @@ class Mechanics:
    pos[0] += vel[0] * delta
    pos[1] += vel[1] * position_along_track_factor
 
-   # Calculate lateral acceleration strength based on forward velocity
-   acc_factor[0] = min(2 * vel[1] / car_vel_max[1], 1)
-
-   # Calculate forward acceleration strength - this gives greater acceleration at lower speeds and boosts deceleration
-   if acc[1] > 0:
-    acc_factor[1] = math.cos(vel[1] / car_vel_max[1] * math.pi / 2)
-   else:
-    acc_factor[1] = Mechanics.CAR_DECELERATION_FACTOR
-
-   # Update Velocity
-   vel[0] += acc[0] * delta * acc_factor[0]
-   vel[1] += acc[1] * delta * acc_factor[1]
+   # Lateral acceleration strength depends on forward velocity. Forward acceleration is greater at lower speeds, and
+   #   deceleration is boosted.
+   vel[0] += acc[0] * delta * min(2 * vel[1] / car_vel_max[1], 1)
+   vel[1] += acc[1] * delta * (math.cos(vel[1] / car_vel_max[1] * math.pi / 2) if acc[1] > 0 else Mechanics.CAR_DECELERATION_FACTOR)
 
    # Constrain Velocity
-   if vel[1] < 0:
-    vel[1] = 0
-   elif vel[1] > car_vel_max[1]:
-    vel[1] = car_vel_max[1]
-   if vel[0] < -car_vel_max[0]:
-    vel[0] = -car_vel_max[0]
-   elif vel[0] > car_vel_max[0]:
-    vel[0] = car_vel_max[0]
+   vel[1] = max(0, min(vel[1], car_vel_max[1]))
+   vel[0] = max(-car_vel_max[0], min(vel[0], car_vel_max[0]))
 
    # Dampen velocity
    if acc[0] == 0 or vel[1] < 10:
@@ -683,70 +734,65 @@ class Mechanics:
 
  def process_collisions(self):
   players = self.race.players
-  bb = []
-  for player in players:
-   bb.append(self._get_bounding_box(player))
-
-  l = len(players)
-  for i in range(l):
-   p1 = players[i]
+  bb = self._get_bounding_boxes()
+
+  # Broad Phase - Only test the pairs whose boxes overlap along the track, keeping the players sorted along it
+  order = self._sweep_order
+  for entry in order:
+   entry[0] = bb[entry[1]][0][Y]
+  Sort.insertion_sort(order)
+  pairs = []
+  l = len(order)
+  for a in range(l):
+   i = order[a][1]
+   max_z = bb[i][1][Y]
+   for b in range(a + 1, l):
+    j = order[b][1]
+    if bb[j][0][Y] > max_z:
+     break
+    pairs.append((i, j) if i < j else (j, i))
+
+  # Narrow Phase - In the same order as testing every pair
+  pairs.sort()
+  for i, j in pairs:
    bb1 = bb[i]
-   for j in range(i + 1, l):
-    p2 = players[j]
-    bb2 = bb[j]
-
-    dx0 = bb2[1][X] - bb1[0][X]
-    if dx0 < 0:
-     continue
-    dx1 = bb1[1][X] - bb2[0][X]
-    if dx1 < 0:
-     continue
-    dz0 = bb2[1][Y] - bb1[0][Y]
-    if dz0 < 0:
-     continue
-    dz1 = bb1[1][Y] - bb2[0][Y]
-    if dz1 < 0:
-     continue
+   bb2 = bb[j]
+   dx0 = bb2[1][X] - bb1[0][X]
+   dx1 = bb1[1][X] - bb2[0][X]
+   dz0 = bb2[1][Y] - bb1[0][Y]
+   dz1 = bb1[1][Y] - bb2[0][Y]
+   if dx0 < 0 or dx1 < 0 or dz0 < 0 or dz1 < 0:
+    continue
+
+   # There has been a collision
+   self.collisions += 1
+   mtd_x = dx0 if dx0 < dx1 else -dx1
+   mtd_z = dz0 if dz0 < dz1 else -dz1
+   if abs(mtd_x) < abs(mtd_z):
+    mtd_z = 0
+   else:
+    mtd_x = 0
 
-    # There has been a collision
-    mtd_x = dx0 if dx0 < dx1 else -dx1
-    mtd_z = dz0 if dz0 < dz1 else -dz1
-    if abs(mtd_x) < abs(mtd_z):
-     mtd_z = 0
-    else:
-     mtd_x = 0
-
-    # Intersection Response - Separate the objects so that they just touch each other
-    relaxation = Mechanics.COLLISION_RELAXATION
-    fx = mtd_x * 0.5 * relaxation
-    fz = mtd_z * 0.5 * relaxation / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
-    p1.position[X] += fx
-    p1.position[Y] += fz
-    p2.position[X] -= fx
-    p2.position[Y] -= fz
-
-    # Swap and dampen velocities if hitting back to front
-    if mtd_z != 0:
-     dampen = Mechanics.COLLISION_DAMPEN
-     v = p1.velocity[Y]
-     p1.velocity[Y] = p2.velocity[Y] * dampen
-     p2.velocity[Y] = v * 0.9
+   # Intersection Response - Separate the objects so that they just touch each other
+   p1 = players[i]
+   p2 = players[j]
+   fx = mtd_x * 0.5 * Mechanics.COLLISION_RELAXATION
+   fz = mtd_z * 0.5 * Mechanics.COLLISION_RELAXATION / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
+   p1.position[X] += fx
+   p1.position[Y] += fz
+   p2.position[X] -= fx
+   p2.position[Y] -= fz
+
+   # Swap and dampen velocities if hitting back to front
+   if mtd_z != 0:
+    p1.velocity[Y], p2.velocity[Y] = p2.velocity[Y] * Mechanics.COLLISION_DAMPEN, p1.velocity[Y] * 0.9
 
  def constrain_players_to_track(self):
-  car_half_width = Mechanics.CAR_SIZE_M[0] / 2
-  track_half_width = TrackDef.TRACK_SIZE_M[0] / 2
-  track_edge = (-track_half_width, track_half_width)
+  max_x = TrackDef.TRACK_SIZE_M[0] / 2 - Mechanics.CAR_SIZE_M[0] / 2
   for player in self.race.players:
    # Check if player is touching the edge of the track
-   x = player.position[0]
-   hit = False
-   if x - car_half_width < track_edge[0]:
-    x = track_edge[0] + car_half_width
-    hit = True
-   elif x + car_half_width > track_edge[1]:
-    x = track_edge[1] - car_half_width
-    hit = True
-   if hit:
+   x = max(-max_x, min(player.position[0], max_x))
+   if x != player.position[0]:
     player.position[0] = x
     player.velocity[0] = 0
     player.velocity[1] *= Mechanics.CAR_VELOCITY_DAMPEN_TRACK_EDGE
@@ -754,23 +800,26 @@ class Mechanics:
  # Returns a 2d bounding box for a player in 'track space', which is conceptually
  #   an infinitely long line whose origin is at the start of the race.
  def _get_bounding_box(self, player):
-  pos = player.position
   hx = Mechanics.CAR_SIZE_M[X] / 2.0
   hz = Mechanics.CAR_SIZE_M[Z] / 2.0
-  cx = pos[0]
-  cz = pos[1] * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
+  cx = player.position[0]
+  cz = player.position[1] * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
   return ((cx - hx, cz - hz), (cx + hx, cz + hz))
 
+ def _get_bounding_boxes(self):
+  return [self._get_bounding_box(player) for player in self.race.players]
+
 class Intelligence:
  class PlayerState:
   OVERTAKING_DISTANCE_M = 6
   LATERAL_SHUFFLE_MS = Mechanics.CAR_VELOCITY_MAX_MS[0] * 0.4
+  INITIAL_AGGRESSION = 0.9
 
   def __init__(self, race, player):
    self.race = race
    self.player = player
    self.target_x = player.position[0]
-   self.aggression = 0.9
+   self.aggression = Intelligence.PlayerState.INITIAL_AGGRESSION
    self.evaluate_count = 0
    self.think(player, player)
 
@@ -789,79 +838,42 @@ class Intelligence:
     self.evaluate_count = random.randrange(60) + 60
 
   def _apply_forward_acceleration(self):
-   target_velocity = self._calculate_target_velocity()
-   actual_velocity = self.player.velocity[1]
-   acceleration_factor = 1 if target_velocity > actual_velocity else -Mechanics.CAR_DECELERATION_FACTOR
+   acceleration_factor = 1 if self._calculate_target_velocity() > self.player.velocity[1] else -Mechanics.CAR_DECELERATION_FACTOR
    self.player.acceleration[1] = Mechanics.CAR_ACCELERATION_MSS[1] * acceleration_factor
 
   def _apply_lateral_velocity(self):
-   target_x = self.target_x
-   actual_x = self.player.position[0]
-   difference = target_x - actual_x
-   if abs(difference) > 0.1:
-    shuffle_factor = Intelligence.PlayerState.LATERAL_SHUFFLE_MS
-    if difference < 0:
-     shuffle_factor = -shuffle_factor
-   else:
-    shuffle_factor = 0
-   self.player.velocity[0] = shuffle_factor
+   difference = self.target_x - self.player.position[0]
+   shuffle_factor = Intelligence.PlayerState.LATERAL_SHUFFLE_MS if abs(difference) > 0.1 else 0
+   self.player.velocity[0] = -shuffle_factor if difference < 0 else shuffle_factor
 
   def _calculate_target_velocity(self):
    track = self.race.track_def.track
-   track_length = len(track)
-
-   position = self.player.position[1]
-   track_index = int(position)
-   track1 = track[track_index % track_length]
-   track2 = track[(track_index + Intelligence.TRACK_LOOK_AHEAD) % track_length]
-
-   track_angle = Math.get_angle_between_orientations(track1.orientation, track2.orientation)
-   target_velocity = Mechanics.CAR_VELOCITY_MAX_MS[1] * math.cos(min(abs(track_angle) * 1.4, 1)) * self.aggression
-   return target_velocity
+   i = int(self.player.position[1])
+   track_angle = Math.get_angle_between_orientations(track[i % len(track)].orientation, track[(i + Intelligence.TRACK_LOOK_AHEAD) % len(track)].orientation)
+   return Mechanics.CAR_VELOCITY_MAX_MS[1] * math.cos(min(abs(track_angle) * 1.4, 1)) * self.aggression
 
   def _calculate_relative_positions(self, player_ahead, player_behind):
    track_length = len(self.race.track_def.track)
+   position = self.player.position[1]
 
    # See how close we are to the car in front and the car behind
-   distance_to_player = int(player_ahead.position[1] - self.player.position[1])
-   distance_to_player %= track_length
-   distance_to_player *= TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
-   self.close_to_player_ahead = (distance_to_player <= Intelligence.PlayerState.OVERTAKING_DISTANCE_M)
-
-   # Make sure that we have cleared the car behind before making a manoeuvre
-   distance_to_player = int(self.player.position[1] - player_behind.position[1])
-   distance_to_player %= track_length
-   distance_to_player *= TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
-   self.close_to_player_behind = (distance_to_player <= Mechanics.CAR_SIZE_M[Z] * 2)
+   self.close_to_player_ahead = (int(player_ahead.position[1] - position) % track_length * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M <= Intelligence.PlayerState.OVERTAKING_DISTANCE_M)
+   self.close_to_player_behind = (int(position - player_behind.position[1]) % track_length * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M <= Mechanics.CAR_SIZE_M[Z] * 2)
 
   def _consider_overtaking(self, player_ahead, player_behind):
    self.overtaking = None
 
-   # Only consider overtaking if we are travelling faster than the player ahead of us
-   if self.player.velocity[1] <= player_ahead.velocity[1]:
-    return
-
-   # Make sure that we are close enough to the car ahead to consider overtaking
-   if not self.close_to_player_ahead:
-    return
-
-   # Make sure that we have cleared the car behind before making a manoeuvre
-   if self.close_to_player_behind:
+   # Only overtake a slower car that we are close to, once we have cleared the car behind
+   if self.player.velocity[1] <= player_ahead.velocity[1] or not self.close_to_player_ahead or self.close_to_player_behind:
     return
 
    # We are going to position ourselves for overtaking
    self.overtaking = player_ahead
-
    opponent_x = player_ahead.position[0]
-   car_double_width = 2 * Mechanics.CAR_SIZE_M[X]
    if opponent_x >= 0:
-    target_x = opponent_x - car_double_width
-    if target_x < self.target_x:
-     self.target_x = target_x
+    self.target_x = min(self.target_x, opponent_x - 2 * Mechanics.CAR_SIZE_M[X])
    else:
-    target_x = opponent_x + car_double_width
-    if target_x > self.target_x:
-     self.target_x = target_x
+    self.target_x = max(self.target_x, opponent_x + 2 * Mechanics.CAR_SIZE_M[X])
 
  # The number of track segments to look ahead to determine the appropriate velocity
  TRACK_LOOK_AHEAD = 10
@@ -870,30 +882,17 @@ class Intelligence:
   self.race = race
   self.player_states = [Intelligence.PlayerState(race, player) for player in race.players]
 
- def process_players(self):
-  track_length = len(self.race.track_def.track)
+  self.autopilot = False
 
-  # Create a list of players sorted by their position on the track, rather than their position in the race.
-  # If all are on the same lap, this is the same thing, but otherwise it will be different.
-  # This is necessary for players to work out who is physically in front or behind of them.
-  players = []
-  i = 0
-  for player in self.race.players:
-   players.append([player.position[1] - track_length * self.race.get_player_lap(player), i, player])
-   i += 1
-  sorted_players = Sort.quick_sort(players)
-
-  i = 0
+ def process_players(self):
+  sorted_players = self.race.track_players
   l = len(sorted_players)
-  while i < l:
-   sorted_player = sorted_players[i]
-   player_index = sorted_player[Race.SORTED_PLAYER_INDEX]
-   if player_index != Player.HUMAN:
-    player_state = self.player_states[player_index]
+  for i in range(l):
+   player_index = sorted_players[i][Race.SORTED_PLAYER_INDEX]
+   if player_index != Player.HUMAN or self.autopilot:
     player_ahead = sorted_players[(i + 1) % l][Race.SORTED_PLAYER_PLAYER]
     player_behind = sorted_players[(i - 1) % l][Race.SORTED_PLAYER_PLAYER]
-    player_state.think(player_ahead, player_behind)
-   i += 1
+    self.player_states[player_index].think(player_ahead, player_behind)
 
 class Race:
  STARTING_GRID_SPACE_M = 1.2
@@ -909,35 +908,39 @@ class Race:
 
   self.players = players
   self.sorted_players = []
+  self.track_players = []
   self.track_def = track_def
   self.track_objects = [None] * len(track_def.track)
-  self._dynamic_sprites = []
+  self.dynamic_track_objects = [[] for segment in track_def.track]
+  self._dynamic_track_indices = []
+  self._sprite_pool = []
+  self._sprites_used = 0
   self._create_track_objects()
   self._init_players()
   self._sort_players()
+  self._previous_positions = [list(player.position) for player in players]
+  self._current_positions = [list(player.position) for player in players]
   self.mechanics = Mechanics(self)
   self.intelligence = Intelligence(self)
 
  # Initialise the players and position them on the starting grid
  def _init_players(self):
-  offset = (TrackDef.TRACK_SIZE_M[X] / 4.0, -Race.STARTING_GRID_SPACE_M / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M)
-  x = (-offset[0], offset[0])
-  z = offset[1]
-
-  i = 0
-  player_indices = range(Player.COMPUTER, len(self.players))
+  x = TrackDef.TRACK_SIZE_M[X] / 4.0
+  dz = -Race.STARTING_GRID_SPACE_M / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
+  player_indices = list(range(Player.COMPUTER, len(self.players)))
   random.shuffle(player_indices)
 
   # Ensure that the player starts at the rear of the grid
   player_indices.append(Player.HUMAN)
-  for player_index in player_indices:
-   player = self.players[player_index]
+  z = 0
+  for i in range(len(player_indices)):
+   z += dz
+   player = self.players[player_indices[i]]
    player.reset()
-   player.position[0] = x[i % 2]
+   player.position[0] = x if i % 2 else -x
    player.position[1] = z
-   self.sorted_players.append([-z, player_index, player])
-   i += 1
-   z += offset[1]
+   self.sorted_players.append([-z, player_indices[i], player])
+  self.track_players = [[0, i, self.players[i]] for i in range(len(self.players))]
 
  # Returns the 'lap' that a player is on
  def get_player_lap(self, player):
@@ -946,8 +949,7 @@ class Race:
  # Returns the position in the race of the specified player
  def get_player_position(self, player_index):
   for i in range(len(self.sorted_players)):
-   sorted_player = self.sorted_players[i]
-   if sorted_player[Race.SORTED_PLAYER_INDEX] == player_index:
+   if self.sorted_players[i][Race.SORTED_PLAYER_INDEX] == player_index:
     return i + 1
   return 0
 
@@ -966,74 +968,61 @@ class Race:
 
   # Create Starting Banner
   height = 2
-  image_name = IMG_BANNER
-  image_size = IMAGES[image_name][1]
-  self._create_track_object(0, (0, height / 2, 0), (track_width, height), image_name)
+  self._create_track_object(0, (0, height / 2, 0), (track_width, height), IMG_BANNER)
 
-  i = 0
-  for segment in self.track_def.track:
+  for i in range(len(self.track_def.track)):
    if random.randrange(4) == 0:
-    tree = random.randrange(6)
-    image_name = IMG_TREE + tree
+    image_name = IMG_TREE + random.randrange(6)
     image_size = IMAGES[image_name][1]
     x = random.random() * 5 + track_edge
-    y = image_size[1] / 2
     z = random.random()
-    if random.randrange(2) == 0:
-     x = -x
-    self._create_track_object(i, (x, y, z), image_size, image_name, True)
-   i += 1
+    self._create_track_object(i, (-x if random.randrange(2) == 0 else x, image_size[1] / 2, z), image_size, image_name, True)
 
  # Sorts the sorted_players list to reflect the relative positions of the players.
+ # It also sorts the track_players list, which orders the players by their position on the track, rather than their
+ #   position in the race. If all are on the same lap, this is the same thing, but otherwise it will be different.
+ #   This is necessary for players to work out who is physically in front or behind of them.
  def _sort_players(self):
   for sorted_player in self.sorted_players:
    sorted_player[Race.SORTED_PLAYER_POSITION] = -sorted_player[Race.SORTED_PLAYER_PLAYER].position[1]
-  self.sorted_players = Sort.quick_sort(self.sorted_players)
+  Sort.insertion_sort(self.sorted_players)
+
+  track_length = len(self.track_def.track)
+  for track_player in self.track_players:
+   player = track_player[Race.SORTED_PLAYER_PLAYER]
+   track_player[Race.SORTED_PLAYER_POSITION] = player.position[1] - track_length * self.get_player_lap(player)
+  Sort.insertion_sort(self.track_players)
 
  # Inserts a track object (a sprite associated with a particular position on the track)
  # The Sprite's position and orientation is relative to the track_position with which it is associated.
  def _create_track_object(self, track_position, position, size, image, absolute_y = False):
-  track = self.track_def.track
+  track_index, world_pos, orientation = self.get_world_position(track_position, position, absolute_y)
+  # Start a new sprite bucket if no sprites have been assigned to this track_position yet
+  self.track_objects[track_index] = (self.track_objects[track_index] or []) + [Sprite(world_pos, size, Sprite.ORIENTATION_BILLBOARD, image)]
 
-  # Find the section of track with which this sprite will be associated
+ # Returns the index of the track segment at track_position, the world coordinates of a position relative to the
+ #   track there, and the orientation of the track there
+ def get_world_position(self, track_position, position, absolute_y = False):
+  track = self.track_def.track
   track_index = int(track_position)
-  modular_track_index = track_index % len(track)
-  track1 = track[modular_track_index]
+  track1 = track[track_index % len(track)]
   track2 = track[(track_index + 1) % len(track)]
 
   # If track_position specifies a position between two segments of track, we need to
   #   interpolate the centre point and orientation
   t = track_position - track_index
   o1 = track1.orientation
-  o2 = track2.orientation
-  orientation = Math.interpolate(t, o1, o1 + Math.get_angle_between_orientations(o1, o2))
-  centre = []
-  for a in range(3):
-   centre.append(Math.interpolate(t, track1.position[a], track2.position[a]))
+  orientation = Math.interpolate(t, o1, o1 + Math.get_angle_between_orientations(o1, track2.orientation))
+  centre = [Math.interpolate(t, track1.position[a], track2.position[a]) for a in range(3)]
 
-  # Calculate world coordinates for the sprite, based on the centre of the track and the supplied coordinates
+  # Rotate the local coordinates according to the track segment's orientation
   sine = math.sin(orientation)
   cosine = math.cos(orientation)
+  x = position[X] * cosine + position[Z] * sine + centre[X]
+  z = position[Z] * cosine - position[X] * sine + centre[Z]
+  return (track_index % len(track), (x, position[Y] + (0 if absolute_y else centre[Y]), z), orientation)
 
-  # Rotate the local coordinates according to the track segment's orientation
-  px = position[X] * cosine + position[Z] * sine
-  pz = position[Z] * cosine - position[X] * sine
-  world_pos = (px + centre[X], position[Y] + (centre[Y] if not absolute_y else 0), pz + centre[Z])
-  sprite = Sprite(world_pos, size, Sprite.ORIENTATION_BILLBOARD, image)
-
-  # Check if sprites have already been assigned to this track_position
-  sprite_bucket = self.track_objects[modular_track_index]
-  if sprite_bucket != None:
-   sprite_bucket.append(sprite)
-  else:
-   # Otherwise, start a new sprite bucket
-   sprite_bucket = [sprite]
-   self.track_objects[modular_track_index] = sprite_bucket
-
-  # Return the bucket in which the sprite was added together with the index
-  return (sprite_bucket, len(sprite_bucket) - 1)
-
- # Inserts sprites representing the players into the track_objects dictionary
+ # Inserts sprites representing the players into the dynamic_track_objects layer
  def add_player_sprites(self):
   # Calculate where the car appears above the track
   y = TrackDef.TRACK_SIZE_M[Y] / 2.0 + Mechanics.CAR_SIZE_M[Y] / 2.0
@@ -1043,21 +1032,51 @@ class Race:
    frame = int(player.position[1] * 8) % 4
    self.add_dynamic_sprite(track_position, pos, Mechanics.CAR_SIZE_M, IMG_CAR + frame)
 
- # Registers a dynamic sprite that will be associated with a part of the track and which can be removed at the end of the frame
+ # Adds a sprite, from a pool, to the dynamic_track_objects for this frame only
  def add_dynamic_sprite(self, track_position, position, size, image):
-  self._dynamic_sprites.append(self._create_track_object(track_position, position, size, image))
+  track_index, world_pos, orientation = self.get_world_position(track_position, position)
+  if self._sprites_used == len(self._sprite_pool):
+   self._sprite_pool.append(Sprite(None, None, Sprite.ORIENTATION_BILLBOARD, None))
+  sprite = self._sprite_pool[self._sprites_used]
+  self._sprites_used += 1
+  sprite.position, sprite.size, sprite.image = world_pos, size, image
+  sprite_bucket = self.dynamic_track_objects[track_index]
+  if not sprite_bucket:
+   self._dynamic_track_indices.append(track_index)
+  sprite_bucket.append(sprite)
 
- # Removes sprites representing dynamic objects that were inserted just for this frame
  def remove_dynamic_sprites(self):
-  i = len(self._dynamic_sprites) - 1
-  while i >= 0:
-   sprite_bucket_info = self._dynamic_sprites[i]
-   sprite_bucket_info[0].pop(sprite_bucket_info[1])
-   i -= 1
-  self._dynamic_sprites = []
+  for track_index in self._dynamic_track_indices:
+   del self.dynamic_track_objects[track_index][:]
+  del self._dynamic_track_indices[:]
+  self._sprites_used = 0
+
+ # Moves the players part of the way (0 <= t <= 1) through the last tick, until restore_player_positions()
+ def interpolate_player_positions(self, t):
+  for i in range(len(self.players)):
+   position = self.players[i].position
+   previous = self._previous_positions[i]
+   current = self._current_positions[i]
+   current[:] = position
+   for a in range(2):
+    position[a] = previous[a] + (current[a] - previous[a]) * t
+
+ def restore_player_positions(self):
+  for i in range(len(self.players)):
+   self.players[i].position[:] = self._current_positions[i]
+
+ def _save_player_positions(self):
+  for i in range(len(self.players)):
+   self._previous_positions[i][:] = self.players[i].position
+
+ def show_replay_tick(self, replay, tick):
+  replay.apply(tick, self.players)
+  self._save_player_positions()
+  self._sort_players()
 
  # Process a slice of time in the race
  def process_tick(self, delta):
+  self._save_player_positions()
   m = self.mechanics
   m.apply_force()
   m.move_players(delta)
@@ -1078,22 +1097,8 @@ class Renderer:
  NEAR_PLANE_M = 0.1
  FAR_PLANE_M = 200
 
- # Projects a 3d view-space coordinate into a 2d canvas coordinate
- # This routine is included as a reference, but is not used in the game.
- # Instead, see the method below it.
- def view_to_canvas_slow(pos):
-  distance = pos[Z] + Renderer.NEAR_PLANE_M
-  x = pos[X] / distance
-  y = -pos[Y] / distance
-  x *= Renderer.SCALE_WIDTH
-  y *= Renderer.SCALE_HEIGHT
-  x += Renderer.CANVAS_HALF_WIDTH
-  y += Renderer.CANVAS_HALF_HEIGHT
-  return (x, y)
-
- # Projects a 3d view-space coordinate into a 2d canvas coordinate
- # This is the optimised version of the view_to_canvas method.
- # It runs about twice as quickly as the 'readable' version.
+ # Projects a 3d view-space coordinate into a 2d canvas coordinate, which is
+ #   ((x / (z + NEAR_PLANE_M)) * SCALE_WIDTH + CANVAS_HALF_WIDTH, (-y / (z + NEAR_PLANE_M)) * SCALE_HEIGHT + CANVAS_HALF_HEIGHT)
  def view_to_canvas(pos):
   distance = pos[2] + 0.1
   return (400.0 * (pos[0] / distance + 1), 300.0 * (-pos[1] / distance + 1))
@@ -1111,11 +1116,13 @@ class FPSRenderer(Renderer):
  def __init__(self, time_counter):
   self.time_counter = time_counter
 
- def render_fps(self, canvas):
+ def render_fps(self, canvas, race_renderer = None):
   delta = self.time_counter.get_average_time()
   if delta > 0:
-   fps = 1.0 / delta
-   canvas.draw_text("FPS: " + str(int(round(fps))), (10, Renderer.CANVAS_HEIGHT - 10), 15, "#fff", FONT_STYLE)
+   message = "FPS: " + str(int(round(1.0 / delta)))
+   if race_renderer != None:
+    message += "   Culled: " + str(race_renderer.culled_sprites)
+   canvas.draw_text(message, (10, Renderer.CANVAS_HEIGHT - 10), 15, "#fff", FONT_STYLE)
 
 class RaceRenderer(Renderer):
  class Message:
@@ -1132,17 +1139,36 @@ class RaceRenderer(Renderer):
  COLOUR_ROSTER_PLAYER = "#ff0"
  COLOUR_VELOCITY = "#ff0"
 
- def __init__(self, image_manager, race):
+ def __init__(self, image_manager, race, profiler = None):
   self.camera = Camera()
   self.image_manager = image_manager
+  self.sprite_cache = image_manager.sprite_cache
   self.race = race
+  self.profiler = profiler or Profiler()
   self.render_depth = RaceRenderer.TRACK_RENDER_MIN_DEPTH
   self.message = None
+  self.culled_sprites = 0
+  self.track_render_time = 0
+  self.images_pending = True
+  self.culler = TrackCuller(race.track_def.track, race.track_objects, Renderer.NEAR_PLANE_M, Renderer.FAR_PLANE_M) if TrackCuller else None
+
+ # Position the camera behind a player's car, facing along the track
+ def follow_player(self, player):
+  race = self.race
+  track = race.track_def.track
+  z = RaceRenderer.CAMERA_DISTANCE_BEHIND_PLAYER_M + player.velocity[1] / Game.FPS
+  position = (player.position[0], RaceRenderer.CAMERA_HEIGHT_ABOVE_TRACK_M, -z)
+  track_index, position, yaw = race.get_world_position(race.get_player_track_position(player), position)
+
+  # Tilt and re-position the camera when going up and down hills
+  ydiff = track[(track_index + 1) % len(track)].position[Y] - track[track_index].position[Y]
+  c = self.camera
+  c.set_yaw(yaw)
+  c.set_pitch(ydiff * math.pi / 2)
+  c.position[:] = (position[X], position[Y] - ydiff * 5, position[Z])
 
  def get_camera_track_position(self):
-  track_position = self.race.get_player_track_position(self.race.players[Player.HUMAN])
-  track_position -= RaceRenderer.CAMERA_DISTANCE_BEHIND_PLAYER_M / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
-  return track_position
+  return self.race.get_player_track_position(self.race.players[Player.HUMAN]) - RaceRenderer.CAMERA_DISTANCE_BEHIND_PLAYER_M / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
 
  def _get_track(self):
   return self.race.track_def.track
@@ -1170,108 +1196,102 @@ class RaceRenderer(Renderer):
   hy = horizon_cv[Y]
 
   # Draw Sky
-  # The Sky image is 4480x360 pixels. The first 3200 are a panorama, then the first 1280 pixels are repeated.
-  # Only 800 pixels ought to be repeated, but in order for the rolling effect to work, an additional margin is required.
-  # The roll_factor is maximum amount of extra space needed in the upper margins when rolling.
-  # Messy, but empirically ok when camera is pitching too. The original image height was 300, but 60 additional pixels added for margin.
-  roll_factor = 1.7
-  image = self.image_manager.images[IMG_BACKDROP]
+  # The Sky image is 4480x360 pixels: a 3200 pixel panorama, then its first 1280 pixels again, which is 480 more than
+  #   the canvas needs, as a margin for rolling. The 1.7 is the most extra space needed above it when rolling, which
+  #   is empirically ok when pitching too. 60 pixels were added to the original height of 300 as a margin.
   iw = 3200.0
   ih = 360.0
-  if ih > 0:
-   angle = (c.yaw + math.pi / 4.0)
-   if c.yaw - abs(c.roll) < 0:
-    angle += 2.0 * math.pi
-   margin = abs(c.sine_roll) * ih * 2.0
-   sp = (iw * angle / (math.pi * 2.0), ih / 2.0)
-   ss = (iw / 4.0 + margin, ih)
-   dih = ih * roll_factor
-   dp = (Renderer.CANVAS_HALF_WIDTH, hy - dih / 2.0)
-   ds = (ss[ 0 ], dih)
-   dp = self._canvas_to_roll(dp)
-   canvas.draw_image(image, sp, ss, dp, ds, c.roll)
-
- def _render_sprite(self, canvas, sprite):
-  view_pos = self.camera.world_to_view(sprite.position)
-  if (view_pos[Z] < Renderer.NEAR_PLANE_M) or (view_pos[Z] >= Renderer.FAR_PLANE_M):
-   return
-
-  centre = Renderer.view_to_canvas(view_pos)
-
-  sprite_orientation = sprite.orientation
-  if (sprite_orientation != Sprite.ORIENTATION_BILLBOARD):
-   rotation = sprite_orientation - self.camera.yaw
-   apparent_width = abs(sprite.size[X] * math.cos(rotation)) + abs(sprite.size[Z] * math.sin(rotation))
-  else:
-   apparent_width = sprite.size[X]
-
-  horizontal_extent = Renderer.view_to_canvas((view_pos[X] - apparent_width / 2.0, view_pos[Y], view_pos[Z]))[X]
-  vertical_extent = Renderer.view_to_canvas((view_pos[X], view_pos[Y] + sprite.size[Y] / 2.0, view_pos[Z]))[Y]
-  width = (centre[X] - horizontal_extent) * 2.0
-  height = (centre[Y] - vertical_extent) * 2.0
-
-  # Rotate the centre point around the centre of the screen to simulate the roll effect
-  centre = self._canvas_to_roll(centre)
-
-  image = self.image_manager.images[sprite.image]
-  image_size = (image.get_width(), image.get_height())
-  if image_size[0] != 0:
-   # Prevent images that didn't load from causing a crash
-   image_centre = (image_size[0] / 2.0, image_size[1] / 2.0)
-   canvas.draw_image(image, image_centre, image_size, centre, (width, height), self.camera.roll)
-
- # Render the track
- def _render_track(self, canvas):
+  angle = c.yaw + math.pi / 4.0
+  if c.yaw - abs(c.roll) < 0:
+   angle += 2.0 * math.pi
+  ss = (iw / 4.0 + abs(c.sine_roll) * ih * 2.0, ih)
+  dp = self._canvas_to_roll((Renderer.CANVAS_HALF_WIDTH, hy - ih * 1.7 / 2.0))
+  canvas.draw_image(self.image_manager.images[IMG_BACKDROP], (iw * angle / (math.pi * 2.0), ih / 2.0), ss, dp, (ss[0], ih * 1.7), c.roll)
+
+ def _get_visible_sprites(self):
   track = self._get_track()
   track_objects = self.race.track_objects
+  dynamic_track_objects = self.race.dynamic_track_objects
   track_length = len(track)
   length = max(min(self.render_depth, track_length), RaceRenderer.TRACK_RENDER_MIN_DEPTH)
   track_position = int(self.get_camera_track_position()) - 1
+  culler = self.culler
+  if culler != None:
+   culler.start_frame(self.camera)
+  culled = 0
+  sprites = []
   for i in range(length):
    pos = (track_position + length - i) % track_length
-   self._render_sprite(canvas, track[pos].sprite)
-
-   sprite_bucket = track_objects[pos]
-   if sprite_bucket != None:
-    for sprite in sprite_bucket:
-     self._render_sprite(canvas, sprite)
-
+   sprite_bucket = track_objects[pos] or []
+   if culler == None or culler.is_visible(pos):
+    sprites.append(track[pos].sprite)
+    sprites.extend(sprite_bucket)
+   else:
+    culled += 1 + len(sprite_bucket)
+   sprites.extend(dynamic_track_objects[pos])
   self.render_depth = length
+  self.culled_sprites = culled
+  return sprites
+
+ # Render the track. Projecting each sprite inlines world_to_view(), view_to_canvas() and _canvas_to_roll() for speed.
+ def _render_track(self, canvas):
+  start_time = get_time()
+  if self.images_pending:
+   self.images_pending = (self.image_manager.get_number_of_pending_images() > 0)
+  c = self.camera
+  cx, cy, cz = c.position
+  sy, ky, sp, kp, sr, kr = c.sine_yaw, c.cosine_yaw, c.sine_pitch, c.cosine_pitch, c.sine_roll, c.cosine_roll
+  far = Renderer.FAR_PLANE_M
+  sources = self.image_manager.sources
+  for sprite in self._get_visible_sprites():
+   # Prevent images that didn't load from causing a crash
+   source = sources[sprite.image]
+   if source == None:
+    continue
+
+   pos = sprite.position
+   vbx = pos[0] - cx
+   vby = pos[1] - cy
+   vbz = pos[2] - cz
+   vbx, vbz = vbx * ky - vbz * sy, vbx * sy + vbz * ky
+   if c.pitch != 0:
+    vby, vbz = vby * kp - vbz * sp, vby * sp + vbz * kp
+   if vbz < 0.1 or vbz >= far:
+    continue
+
+   size = sprite.size
+   width = size[X]
+   if sprite.orientation != Sprite.ORIENTATION_BILLBOARD:
+    so = sprite.sine_orientation
+    ko = sprite.cosine_orientation
+    width = abs(width * (ko * ky + so * sy)) + abs(size[Z] * (so * ky - ko * sy))
+
+   scale = 1.0 / (vbz + 0.1)
+   tx = 400.0 * vbx * scale
+   ty = -300.0 * vby * scale
+   size = (400.0 * width * scale, 300.0 * size[Y] * scale)
+   if self.sprite_cache != None:
+    source = self.sprite_cache.get_source(sprite.image, source, size)
+   canvas.draw_image(source[0], source[1], source[2], (tx * kr - ty * sr + 400.0, tx * sr + ty * kr + 300.0), size, c.roll)
+  self.track_render_time = get_time() - start_time
 
  # Render the roster of players
  def _render_player_roster(self, canvas):
   race = self.race
-  x = 32
-  xname = 56
   y = 50
-  yd = 28
-
-  height = yd * (len(race.players) + 0.5)
-
-  rect = Math.rect(x - 12, y - yd, 320, height)
   colour = 'rgba(0,0,0,0.5)'
-  canvas.draw_polygon(rect, 1, colour, colour)
+  canvas.draw_polygon(Math.rect(20, 22, 320, 28 * (len(race.players) + 0.5)), 1, colour, colour)
 
-  position = 1
-  total_laps = race.track_def.laps
   for i in range(len(race.sorted_players)):
-   sorted_player = race.sorted_players[i]
-   player = sorted_player[Race.SORTED_PLAYER_PLAYER]
-   lap = race.get_player_lap(player)
-   message = str(position) + " - " + player.name + " - Lap " + str(lap) + " of " + str(total_laps)
+   position, index, player = race.sorted_players[i]
+   message = str(i + 1) + " - " + player.name + " - Lap " + str(race.get_player_lap(player)) + " of " + str(race.track_def.laps)
    if i > 0:
-    previous_player = race.sorted_players[i - 1][Race.SORTED_PLAYER_PLAYER]
-    difference = previous_player.position[1] - player.position[1]
-    difference_metres = difference * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
-    message += " - " + str(round(difference_metres, 1)) + "m"
-
-   index = sorted_player[Race.SORTED_PLAYER_INDEX]
+    message += " - " + str(round((race.sorted_players[i - 1][Race.SORTED_PLAYER_PLAYER].position[1] - player.position[1]) * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M, 1)) + "m"
    colour = RaceRenderer.COLOUR_ROSTER_PLAYER if index == Player.HUMAN else RaceRenderer.COLOUR_ROSTER
-   canvas.draw_text(message, (xname, y), 16, colour, FONT_STYLE)
+   canvas.draw_text(message, (56, y), 16, colour, FONT_STYLE)
    if index < IMG_LOGO:
-    Renderer.render_image(canvas, self.image_manager.images[IMG_HEAD + index], (x, y - 20))
-   y += yd
-   position += 1
+    Renderer.render_image(canvas, self.image_manager.images[IMG_HEAD + index], (32, y - 20))
+   y += 28
 
  # Render the Player's position and speed
  def _render_player_status(self, canvas):
@@ -1291,15 +1311,20 @@ class RaceRenderer(Renderer):
 
  # Render the race
  def render(self, canvas):
+  profiler = self.profiler
   self._render_background(canvas)
+  profiler.end_phase('Sky')
   self._render_track(canvas)
+  profiler.end_phase('Track')
   self._render_player_roster(canvas)
   self._render_player_status(canvas)
   self._render_message(canvas)
+  profiler.end_phase('Status')
 
 class MiniMapRenderer(Renderer):
  COLOUR_TRACK = "#000"
  COLOUR_PLAYER = "#f00"
+ RECT = (Renderer.CANVAS_WIDTH * 0.8, Renderer.CANVAS_HEIGHT * 0.2, Renderer.CANVAS_WIDTH * 0.3, Renderer.CANVAS_HEIGHT * 0.3)
 
  def __init__(self, race, rect):
   bbox = race.track_def.bounding_box
@@ -1312,7 +1337,7 @@ class MiniMapRenderer(Renderer):
 
  def _calculate_track(self):
   control_points = self.race.track_def.control_points
-  lines_per_def = max(6, 80 / len(control_points))
+  lines_per_def = max(6, 80 // len(control_points))
   self.points = []
   for cp in control_points:
    for j in range(lines_per_def):
@@ -1320,25 +1345,19 @@ class MiniMapRenderer(Renderer):
   self.points.append(self.points[0])
 
  def _project(self, point):
-  x = self.origin[0] + (point[X] - self.track_centre[X]) * self.scale
-  y = self.origin[1] - (point[Z] - self.track_centre[Z]) * self.scale
-  return (x, y)
+  return (self.origin[0] + (point[X] - self.track_centre[X]) * self.scale, self.origin[1] - (point[Z] - self.track_centre[Z]) * self.scale)
 
  def render(self, canvas):
   canvas.draw_polyline(self.points, 8, MiniMapRenderer.COLOUR_TRACK)
 
   race = self.race
   track = race.track_def.track
-  index = 1
-  for sorted_player in self.race.sorted_players:
-   player = sorted_player[Race.SORTED_PLAYER_PLAYER]
-   player_position = self.race.get_player_track_position(player) % len(track)
-   pos = self._project(track[int(player_position)].position)
-
-   colour = RaceRenderer.COLOUR_ROSTER_PLAYER if sorted_player[Race.SORTED_PLAYER_INDEX] == Player.HUMAN else RaceRenderer.COLOUR_ROSTER
+  for i in range(len(race.sorted_players)):
+   position, index, player = race.sorted_players[i]
+   pos = self._project(track[int(race.get_player_track_position(player) % len(track))].position)
+   colour = RaceRenderer.COLOUR_ROSTER_PLAYER if index == Player.HUMAN else RaceRenderer.COLOUR_ROSTER
    canvas.draw_circle(pos, 3, 1, MiniMapRenderer.COLOUR_PLAYER, colour)
-   canvas.draw_text(str(index), (pos[0] - 4, pos[1] - 8), 14, colour, FONT_STYLE)
-   index += 1
+   canvas.draw_text(str(i + 1), (pos[0] - 4, pos[1] - 8), 14, colour, FONT_STYLE)
 
 class TrackOverviewRenderer(Renderer):
  COLOUR_TRACK_BASE = "#4a4a19"
@@ -1353,9 +1372,11 @@ class TrackOverviewRenderer(Renderer):
   self.camera.set_pitch(-math.pi * 45  / 180)
   self.points = None
 
-  bb = self.track_def.bounding_box.box
+  self.preview = (track_def.track == None)
+  self.bounding_box = track_def.get_bounding_box()
+  bb = self.bounding_box.box
   self.radius = max(bb[1][X] - bb[0][X], bb[1][Z] - bb[0][Z]) + 20
-  self.track_centre = self.track_def.bounding_box.get_centre()
+  self.track_centre = self.bounding_box.get_centre()
   self.camera.position[Y] = self.radius
   self.set_track_rotation(0)
   self._calculate_track()
@@ -1370,12 +1391,13 @@ class TrackOverviewRenderer(Renderer):
   self._render_base(canvas)
   self._render_track(canvas)
 
- def _render_base(self, canvas):
-  track_offset = TrackOverviewRenderer.TRACK_POSITION
-  bb = self.track_def.bounding_box
-  box = bb.box
-  c = bb.get_centre()
+ def _project(self, p):
+  vp = Renderer.view_to_canvas(self.camera.world_to_view(p))
+  return (vp[0] + TrackOverviewRenderer.TRACK_POSITION[0], vp[1] + TrackOverviewRenderer.TRACK_POSITION[1])
 
+ def _render_base(self, canvas):
+  box = self.bounding_box.box
+  c = self.track_centre
   ts = 15 + TrackOverviewRenderer.TRACK_HALF_WIDTH
   y = box[0][Y] - c[Y]
   x1 = box[0][X] - c[X] - ts
@@ -1383,58 +1405,32 @@ class TrackOverviewRenderer(Renderer):
   x2 = box[1][X] - c[X] + ts
   z2 = box[1][Z] - c[Z] + ts
 
-  w = []
-  w.append((x1, y, z1))
-  w.append((x2, y, z1))
-  w.append((x2, y, z2))
-  w.append((x1, y, z2))
-
-  v = []
-  for p in w:
-   vp = Renderer.view_to_canvas(self.camera.world_to_view(p))
-   vp = (vp[0] + track_offset[0], vp[1] + track_offset[1])
-   v.append(vp)
-  v.append(v[0])
+  v = [self._project(p) for p in ((x1, y, z1), (x2, y, z1), (x2, y, z2), (x1, y, z2), (x1, y, z1))]
   canvas.draw_polygon(v, 3, TrackOverviewRenderer.COLOUR_TRACK_BASE_OUTLINE, TrackOverviewRenderer.COLOUR_TRACK_BASE)
 
  def _calculate_track(self):
   control_points = self.track_def.control_points
-  lines_per_def = max(6, 80 / len(control_points))
+  lines_per_def = max(6, 80 // len(control_points))
 
+  # Both edges of the track, relative to its centre
   self.points = [[], []]
+  c = self.track_centre
   for cp in control_points:
    for j in range(lines_per_def):
     t = float(j) / lines_per_def
-    p = self._calculate_track_points(cp.curve, t)
-    for e in range(2):
-     self.points[e].append(p[e])
-
- def _calculate_track_points(self, curve, t):
-  p = curve.calculate_point(t)
-  p[X] -= self.track_centre[X]
-  p[Y] -= self.track_centre[Y]
-  p[Z] -= self.track_centre[Z]
-  v = Math.normalise(curve.calculate_tangent(t))
-  v[0] *= TrackOverviewRenderer.TRACK_HALF_WIDTH
-  v[2] *= TrackOverviewRenderer.TRACK_HALF_WIDTH
-  return ((p[X] - v[Z], p[Y], p[Z] + v[X]), (p[X] + v[Z], p[Y], p[Z] - v[X]))
+    x, y, z = [a - b for a, b in zip(cp.curve.calculate_point(t), c)]
+    v = [a * TrackOverviewRenderer.TRACK_HALF_WIDTH for a in Math.normalise(cp.curve.calculate_tangent(t))]
+    self.points[0].append((x - v[Z], y, z + v[X]))
+    self.points[1].append((x + v[Z], y, z - v[X]))
 
  def _render_track(self, canvas):
-  camera = self.camera
-  track_offset = TrackOverviewRenderer.TRACK_POSITION
-
   start_line = []
 
   # Draw both edges of the track
   for e in range(2):
-   points = []
-   for p in self.points[e]:
-    vp = Renderer.view_to_canvas(camera.world_to_view(p))
-    vp = (vp[0] + track_offset[0], vp[1] + track_offset[1])
-    points.append(vp)
-   start_point = points[0]
-   points.append(start_point)
-   start_line.append(start_point)
+   points = [self._project(p) for p in self.points[e]]
+   points.append(points[0])
+   start_line.append(points[0])
    canvas.draw_polyline(points, 2, TrackOverviewRenderer.COLOUR_TRACK)
 
   # Draw Start / Finish Line
@@ -1461,6 +1457,10 @@ class IntroRenderer(Renderer):
  def render(self, canvas):
   Renderer.render_image(canvas, self.image_manager.images[IMG_LOGO], (Renderer.CANVAS_HALF_WIDTH - 230, 16))
   if self.track:
+   ready = (self.track.track != None)
+   if ready and self._track_renderer.preview:
+    self._track_renderer = TrackOverviewRenderer(self.track)
+
    rect = Math.rect(40, Renderer.CANVAS_HALF_HEIGHT + 70, Renderer.CANVAS_WIDTH - 80, Renderer.CANVAS_HALF_HEIGHT - 120)
    canvas.draw_polygon(rect, 4, IntroRenderer.COLOUR_PANEL_EDGE, IntroRenderer.COLOUR_PANEL)
 
@@ -1469,68 +1469,41 @@ class IntroRenderer(Renderer):
 
    Renderer.render_shadow_text(canvas, "Choose Track with LEFT and RIGHT", (Renderer.CANVAS_HALF_WIDTH - 155, Renderer.CANVAS_HALF_HEIGHT + 50), 18, IntroRenderer.COLOUR_TEXT_ADVICE)
 
-   x1 = 70
-   x2 = 190
    y = Renderer.CANVAS_HALF_HEIGHT + 125
-   Renderer.render_shadow_text(canvas, "Track:", (x1, y), 22, IntroRenderer.COLOUR_TEXT_LABEL)
-   Renderer.render_shadow_text(canvas, self.track.name, (x2, y), 22, IntroRenderer.COLOUR_TEXT_VALUE)
-
-   y += 40
-   laps = str(self.track.laps)
-   Renderer.render_shadow_text(canvas, "Laps:", (x1, y), 22, IntroRenderer.COLOUR_TEXT_LABEL)
-   Renderer.render_shadow_text(canvas, laps, (x2, y), 22, IntroRenderer.COLOUR_TEXT_VALUE)
-
-   y += 40
-   distance = str(int(round(self.track.get_length_m()))) + " metres"
-   Renderer.render_shadow_text(canvas, "Distance:", (x1, y), 22, IntroRenderer.COLOUR_TEXT_LABEL)
-   Renderer.render_shadow_text(canvas, distance, (x2, y), 22, IntroRenderer.COLOUR_TEXT_VALUE)
+   distance = str(int(round(self.track.get_length_m()))) + " metres" if ready else "Building..."
+   for label, value in (("Track:", self.track.name), ("Laps:", str(self.track.laps)), ("Distance:", distance)):
+    Renderer.render_shadow_text(canvas, label, (70, y), 22, IntroRenderer.COLOUR_TEXT_LABEL)
+    Renderer.render_shadow_text(canvas, value, (190, y), 22, IntroRenderer.COLOUR_TEXT_VALUE)
+    y += 40
 
    pending_images = self.image_manager.get_number_of_pending_images()
-   ready = (pending_images == 0)
-   message = "Press SPACE to RACE!" if ready else "Waiting for " + str(pending_images) + " images"
+   if pending_images > 0:
+    ready = False
+    message = "Waiting for " + str(pending_images) + " images"
+   else:
+    message = "Press SPACE to RACE!" if ready else "Building track..."
    colour = IntroRenderer.COLOUR_TEXT_ADVICE if ready else IntroRenderer.COLOUR_TEXT_LOADING
    Renderer.render_shadow_text(canvas, message, (Renderer.CANVAS_HALF_WIDTH - 100, Renderer.CANVAS_HEIGHT - 18), 18, colour)
 
-   Renderer.render_shadow_text(canvas, Game.VERSION, (Renderer.CANVAS_WIDTH - 130, 15), 13, IntroRenderer.COLOUR_TEXT_LABEL)
-   Renderer.render_shadow_text(canvas, "'A' = Toggle Music", (Renderer.CANVAS_WIDTH - 124, Renderer.CANVAS_HEIGHT - 25), 14, IntroRenderer.COLOUR_TEXT_ADVICE)
-   Renderer.render_shadow_text(canvas, "'S' = Toggle SFX", (Renderer.CANVAS_WIDTH - 124, Renderer.CANVAS_HEIGHT - 10), 14, IntroRenderer.COLOUR_TEXT_ADVICE)
-
-class BuildTracksRenderer(Renderer):
- COLOUR_BACKGROUND = "#333"
-
- def __init__(self, game):
-  self.game = game
-  self.track_index = 0
-  self.log = []
-
- def render(self, canvas):
-  track_defs = self.game.track_defs
-  if self.track_index < len(track_defs):
-   track_def = track_defs[self.track_index];
-   start_time = time.time()
-   track_def.create_track()
-   finish_time = time.time()
-   self.log.append('Building track "' + track_def.name + '" ... ' + str(round(finish_time - start_time, 2)) + ' seconds')
-   self.track_index += 1
-
-   y = 50
-   for line in self.log:
-    canvas.draw_text(line, (50, y), 18, '#0a0', FONT_STYLE)
-    y += 24
-  else:
-   self.game.show_introduction()
+   w = Renderer.CANVAS_WIDTH
+   h = Renderer.CANVAS_HEIGHT
+   advice = IntroRenderer.COLOUR_TEXT_ADVICE
+   for text, position, size, colour in ((Game.VERSION, (w - 130, 15), 13, IntroRenderer.COLOUR_TEXT_LABEL), ("'A' = Toggle Music", (w - 124, h - 25), 14, advice), ("'S' = Toggle SFX", (w - 124, h - 10), 14, advice)):
+    Renderer.render_shadow_text(canvas, text, position, size, colour)
 
 class Key:
- UP = simplegui.KEY_MAP['up']
- DOWN = simplegui.KEY_MAP['down']
- LEFT = simplegui.KEY_MAP['left']
- RIGHT = simplegui.KEY_MAP['right']
- SPACE = simplegui.KEY_MAP['space']
- MAP = simplegui.KEY_MAP['m']
- SFX = simplegui.KEY_MAP['s']
- MUSIC = simplegui.KEY_MAP['a']
  ESCAPE = 27
 
+ def set_key_map(key_map):
+  keys = [key_map[name] for name in ('up', 'down', 'left', 'right', 'space', 'm', 's', 'a', 'p', 'r')]
+  Key.UP, Key.DOWN, Key.LEFT, Key.RIGHT, Key.SPACE, Key.MAP, Key.SFX, Key.MUSIC, Key.PROFILE, Key.REPLAY = keys
+
+# Everything is drawn, loaded and played through the backend, which must be set before the Game is created
+def set_backend(new_backend):
+ global backend
+ backend = new_backend
+ Key.set_key_map(new_backend.KEY_MAP)
+
 class Game:
  VERSION = 'v1.4 11th July 2013'
 
@@ -1538,183 +1511,156 @@ class Game:
  STATE_PRE_RACE = 2
  STATE_RACE = 3
  STATE_POST_RACE = 4
- STATE_BUILD_TRACKS = 5
+ STATE_REPLAY = 5
 
  PRE_RACE_HEIGHT_M = 15
  PRE_RACE_DELAY_S = 3.5
+ REPLAY_SKIP_S = 5
 
  FPS = 60
+ SIMULATION_STEP_S = 1.0 / FPS
+ MAX_FRAME_TIME_S = 0.25          # Longer frames (e.g. when the browser was in the background) aren't caught up
 
  def __init__(self):
-  self.state = Game.STATE_BUILD_TRACKS
-  self.frame = simplegui.create_frame("Power Drift", Renderer.CANVAS_WIDTH, Renderer.CANVAS_HEIGHT)
+  self.state = None
+  self.frame = backend.create_frame("Power Drift", Renderer.CANVAS_WIDTH, Renderer.CANVAS_HEIGHT)
   self.frame.set_draw_handler(self.on_render)
   self.frame.set_keydown_handler(self.on_keydown)
   self.frame.set_keyup_handler(self.on_keyup)
-  self.frame.set_canvas_background(BuildTracksRenderer.COLOUR_BACKGROUND)
   self.frame.start()
 
   self.time_counter = TimeCounter()
   self.image_manager = ImageManager()
-  self.music_manager = MusicManager(self.time_counter)
-  self.engine_manager = EngineManager(self.time_counter)
-  self.players = []
-  self.track_defs = []
+  self.audio_scheduler = AudioScheduler()
+  self.music_manager = MusicManager(self.audio_scheduler)
+  self.engine_manager = EngineManager(self.audio_scheduler)
+  self.players = [Player(name) for name in PLAYERS]
+  self.track_defs = Game._define_tracks()
+  self.track_builder = (CachingTrackBuilder or TrackBuilder)(self.track_defs)
   self.active_keys = {}
-  self._build_tracks_renderer = BuildTracksRenderer(self)
   self._intro_renderer = IntroRenderer(self.image_manager)
   self._fps_renderer = FPSRenderer(self.time_counter)
+  self.profiler = Profiler()
+  self._show_profile = False
   self._race_renderer = None
   self._map_renderer = None
   self._show_map = True
-  self._define_players()
-  self._define_tracks()
-
- # Define Players
- def _define_players(self):
-  for name in PLAYERS:
-   self.players.append(Player(name))
+  self._last_track_def = None
+  self.show_introduction()
 
  # Define Track
- # A Track is defined as a list of control points and their tangent vectors.
- def _define_tracks(self):
-  t = TrackDef('Infinity', 3)
-  t.add(ControlPoint((7, 0, -84), (5, 0, 20)))
-  t.add(ControlPoint((21, 0, -13), (5, 0, 35)))
-  t.add(ControlPoint((13, 0, 0), (-20, 0, 0)))
-  t.add(ControlPoint((4, 0, -13), (0, 0, -20)))
-  t.add(ControlPoint((8, 0, -26), (10, 0, -25)))
-  t.add(ControlPoint((14, 7, -52), (5, -2, -25)))
-  t.add(ControlPoint((17, 3, -64), (5, 3, -25)))
-  t.add(ControlPoint((22, 9, -79), (5, -2, -15)))
-  t.add(ControlPoint((27, 0, -100), (2, 0, -10), IMG_SAND))
-  t.add(ControlPoint((28, 0, -115), (0, 0, -30)))
-  t.add(ControlPoint((16, 0, -140), (-30, 0, 0)))
-  t.add(ControlPoint((4, 0, -115), (0, 0, 30)))
-  self.track_defs.append(t)
-
-  t = TrackDef('Orion', 4)
+ # A Track is defined as a list of control points, each with its coordinates, its tangent vector and optionally the
+ #   image of the track that follows it.
+ def _define_tracks():
   m = 40
-  t.add(ControlPoint((0, 0, 20), (0, 0, m)))
-  t.add(ControlPoint((20, 0, 40), (m, 0, 0), IMG_SAND))
-  t.add(ControlPoint((40, 0, 20), (0, 0, -m), IMG_GRAVEL))
-  t.add(ControlPoint((20, 0, 0), (-m, 0, 0)))
-  t.add(ControlPoint((0, 4, 0), (-m, 0, 0)))
-  t.add(ControlPoint((-20, 0, 0), (-m, 0, 0)))
-  t.add(ControlPoint((-40, 0, -20), (0, 0, -m), IMG_SAND))
-  t.add(ControlPoint((-20, 0, -40), (m, 0, 0), IMG_GRAVEL))
-  t.add(ControlPoint((0, 0, -20), (0, 0, m)))
-  self.track_defs.append(t)
-
-  t = TrackDef('Saddle', 3)
-  t.add(ControlPoint((107, 0, 37), (0, 0, -30)))
-  t.add(ControlPoint((91, 0, 13), (-30, 0, 0)))
-  t.add(ControlPoint((75, 0, 27), (-8, 0, 15), IMG_SAND))
-  t.add(ControlPoint((57, 0, 39), (-30, 0, 0)))
-  t.add(ControlPoint((39, 0, 27), (-8, 0, -15), IMG_GRAVEL))
-  t.add(ControlPoint((23, 0, 13), (-30, 0, 0)))
-  t.add(ControlPoint((7, 2, 37), (0, 10, 30)))
-  t.add(ControlPoint((7, 5, 45), (0, 3, 10)))
-  t.add(ControlPoint((7, 3, 52), (0, -3, 10)))
-  t.add(ControlPoint((7, 5, 63), (0, 10, 10)))
-  t.add(ControlPoint((23, 0, 87), (30, 0, 0)))
-  t.add(ControlPoint((39, 0, 73), (8, 0, -15), IMG_SAND))
-  t.add(ControlPoint((57, 0, 61), (30, 0, 0)))
-  t.add(ControlPoint((75, 0, 73), (8, 0, 15), IMG_GRAVEL))
-  t.add(ControlPoint((91, 0, 87), (30, 0, 0)))
-  t.add(ControlPoint((107, 0, 63), (0, 0, -30)))
-  self.track_defs.append(t)
-
-  t = TrackDef('Tree-Tops', 4)
-  t.add(ControlPoint((74, 0, 16), (12, 0, 10)))
-  t.add(ControlPoint((86, 3, 39), (0, 0, 30)))
-  t.add(ControlPoint((72, 1, 55), (-30, 0, 0)))
-  t.add(ControlPoint((46, 4, 36), (-30, 0, 0)))
-  t.add(ControlPoint((20, 1, 55), (-30, 0, 0)))
-  t.add(ControlPoint((4, 3, 39), (0, 0, -30)))
-  t.add(ControlPoint((18, 0, 16), (12, 0, -10)))
-  t.add(ControlPoint((46, 2, 3), (40, 0, 0)))
-  self.track_defs.append(t)
-
-  t = TrackDef('Oval', 5)
-  t.add(ControlPoint((0, 0, 0), (0, 0, 100)))
-  t.add(ControlPoint((100, 0, 0), (0, 0, -100)))
-  self.track_defs.append(t)
-
-  t = TrackDef('Inside-Out', 3)
-  t.add(ControlPoint((15, 0, 15), (25, 0, -30), IMG_ROCK))
-  t.add(ControlPoint((55, 0, -10), (30, 0, 30)))
-  t.add(ControlPoint((40, 0, 26), (-25, 0, 25)))
-  t.add(ControlPoint((22, 2, 49), (0, 0, 25)))
-  t.add(ControlPoint((35, 3, 65), (25, 0, 0)))
-  t.add(ControlPoint((47, 2, 49), (0, 0, -25)))
-  t.add(ControlPoint((64, 0, 27), (40, 0, 15)))
-  t.add(ControlPoint((43, 0, 84), (-90, 0, 0)))
-  self.track_defs.append(t)
-
-  # Add your own tracks here...
+  tracks = (
+   ('Infinity', 3, (
+    (7, 0, -84, 5, 0, 20), (21, 0, -13, 5, 0, 35),
+    (13, 0, 0, -20, 0, 0), (4, 0, -13, 0, 0, -20),
+    (8, 0, -26, 10, 0, -25), (14, 7, -52, 5, -2, -25),
+    (17, 3, -64, 5, 3, -25), (22, 9, -79, 5, -2, -15),
+    (27, 0, -100, 2, 0, -10, IMG_SAND), (28, 0, -115, 0, 0, -30),
+    (16, 0, -140, -30, 0, 0), (4, 0, -115, 0, 0, 30),
+   )),
+   ('Orion', 4, (
+    (0, 0, 20, 0, 0, m), (20, 0, 40, m, 0, 0, IMG_SAND),
+    (40, 0, 20, 0, 0, -m, IMG_GRAVEL), (20, 0, 0, -m, 0, 0),
+    (0, 4, 0, -m, 0, 0), (-20, 0, 0, -m, 0, 0),
+    (-40, 0, -20, 0, 0, -m, IMG_SAND), (-20, 0, -40, m, 0, 0, IMG_GRAVEL),
+    (0, 0, -20, 0, 0, m),
+   )),
+   ('Saddle', 3, (
+    (107, 0, 37, 0, 0, -30), (91, 0, 13, -30, 0, 0),
+    (75, 0, 27, -8, 0, 15, IMG_SAND), (57, 0, 39, -30, 0, 0),
+    (39, 0, 27, -8, 0, -15, IMG_GRAVEL), (23, 0, 13, -30, 0, 0),
+    (7, 2, 37, 0, 10, 30), (7, 5, 45, 0, 3, 10),
+    (7, 3, 52, 0, -3, 10), (7, 5, 63, 0, 10, 10),
+    (23, 0, 87, 30, 0, 0), (39, 0, 73, 8, 0, -15, IMG_SAND),
+    (57, 0, 61, 30, 0, 0), (75, 0, 73, 8, 0, 15, IMG_GRAVEL),
+    (91, 0, 87, 30, 0, 0), (107, 0, 63, 0, 0, -30),
+   )),
+   ('Tree-Tops', 4, (
+    (74, 0, 16, 12, 0, 10), (86, 3, 39, 0, 0, 30),
+    (72, 1, 55, -30, 0, 0), (46, 4, 36, -30, 0, 0),
+    (20, 1, 55, -30, 0, 0), (4, 3, 39, 0, 0, -30),
+    (18, 0, 16, 12, 0, -10), (46, 2, 3, 40, 0, 0),
+   )),
+   ('Oval', 5, (
+    (0, 0, 0, 0, 0, 100), (100, 0, 0, 0, 0, -100),
+   )),
+   ('Inside-Out', 3, (
+    (15, 0, 15, 25, 0, -30, IMG_ROCK), (55, 0, -10, 30, 0, 30),
+    (40, 0, 26, -25, 0, 25), (22, 2, 49, 0, 0, 25),
+    (35, 3, 65, 25, 0, 0), (47, 2, 49, 0, 0, -25),
+    (64, 0, 27, 40, 0, 15), (43, 0, 84, -90, 0, 0),
+   )),
+   # Add your own tracks here...
+  )
+
+  track_defs = []
+  for name, laps, control_points in tracks:
+   t = TrackDef(name, laps)
+   for cp in control_points:
+    t.add(ControlPoint(cp[0 : 3], cp[3 : 6], cp[6] if len(cp) > 6 else None))
+   track_defs.append(t)
+  return track_defs
 
  # Apply the player's input to their car's acceleration
  def _apply_input(self):
   acc = self.players[Player.HUMAN].acceleration
   car_acc = Mechanics.CAR_ACCELERATION_MSS
-  acc[0] = (car_acc[0] if self.is_key_pressed(Key.RIGHT) else 0) + (-car_acc[0] if self.is_key_pressed(Key.LEFT) else 0)
-  acc[1] = (car_acc[1] if self.is_key_pressed(Key.UP) else 0) + (-car_acc[1] if self.is_key_pressed(Key.DOWN) else 0)
+  acc[0] = car_acc[0] * (self.is_key_pressed(Key.RIGHT) - self.is_key_pressed(Key.LEFT))
+  acc[1] = car_acc[1] * (self.is_key_pressed(Key.UP) - self.is_key_pressed(Key.DOWN))
 
  def _calculate_roll(self):
-  desired_roll = 0
-  strength = 0
-
   # Adjust roll based on player's applied horizontal acceleration and their forward velocity
   player = self.players[Player.HUMAN]
-  acc = player.acceleration[0]
-  if acc != 0:
-   acc /= -Mechanics.CAR_ACCELERATION_MSS[0]
-   vel = player.velocity[1] / Mechanics.CAR_VELOCITY_MAX_MS[1]
-   strength = acc * vel
-   desired_roll = strength * math.pi / 6
+  strength = (player.acceleration[0] / -Mechanics.CAR_ACCELERATION_MSS[0]) * (player.velocity[1] / Mechanics.CAR_VELOCITY_MAX_MS[1])
+  desired_roll = strength * math.pi / 6
 
   c = self._race_renderer.camera
-  actual_roll = c.roll
-
-  if actual_roll != desired_roll:
+  if c.roll != desired_roll:
    theta = math.pi / (70 if strength == 0 else 40)
-   if actual_roll < desired_roll:
-    actual_roll = min(actual_roll + theta, desired_roll)
-   else:
-    actual_roll = max(actual_roll - theta, desired_roll)
-   c.set_roll(actual_roll)
+   c.set_roll(min(c.roll + theta, desired_roll) if c.roll < desired_roll else max(c.roll - theta, desired_roll))
 
  def _get_number_suffix(self, number):
-  n = number % 10
-  if n == 1 and number != 11:
-   return 'st'
-  if n == 2 and number != 12:
-   return 'nd'
-  if n == 3 and number != 13:
-   return 'rd'
-  return 'th'
+  return 'th' if number in (11, 12, 13) or number % 10 > 3 else ('th', 'st', 'nd', 'rd')[number % 10]
 
  def is_key_pressed(self, key):
-  return key in self.active_keys and self.active_keys[key] == True
+  return self.active_keys.get(key) == True
 
  def _set_selected_track_index(self, index):
   index %= len(self.track_defs)
   self.selected_track_index = index
   self._intro_renderer.set_track(self.track_defs[index])
 
+  self.track_builder.prefetch((index, index + 1, index - 1))
+
  def start_race(self, track_def):
   self.state = Game.STATE_PRE_RACE
   self.time_counter.reset()
   self.frame.set_canvas_background(RaceRenderer.COLOUR_BACKGROUND)
+  if self.image_manager.sprite_cache != None and track_def != self._last_track_def:
+   self.image_manager.sprite_cache.reset_statistics()
+  self._last_track_def = track_def
   self.race = Race(self.players, track_def)
-  self._race_renderer = RaceRenderer(self.image_manager, self.race)
+  self._race_renderer = RaceRenderer(self.image_manager, self.race, self.profiler)
+  self.depth_controller = RenderDepthController(RaceRenderer.TRACK_RENDER_MIN_DEPTH) if RenderDepthController else None
+  self.time_accumulator = 0
+  self.replay = Replay(track_def.name, [player.name for player in self.players], Game.SIMULATION_STEP_S) if Replay else None
   self._race_renderer.message = RaceRenderer.Message('Use Cursor Keys to Accelerate, Brake and Steer', 150)
-  self._map_renderer = MiniMapRenderer(self.race, (Renderer.CANVAS_WIDTH * 0.8, Renderer.CANVAS_HEIGHT * 0.2, Renderer.CANVAS_WIDTH * 0.3, Renderer.CANVAS_HEIGHT * 0.3))
+  self._map_renderer = MiniMapRenderer(self.race, MiniMapRenderer.RECT)
   self.music_manager.play(MUSIC_START)
 
+ def show_replay(self):
+  self.state = Game.STATE_REPLAY
+  self.replay.playback_time = 0
+  self.time_accumulator = 0
+  self.engine_manager.stop()
+  self._race_renderer.message = RaceRenderer.Message('Replay - LEFT and RIGHT to skip, ESC to race again', 180)
+
  def show_introduction(self):
-  if self.state == Game.STATE_BUILD_TRACKS:
+  if self.state == None:
    self._set_selected_track_index(0)
   self.state = Game.STATE_INTRODUCTION
   self.frame.set_canvas_background(IntroRenderer.COLOUR_BACKGROUND)
@@ -1724,37 +1670,11 @@ class Game:
   self._race_renderer = None
   self._map_renderer = None
 
- # Position the camera behind the player's car, facing along the track
+ # Position the camera behind the player's car. Before the race starts, it descends from above the track.
  def set_camera_position(self):
-  race = self.race
   player = self.players[Player.HUMAN]
-  track = race.track_def.track
-  track_position = race.get_player_track_position(player)
-  track_index = int(track_position)
-  track1 = track[track_index % len(track)]
-  track2 = track[(track_index + 1) % len(track)]
-
-  t = track_position - track_index
-  o1 = track1.orientation
-  o2 = track2.orientation
-
+  self._race_renderer.follow_player(player)
   c = self._race_renderer.camera
-  c.set_yaw(Math.interpolate(t, o1, o1 + Math.get_angle_between_orientations(o1, o2)))
-
-  for a in range(3):
-   c.position[a] = Math.interpolate(t, track1.position[a], track2.position[a])
-
-  # Tilt and re-position the camera when going up and down hills
-  ydiff = track2.position[Y] - track1.position[Y]
-  c.set_pitch(ydiff * math.pi / 2)
-  c.position[Y] += -ydiff * 5
-
-  player_x = player.position[0]
-  player_z = RaceRenderer.CAMERA_DISTANCE_BEHIND_PLAYER_M
-  player_z += player.velocity[1] / Game.FPS
-  c.position[X] += c.cosine_yaw * player_x - c.sine_yaw * player_z
-  c.position[Y] += RaceRenderer.CAMERA_HEIGHT_ABOVE_TRACK_M
-  c.position[Z] -= c.sine_yaw * player_x + c.cosine_yaw * player_z
 
   if self.state == Game.STATE_PRE_RACE:
    delta = self.time_counter.get_total_time() / Game.PRE_RACE_DELAY_S
@@ -1762,11 +1682,8 @@ class Game:
     c.position[Y] += Game.PRE_RACE_HEIGHT_M * (1 - delta)
 
     # Add "Start" sprite
-    track_position = self._race_renderer.get_camera_track_position() + 1
-    x = player.position[X]
-    y = self._race_renderer.camera.position[Y] + 0.2
-    z = 20 * (1 - delta)
-    self.race.add_dynamic_sprite(track_position, (x, y, z), (4.43, 3.07), IMG_START)
+    position = (player.position[X], c.position[Y] + 0.2, 20 * (1 - delta))
+    self.race.add_dynamic_sprite(self._race_renderer.get_camera_track_position() + 1, position, (4.43, 3.07), IMG_START)
    else:
     self.state = Game.STATE_RACE
     self.music_manager.play(MUSIC_RACE + self.selected_track_index % 2)
@@ -1775,50 +1692,78 @@ class Game:
  def process_tick(self):
   self.time_counter.record_time()
   delta = self.time_counter.get_average_time()
-  self.music_manager.process_sound()
+  interval = min(self.time_counter.get_last_interval(), Game.MAX_FRAME_TIME_S)
+  self.audio_scheduler.process()
 
   if self.state != Game.STATE_INTRODUCTION:
    # Adjust render depth to try to maintain a frame rate around 30fps
-   self._race_renderer.render_depth += 1 if delta < 0.031 else -1 if delta > 0.035 else 0
+   rr = self._race_renderer
+   race = self.race
+   if self.depth_controller != None:
+    rr.render_depth = self.depth_controller.update(interval, rr.track_render_time, rr.render_depth, len(race.track_def.track))
+   else:
+    rr.render_depth += 1 if delta < 0.031 else -1 if delta > 0.035 else 0
 
-   if self.state == Game.STATE_RACE or self.state == Game.STATE_POST_RACE:
-    self._apply_input()
+   if self.state == Game.STATE_REPLAY:
+    race.show_replay_tick(self.replay, self.replay.advance(interval))
     self._calculate_roll()
 
-    race = self.race
-    race.process_tick(1.0 / Game.FPS)
+   elif self.state != Game.STATE_PRE_RACE:
+    self._apply_input()
+    recording = (self.state == Game.STATE_RACE and self.replay != None)
+    input_flags = Replay.get_input_flags(self.is_key_pressed, Key) if recording else 0
+
+    # Advance the race in fixed steps, carrying what's left over into the next frame
+    self.time_accumulator += interval
+    while self.time_accumulator >= Game.SIMULATION_STEP_S:
+     self._calculate_roll()
+     race.process_tick(Game.SIMULATION_STEP_S)
+     if recording:
+      self.replay.record(self.players, input_flags)
+     self.time_accumulator -= Game.SIMULATION_STEP_S
 
     self.engine_manager.set_pitch(self.players[Player.HUMAN].velocity[1] / Mechanics.CAR_VELOCITY_MAX_MS[1])
-    self.engine_manager.process_sound()
 
     # Check if race has finished
-    if self.state == Game.STATE_RACE:
-     if race.get_player_lap(self.players[Player.HUMAN]) > race.track_def.laps:
-      final_position = self.race.get_player_position(Player.HUMAN)
-      suffix = self._get_number_suffix(final_position)
-      message = 'You finished ' + str(final_position) + suffix + ' - Press ESC to race again'
-      self.music_manager.play(MUSIC_WIN if final_position == 1 else MUSIC_LOSE)
-      self._race_renderer.message = RaceRenderer.Message(message, 160)
-      self.state = Game.STATE_POST_RACE
+    if self.state == Game.STATE_RACE and race.get_player_lap(self.players[Player.HUMAN]) > race.track_def.laps:
+     final_position = race.get_player_position(Player.HUMAN)
+     message = 'You finished ' + str(final_position) + self._get_number_suffix(final_position) + ' - Press ESC to race again'
+     if self.replay != None:
+      self.replay.save_in_background()
+      message += ' or R to watch the replay'
+     self.music_manager.play(MUSIC_WIN if final_position == 1 else MUSIC_LOSE)
+     rr.message = RaceRenderer.Message(message, 160)
+     self.state = Game.STATE_POST_RACE
   else:
    # Rotate the track 60 degrees per second
    self._intro_renderer.track_rotation += delta * math.pi / 3
+   self.track_builder.process()
 
  def on_render(self, canvas):
+  profiler = self.profiler
+  profiler.start_frame()
+  self.process_tick()
+  profiler.end_phase('Tick')
   if self.state == Game.STATE_INTRODUCTION:
-   self.process_tick()
    self._intro_renderer.render(canvas)
-  elif self.state == Game.STATE_BUILD_TRACKS:
-   self._build_tracks_renderer.render(canvas)
   else:
-   self.process_tick()
-   self.race.add_player_sprites()
+   race = self.race
+   race.interpolate_player_positions(self.time_accumulator / Game.SIMULATION_STEP_S)
+   race.add_player_sprites()
    self.set_camera_position()
+   profiler.end_phase('Sprites')
    self._race_renderer.render(canvas)
+   if self.state == Game.STATE_REPLAY:
+    self.replay.render_input(canvas, (20, Renderer.CANVAS_HEIGHT - 140))
    if self._show_map:
     self._map_renderer.render(canvas)
-   self.race.remove_dynamic_sprites()
-  self._fps_renderer.render_fps(canvas)
+   race.remove_dynamic_sprites()
+   race.restore_player_positions()
+  self._fps_renderer.render_fps(canvas, self._race_renderer)
+  if self._show_profile:
+   profiler.render(canvas, (10, Renderer.CANVAS_HEIGHT - 42), 1.0 / 30)
+  profiler.end_phase('Other')
+  profiler.end_frame()
 
  def on_keydown(self, key):
   self.active_keys[key] = True
@@ -1828,12 +1773,17 @@ class Game:
    elif self.is_key_pressed(Key.RIGHT):
     self._set_selected_track_index(self.selected_track_index + 1)
    elif self.is_key_pressed(Key.SPACE):
-    self.start_race(self.track_defs[self.selected_track_index])
-  elif self.state != Game.STATE_BUILD_TRACKS:
-   if self.is_key_pressed(Key.ESCAPE):
-    self.show_introduction()
+    self.start_race(self.track_builder.build(self.selected_track_index))
+  elif self.is_key_pressed(Key.ESCAPE):
+   self.show_introduction()
+  elif self.state == Game.STATE_REPLAY and key in (Key.LEFT, Key.RIGHT):
+   self.replay.skip(Game.REPLAY_SKIP_S if key == Key.RIGHT else -Game.REPLAY_SKIP_S)
+  elif key == Key.REPLAY and self.state == Game.STATE_POST_RACE and self.replay != None:
+   self.show_replay()
   if self.is_key_pressed(Key.MAP):
    self._show_map = not self._show_map
+  elif self.is_key_pressed(Key.PROFILE):
+   self._show_profile = not self._show_profile
   elif self.is_key_pressed(Key.SFX):
    self.engine_manager.toggle()
   elif self.is_key_pressed(Key.MUSIC):
@@ -1843,4 +1793,6 @@ class Game:
   self.active_keys[key] = False
 
 # Initialisation
-Game()
\ No newline at end of file
+if simplegui:
+ set_backend(simplegui)
+ Game()
\ No newline at end of file
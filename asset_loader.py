@@ -0,0 +1,94 @@
+# Asset Loader
+#
+# Loads assets from the bundled img/, music/ and fx/ directories concurrently, so that the time taken to
+# get ready is that of the slowest asset rather than the sum of them all. Each asset is read and decoded
+# by a function run on a pool of workers, and load() returns a Future for it straight away. A callback
+# can be given, which is called with the Future once the asset has loaded or has finally failed, so
+# that nothing needs to check on the assets every frame. A load that fails is tried again up to RETRIES
+# more times before its Future reports the error.
+#
+# The PNG decoder in atlas.py is pure Python and so holds the GIL while it runs. The workers are
+# therefore processes by default, which decode in parallel on separate cores, and the load functions
+# must be picklable (defined at the top level of a module), as must their results. Threads can be used
+# instead, for functions that spend their time waiting on files.
+#
+# The loader knows nothing about the game, as it is given the function that loads each asset, and is
+# only for use outside CodeSkulptor.
+
+import concurrent.futures
+import os
+import threading
+import time
+
+class AssetLoader:
+ RETRIES = 2
+ RETRY_DELAY_S = 0.05
+
+ def __init__(self, workers = None, processes = True):
+  if processes:
+   self._executor = concurrent.futures.ProcessPoolExecutor(workers)
+  else:
+   self._executor = concurrent.futures.ThreadPoolExecutor(workers or min(32, (os.cpu_count() or 1) + 4))
+  self._ready = threading.Condition()
+  self._futures = []
+  self._pending = 0
+  self.start_time = time.perf_counter()
+  self.ready_time = None
+
+ # Starts loading an asset by calling function(*args) on a worker, and returns a Future for its result
+ def load(self, function, args = (), callback = None):
+  future = self._executor.submit(_load_with_retries, function, args, AssetLoader.RETRIES, AssetLoader.RETRY_DELAY_S)
+  with self._ready:
+   self._futures.append(future)
+   self._pending += 1
+   self.ready_time = None
+  future.add_done_callback(lambda future: self._on_done(future, callback))
+  return future
+
+ def get_number_of_pending_assets(self):
+  return self._pending
+
+ # Waits until every asset has loaded or failed and its callback has been called, and returns False if the timeout
+ #   expired first
+ def wait(self, timeout = None):
+  with self._ready:
+   return self._ready.wait_for(lambda: self._pending == 0, timeout)
+
+ # Returns the number of seconds from the creation of the loader until every asset was loaded, or None if some are still loading
+ def get_ready_time(self):
+  return self.ready_time
+
+ # Returns the Futures of the assets that failed to load
+ def get_failures(self):
+  with self._ready:
+   return [future for future in self._futures if future.done() and future.exception() != None]
+
+ def shutdown(self, wait = True):
+  self._executor.shutdown(wait)
+
+ # An asset only counts as loaded once its callback has been called, since Futures wake their waiters before calling them
+ def _on_done(self, future, callback):
+  try:
+   if callback != None:
+    callback(future)
+  finally:
+   with self._ready:
+    self._pending -= 1
+    if self._pending == 0:
+     self.ready_time = time.perf_counter() - self.start_time
+     self._ready.notify_all()
+
+# Calls function(*args), trying again if it raises an exception. Runs on a worker.
+def _load_with_retries(function, args, retries, retry_delay):
+ for attempt in range(retries + 1):
+  try:
+   return function(*args)
+  except Exception:
+   if attempt == retries:
+    raise
+   time.sleep(retry_delay * (attempt + 1))
+
+# Reads the whole of a file, for assets that don't need decoding
+def read_file(path):
+ with open(path, 'rb') as f:
+  return f.read()
@@ -0,0 +1,191 @@
+# Texture Atlas Builder
+#
+# Packs the sprite images (the track surfaces, the start sign, the banner, the trees and the cars) into
+# a few large sheets, so that the game loads a handful of images instead of one per sprite. The sheets
+# are written to img/ as atlas_1.png, atlas_2.png, etc. and the table that locates each image within
+# them is printed, ready to replace ATLAS_SHEETS and ATLAS_RECTS in PowerDrift.py. The sheets need to
+# be uploaded alongside the other images at IMAGE_BASE before the table is used. Until then, the tables
+# in PowerDrift.py stay empty and the game doesn't use the atlas.
+#
+# Only images that are drawn as sprites are packed. The player heads, the logo and the backdrop are
+# drawn whole, so they are always loaded separately.
+#
+# Reads and writes PNG files itself, so nothing beyond the standard library is needed. Only 8-bit RGB and
+# RGBA images without interlacing are supported, which is what the images in img/ are.
+#
+# Usage: python atlas.py [--size N] [--padding N]
+
+import argparse
+import os
+import struct
+import zlib
+
+from PowerDrift import IMAGES, IMAGE_TYPE, IMG_BANNER, IMG_CAR, IMG_LOG, IMG_START, is_tuple
+
+IMAGE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'img')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# The images that are drawn by RaceRenderer._render_track()
+SPRITE_IMAGES = tuple(range(IMG_LOG, IMG_START + 1)) + tuple(range(IMG_BANNER, IMG_CAR + 4))
+
+# A decoded image, stored as one bytearray of RGBA pixels per row
+class Bitmap:
+ def __init__(self, width, height):
+  self.width = width
+  self.height = height
+  self.rows = [bytearray(width * 4) for y in range(height)]
+
+ def blit(self, bitmap, x, y):
+  for r in range(bitmap.height):
+   self.rows[y + r][x * 4 : (x + bitmap.width) * 4] = bitmap.rows[r]
+
+ def read_png(path):
+  with open(path, 'rb') as f:
+   data = f.read()
+  if data[0 : 8] != PNG_SIGNATURE:
+   raise ValueError(path + ' is not a PNG file')
+  offset = 8
+  idat = []
+  while offset < len(data):
+   length, chunk_type = struct.unpack_from('>I4s', data, offset)
+   chunk = data[offset + 8 : offset + 8 + length]
+   offset += length + 12
+   if chunk_type == b'IHDR':
+    width, height, depth, colour_type, compression, filter_method, interlace = struct.unpack('>IIBBBBB', chunk)
+    if depth != 8 or colour_type not in (2, 6) or interlace != 0:
+     raise ValueError(path + ' is not an 8-bit RGB or RGBA PNG without interlacing')
+    bpp = 4 if colour_type == 6 else 3
+   elif chunk_type == b'IDAT':
+    idat.append(chunk)
+   elif chunk_type == b'IEND':
+    break
+
+  raw = zlib.decompress(b''.join(idat))
+  bitmap = Bitmap(width, height)
+  stride = width * bpp
+  previous = bytearray(stride)
+  for y in range(height):
+   start = y * (stride + 1)
+   row = bytearray(raw[start + 1 : start + 1 + stride])
+   Bitmap._unfilter(raw[start], row, previous, bpp)
+   if bpp == 4:
+    bitmap.rows[y] = row
+   else:
+    # Add an opaque alpha channel
+    rgba = bitmap.rows[y]
+    for c in range(3):
+     rgba[c :: 4] = row[c :: 3]
+    rgba[3 :: 4] = b'\xff' * width
+   previous = row
+  return bitmap
+
+ # Reverses the PNG filter applied to a row of pixels of bpp bytes, in place. See the PNG specification, section 9.
+ def _unfilter(filter_type, row, previous, bpp = 4):
+  stride = len(row)
+  if filter_type == 1:
+   for i in range(bpp, stride):
+    row[i] = (row[i] + row[i - bpp]) & 0xff
+  elif filter_type == 2:
+   for i in range(stride):
+    row[i] = (row[i] + previous[i]) & 0xff
+  elif filter_type == 3:
+   for i in range(stride):
+    left = row[i - bpp] if i >= bpp else 0
+    row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xff
+  elif filter_type == 4:
+   for i in range(stride):
+    if i >= bpp:
+     a = row[i - bpp]
+     c = previous[i - bpp]
+    else:
+     a = c = 0
+    b = previous[i]
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+     predictor = a
+    elif pb <= pc:
+     predictor = b
+    else:
+     predictor = c
+    row[i] = (row[i] + predictor) & 0xff
+  elif filter_type != 0:
+   raise ValueError('Unknown PNG filter type ' + str(filter_type))
+
+ def write_png(self, path):
+  raw = bytearray()
+  for row in self.rows:
+   raw.append(0)
+   raw.extend(row)
+  with open(path, 'wb') as f:
+   f.write(PNG_SIGNATURE)
+   f.write(Bitmap._chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 6, 0, 0, 0)))
+   f.write(Bitmap._chunk(b'IDAT', zlib.compress(bytes(raw), 9)))
+   f.write(Bitmap._chunk(b'IEND', b''))
+
+ def _chunk(chunk_type, data):
+  return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+# Packs rectangles into sheets, in rows ("shelves") of decreasing height.
+# Returns a list of (sheet, x, y) for each of the sizes, and the size of each sheet.
+def pack(sizes, sheet_size, padding):
+ placements = [None] * len(sizes)
+ sheets = []
+ x = y = shelf_height = 0
+ for i in sorted(range(len(sizes)), key = lambda i: (-sizes[i][1], -sizes[i][0])):
+  w = sizes[i][0] + padding
+  h = sizes[i][1] + padding
+  if w > sheet_size or h > sheet_size:
+   raise ValueError('An image is larger than the sheet size')
+  if not sheets or x + w > sheet_size:
+   # Start a new shelf, and a new sheet if the shelf won't fit on the current one
+   y += shelf_height
+   x = shelf_height = 0
+   if not sheets or y + h > sheet_size:
+    sheets.append([0, 0])
+    y = 0
+  placements[i] = (len(sheets) - 1, x, y)
+  x += w
+  shelf_height = max(shelf_height, h)
+  sheet = sheets[-1]
+  sheet[0] = max(sheet[0], x - padding)
+  sheet[1] = max(sheet[1], y + h - padding)
+ return placements, sheets
+
+def get_image_name(index):
+ image_data = IMAGES[index]
+ image_name = image_data[0] if is_tuple(image_data) else image_data
+ return image_name if '.' in image_name else image_name + IMAGE_TYPE
+
+# Builds the atlas and returns the ATLAS_SHEETS and ATLAS_RECTS that describe it
+def build_atlas(images = SPRITE_IMAGES, sheet_size = 2048, padding = 2, directory = IMAGE_DIRECTORY):
+ bitmaps = [Bitmap.read_png(os.path.join(directory, get_image_name(index))) for index in images]
+ placements, sheet_sizes = pack([(b.width, b.height) for b in bitmaps], sheet_size, padding)
+
+ sheets = [Bitmap(size[0], size[1]) for size in sheet_sizes]
+ rects = []
+ for i in range(len(images)):
+  sheet, x, y = placements[i]
+  sheets[sheet].blit(bitmaps[i], x, y)
+  rects.append((images[i], sheet, x, y, bitmaps[i].width, bitmaps[i].height))
+
+ names = []
+ for i in range(len(sheets)):
+  names.append('atlas_' + str(i + 1))
+  sheets[i].write_png(os.path.join(directory, names[-1] + IMAGE_TYPE))
+ return tuple(names), tuple(rects)
+
+def main():
+ parser = argparse.ArgumentParser(description = 'Pack the sprite images into texture atlas sheets.')
+ parser.add_argument('--size', type = int, default = 2048, help = 'maximum width and height of each sheet, in pixels')
+ parser.add_argument('--padding', type = int, default = 2, help = 'transparent pixels between images, to stop them bleeding into each other when scaled')
+ args = parser.parse_args()
+
+ names, rects = build_atlas(sheet_size = args.size, padding = args.padding)
+ print('ATLAS_SHEETS = ' + repr(names))
+ print('ATLAS_RECTS = ' + repr(rects))
+
+if __name__ == '__main__':
+ main()
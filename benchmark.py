@@ -0,0 +1,222 @@
+# Benchmarks
+#
+# Times the routines that the game spends most of its time in, from single calls such as
+# Renderer.view_to_canvas() up to a complete frame rendered without simplegui, so that changes to their
+# performance can be seen rather than guessed at. Each benchmark is run in loops long enough to time
+# reliably, REPEAT times, and the fastest loop is reported as the time per operation, since the slower
+# loops are slower because of other processes rather than the code being measured.
+#
+# The results are written to a JSON file and compared with a stored baseline, and any benchmark that is
+# more than the threshold slower or faster than the baseline is marked. The baseline only means something
+# on the machine where it was recorded, so record a new one with --update-baseline before making changes.
+#
+# Usage: python benchmark.py [--filter TEXT] [--repeat N] [--output FILE] [--baseline FILE]
+#                            [--threshold N] [--update-baseline]
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from PowerDrift import PLAYERS, Camera, Game, HermiteCurve, MiniMapRenderer, Player, RaceRenderer, Renderer
+from command_buffer import CommandBuffer, ImageStubManager
+from headless import HeadlessRace, create_players
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(DIRECTORY, 'benchmark_results.json')
+DEFAULT_BASELINE = os.path.join(DIRECTORY, 'benchmark_baseline.json')
+
+REPEAT = 5
+MIN_LOOP_TIME_S = 0.2       # Each timed loop is made long enough to take at least this long
+DEFAULT_THRESHOLD = 0.1     # Changes smaller than this proportion of the baseline are treated as noise
+FIELD_SIZES = (1, len(PLAYERS), 20, 100)
+VECTORISED_FIELD_SIZES = (len(PLAYERS), 20, 100)
+SEED = 1
+
+# Each benchmark function prepares its data and returns (run, operations), where run() performs the
+#   given number of operations and is the only part that is timed.
+
+def bench_calculate_point():
+ curve = HermiteCurve((0, 0, 0), (40, 5, 60), (80, 0, 0), (0, 0, 80))
+ ts = [i / 100.0 for i in range(101)]
+ def run():
+  for t in ts:
+   curve.calculate_point(t)
+ return run, len(ts)
+
+def bench_create_track(track_def):
+ def run():
+  track_def.create_track()
+ return run, 1
+
+def bench_world_to_view():
+ camera = Camera()
+ camera.position = [10, 1.5, -20]
+ camera.set_yaw(0.7)
+ points = _get_points()
+ def run():
+  for point in points:
+   camera.world_to_view(point)
+ return run, len(points)
+
+def bench_view_to_canvas():
+ points = [(p[0], p[1], abs(p[2]) + 1) for p in _get_points()]
+ def run():
+  for point in points:
+   Renderer.view_to_canvas(point)
+ return run, len(points)
+
+# Runs ticks of a race that is already under way, with the computer driving every car, optionally using NumPy arrays (see
+#   vector_mechanics.py)
+def bench_process_tick(track_def, player_count, vectorised = False):
+ random.seed(SEED)
+ players = create_players(player_count)
+ headless_race = HeadlessRace(track_def, players, vectorised = vectorised)
+ race = headless_race.race
+ delta = headless_race.delta
+ headless_race.run(max_ticks = Game.FPS * 5)
+ def run():
+  for i in range(Game.FPS):
+   race.process_tick(delta)
+ return run, Game.FPS
+
+# Simulates and renders a frame as the game does, into a CommandBuffer instead of a canvas
+def bench_headless_frame(track_def):
+ random.seed(SEED)
+ players = create_players()
+ headless_race = HeadlessRace(track_def, players)
+ race = headless_race.race
+ delta = headless_race.delta
+ headless_race.run(max_ticks = Game.FPS * 5)
+ renderer = RaceRenderer(ImageStubManager(), race)
+ map_renderer = MiniMapRenderer(race, MiniMapRenderer.RECT)
+ buffer = CommandBuffer()
+ def run():
+  race.process_tick(delta)
+  race.add_player_sprites()
+  renderer.follow_player(players[Player.HUMAN])
+  renderer.render(buffer)
+  map_renderer.render(buffer)
+  race.remove_dynamic_sprites()
+  buffer.clear()
+ return run, 1
+
+# Returns a fixed set of points scattered around the camera
+def _get_points():
+ generator = random.Random(SEED)
+ return [(generator.uniform(-100, 100), generator.uniform(0, 10), generator.uniform(-100, 100)) for i in range(1000)]
+
+# Returns a list of (name, function that prepares the benchmark) for every benchmark
+def get_benchmarks():
+ track_defs = Game._define_tracks()
+ track_def = track_defs[0]
+ benchmarks = [
+  ('HermiteCurve.calculate_point', bench_calculate_point),
+  ('Camera.world_to_view', bench_world_to_view),
+  ('Renderer.view_to_canvas', bench_view_to_canvas)
+ ]
+ for t in track_defs:
+  benchmarks.append(('TrackDef.create_track/' + t.name, lambda t = t: bench_create_track(t)))
+ for player_count in FIELD_SIZES:
+  benchmarks.append(('Race.process_tick/' + str(player_count) + ' players', lambda n = player_count: bench_process_tick(track_def, n)))
+ for player_count in VECTORISED_FIELD_SIZES:
+  benchmarks.append(('Race.process_tick/vectorised/' + str(player_count) + ' players', lambda n = player_count: bench_process_tick(track_def, n, True)))
+ benchmarks.append(('Headless frame/' + track_def.name, lambda: bench_headless_frame(track_def)))
+ return benchmarks
+
+# Times a benchmark, and returns the fastest and the median time per operation in seconds
+def measure(prepare, repeat = REPEAT):
+ run, operations = prepare()
+ loops = 1
+ while True:
+  elapsed = _time_loops(run, loops)
+  if elapsed >= MIN_LOOP_TIME_S:
+   break
+  loops *= 2
+ times = sorted([elapsed] + [_time_loops(run, loops) for i in range(repeat - 1)])
+ operations *= loops
+ return times[0] / operations, times[len(times) // 2] / operations
+
+def _time_loops(run, loops):
+ start_time = time.perf_counter()
+ for i in range(loops):
+  run()
+ return time.perf_counter() - start_time
+
+def run_benchmarks(name_filter = None, repeat = REPEAT):
+ results = {}
+ for name, prepare in get_benchmarks():
+  if name_filter == None or name_filter.lower() in name.lower():
+   best, median = measure(prepare, repeat)
+   results[name] = {'seconds': best, 'median_seconds': median}
+ return results
+
+def save_results(results, path):
+ data = {
+  'python': platform.python_implementation() + ' ' + platform.python_version(),
+  'machine': platform.platform(),
+  'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+  'results': results
+ }
+ with open(path, 'w') as f:
+  json.dump(data, f, indent = 1, sort_keys = True)
+
+def load_results(path):
+ with open(path) as f:
+  return json.load(f)['results']
+
+# Returns a list of (name, seconds, baseline seconds or None, change) in the order of results,
+#   where change is 'slower', 'faster' or '' if the difference is within the threshold
+def compare(results, baseline, threshold = DEFAULT_THRESHOLD):
+ rows = []
+ for name in results:
+  seconds = results[name]['seconds']
+  base = baseline[name]['seconds'] if name in baseline else None
+  change = ''
+  if base != None:
+   if seconds > base * (1 + threshold):
+    change = 'slower'
+   elif seconds < base * (1 - threshold):
+    change = 'faster'
+  rows.append((name, seconds, base, change))
+ return rows
+
+def _format_time(seconds):
+ if seconds < 1e-3:
+  return str(round(seconds * 1e6, 3)) + ' us'
+ return str(round(seconds * 1e3, 3)) + ' ms'
+
+def main():
+ parser = argparse.ArgumentParser(description = 'Time the hot paths of the game and compare them with a baseline.')
+ parser.add_argument('--filter', help = 'only run the benchmarks whose names contain this text')
+ parser.add_argument('--repeat', type = int, default = REPEAT, help = 'number of timed loops of each benchmark')
+ parser.add_argument('--output', default = DEFAULT_OUTPUT, help = 'file to write the results to, as JSON')
+ parser.add_argument('--baseline', default = DEFAULT_BASELINE, help = 'results to compare with')
+ parser.add_argument('--threshold', type = float, default = DEFAULT_THRESHOLD, help = 'proportion by which a result must differ from the baseline to be marked')
+ parser.add_argument('--update-baseline', action = 'store_true', help = 'replace the results in the baseline with these ones')
+ args = parser.parse_args()
+
+ results = run_benchmarks(args.filter, max(args.repeat, 1))
+ save_results(results, args.output)
+
+ baseline = load_results(args.baseline) if os.path.isfile(args.baseline) else {}
+ rows = compare(results, baseline, args.threshold)
+ width = max(len(row[0]) for row in rows) if rows else 0
+ for name, seconds, base, change in rows:
+  line = name.ljust(width) + '  ' + _format_time(seconds).rjust(12)
+  if base != None:
+   line += '  ' + ('%+.1f%%' % ((seconds / base - 1) * 100)).rjust(8) + '  ' + change
+  print(line)
+
+ if args.update_baseline:
+  baseline.update(results)
+  save_results(baseline, args.baseline)
+  print('Updated ' + args.baseline)
+ elif any(row[3] == 'slower' for row in rows):
+  sys.exit(1)
+
+if __name__ == '__main__':
+ main()
@@ -0,0 +1,206 @@
+# Draw Command Buffer
+#
+# A stand-in for the simplegui canvas that records the drawing commands issued by the renderers instead
+# of drawing them. A recorded frame can be replayed onto a real canvas, compared with another frame and
+# summarised as FrameStatistics: the number of calls of each command, the number of sprites that
+# RaceRenderer culled, the images that fell entirely outside the canvas and an estimate of overdraw.
+#
+# Run as a script, it renders a race without simplegui, with every car driven by the computer, and
+# reports the statistics of the frames:
+#
+# Usage: python command_buffer.py [--track NAME] [--frames N] [--players N] [--depth N] [--seed N]
+
+import argparse
+import math
+import os
+import random
+import struct
+
+from PowerDrift import IMAGES, IMAGE_TYPE, PLAYERS, MiniMapRenderer, Player, RaceRenderer, Renderer, is_tuple
+from headless import HeadlessRace, create_players, select_tracks
+
+IMAGE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'img')
+
+# The statistics of a single recorded frame
+class FrameStatistics:
+ def __init__(self):
+  self.counts = {}
+  self.culled = 0
+  self.offscreen = 0
+  self.image_pixels = 0.0
+
+ def __str__(self):
+  counts = ', '.join(name + '=' + str(self.counts[name]) for name in sorted(self.counts))
+  return 'Calls: ' + str(self.get_draw_calls()) + ' (' + counts + '), culled: ' + str(self.culled) + ', offscreen: ' + str(self.offscreen) + ', overdraw: ' + str(round(self.get_overdraw(), 2))
+
+ def get_draw_calls(self):
+  return sum(self.counts.values())
+
+ # The number of times that each canvas pixel is covered by an image, on average
+ def get_overdraw(self):
+  return self.image_pixels / (Renderer.CANVAS_WIDTH * Renderer.CANVAS_HEIGHT)
+
+class CommandBuffer:
+ def __init__(self):
+  self.commands = []
+
+ def draw_image(self, image, centre_source, size_source, centre_dest, size_dest, rotation = 0):
+  self.commands.append(('draw_image', (image, centre_source, size_source, centre_dest, size_dest, rotation)))
+
+ def draw_text(self, text, point, font_size, font_color, font_face = 'serif'):
+  self.commands.append(('draw_text', (text, point, font_size, font_color, font_face)))
+
+ def draw_line(self, point1, point2, line_width, line_color):
+  self.commands.append(('draw_line', (point1, point2, line_width, line_color)))
+
+ def draw_polyline(self, point_list, line_width, line_color):
+  self.commands.append(('draw_polyline', (point_list, line_width, line_color)))
+
+ def draw_polygon(self, point_list, line_width, line_color, fill_color = None):
+  self.commands.append(('draw_polygon', (point_list, line_width, line_color, fill_color)))
+
+ def draw_circle(self, center_point, radius, line_width, line_color, fill_color = None):
+  self.commands.append(('draw_circle', (center_point, radius, line_width, line_color, fill_color)))
+
+ def clear(self):
+  del self.commands[:]
+
+ # Issues the recorded commands to another canvas, in the order that they were recorded
+ def replay(self, canvas):
+  for name, args in self.commands:
+   getattr(canvas, name)(*args)
+
+ # Returns True if other recorded the same commands, with coordinates that differ by no more than tolerance
+ def matches(self, other, tolerance = 1e-6):
+  if len(self.commands) != len(other.commands):
+   return False
+  for command, other_command in zip(self.commands, other.commands):
+   if command[0] != other_command[0] or not CommandBuffer._args_match(command[1], other_command[1], tolerance):
+    return False
+  return True
+
+ def _args_match(a, b, tolerance):
+  if isinstance(a, (tuple, list)):
+   return isinstance(b, (tuple, list)) and len(a) == len(b) and all(CommandBuffer._args_match(x, y, tolerance) for x, y in zip(a, b))
+  if isinstance(a, float) or isinstance(b, float):
+   return isinstance(b, (int, float)) and abs(a - b) <= tolerance
+  return a is b or a == b
+
+ # Summarises the recorded commands. culled is the number of sprites that were culled before drawing.
+ def get_statistics(self, culled = 0):
+  stats = FrameStatistics()
+  stats.culled = culled
+  counts = stats.counts
+  for name, args in self.commands:
+   counts[name] = counts.get(name, 0) + 1
+   if name == 'draw_image':
+    pixels = CommandBuffer._get_image_pixels(args[3], args[4], args[5])
+    if pixels > 0:
+     stats.image_pixels += pixels
+    else:
+     stats.offscreen += 1
+  return stats
+
+ # Estimates the number of canvas pixels covered by an image, from the part of its rotated bounding box that is on the canvas
+ def _get_image_pixels(centre, size, rotation):
+  sine = abs(math.sin(rotation))
+  cosine = abs(math.cos(rotation))
+  half_width = (size[0] * cosine + size[1] * sine) / 2.0
+  half_height = (size[0] * sine + size[1] * cosine) / 2.0
+  if half_width <= 0 or half_height <= 0:
+   return 0
+  visible_width = min(centre[0] + half_width, Renderer.CANVAS_WIDTH) - max(centre[0] - half_width, 0)
+  visible_height = min(centre[1] + half_height, Renderer.CANVAS_HEIGHT) - max(centre[1] - half_height, 0)
+  if visible_width <= 0 or visible_height <= 0:
+   return 0
+  return size[0] * size[1] * (visible_width * visible_height) / (4.0 * half_width * half_height)
+
+# An image that has the size of one of the game's images, but no pixels
+class ImageStub:
+ def __init__(self, name, width, height):
+  self.name = name
+  self.width = width
+  self.height = height
+
+ def get_width(self):
+  return self.width
+
+ def get_height(self):
+  return self.height
+
+# A replacement for ImageManager that reads the sizes of the images from img/, for rendering without simplegui
+class ImageStubManager:
+ def __init__(self, directory = IMAGE_DIRECTORY):
+  self.images = []
+  self.sources = []
+  self.sprite_cache = None
+  for image_data in IMAGES:
+   image_name = image_data[0] if is_tuple(image_data) else image_data
+   if '.' not in image_name:
+    image_name += IMAGE_TYPE
+   width, height = ImageStubManager._read_size(os.path.join(directory, image_name))
+   image = ImageStub(image_name, width, height)
+   self.images.append(image)
+   self.sources.append((image, (width / 2.0, height / 2.0), (width, height)) if width != 0 else None)
+
+ def get_number_of_pending_images(self):
+  return 0
+
+ # Returns the size of a PNG image, or (0, 0) for any other type of image
+ def _read_size(path):
+  with open(path, 'rb') as f:
+   header = f.read(24)
+  if header[0 : 8] != b'\x89PNG\r\n\x1a\n':
+   return (0, 0)
+  return struct.unpack('>II', header[16 : 24])
+
+# Renders a race into a CommandBuffer, one frame per tick, and returns the FrameStatistics of every frame
+def record_race(track_def, frames, player_count = len(PLAYERS), render_depth = RaceRenderer.TRACK_RENDER_MIN_DEPTH, image_manager = None):
+ players = create_players(player_count)
+ headless_race = HeadlessRace(track_def, players)
+ race = headless_race.race
+ if image_manager == None:
+  image_manager = ImageStubManager()
+ renderer = RaceRenderer(image_manager, race)
+ renderer.render_depth = render_depth
+ map_renderer = MiniMapRenderer(race, MiniMapRenderer.RECT)
+
+ buffer = CommandBuffer()
+ results = []
+ for frame in range(frames):
+  race.process_tick(headless_race.delta)
+  race.add_player_sprites()
+  renderer.follow_player(players[Player.HUMAN])
+  renderer.render(buffer)
+  map_renderer.render(buffer)
+  race.remove_dynamic_sprites()
+  results.append(buffer.get_statistics(renderer.culled_sprites))
+  buffer.clear()
+ return results
+
+def main():
+ parser = argparse.ArgumentParser(description = 'Render a race without a canvas and report the drawing commands issued each frame.')
+ parser.add_argument('--track', help = 'name of the track to race on (default: all tracks)')
+ parser.add_argument('--frames', type = int, default = 600, help = 'number of frames to render on each track')
+ parser.add_argument('--players', type = int, default = len(PLAYERS), help = 'number of cars in the race')
+ parser.add_argument('--depth', type = int, default = RaceRenderer.TRACK_RENDER_MIN_DEPTH, help = 'number of track segments to render')
+ parser.add_argument('--seed', type = int, help = 'random seed, for reproducible races')
+ args = parser.parse_args()
+
+ track_defs = select_tracks(args.track)
+ if not track_defs:
+  parser.error('unknown track: ' + args.track)
+
+ if args.seed != None:
+  random.seed(args.seed)
+ for track_def in track_defs:
+  results = record_race(track_def, args.frames, args.players, args.depth)
+  count = float(len(results))
+  print(track_def.name + ': ' + str(len(results)) + ' frames')
+  print('  Draw calls per frame: ' + str(round(sum(s.get_draw_calls() for s in results) / count, 1)) + ' (max ' + str(max(s.get_draw_calls() for s in results)) + ')')
+  print('  Culled per frame:     ' + str(round(sum(s.culled for s in results) / count, 1)))
+  print('  Offscreen per frame:  ' + str(round(sum(s.offscreen for s in results) / count, 1)))
+  print('  Overdraw:             ' + str(round(sum(s.get_overdraw() for s in results) / count, 2)) + ' (max ' + str(round(max(s.get_overdraw() for s in results), 2)) + ')')
+
+if __name__ == '__main__':
+ main()
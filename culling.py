@@ -0,0 +1,63 @@
+# Track Culling
+#
+# Divides a track into chunks of CHUNK_SIZE consecutive segments and puts a bounding sphere around the
+# static sprites of each chunk, so that a whole chunk can be skipped when its sphere lies entirely
+# outside the camera's view, before any work is done on its sprites. On twisting tracks, many of the
+# segments within the render depth are behind or beside the camera. The view includes the corners of
+# the canvas that are brought into it when the camera rolls.
+#
+# CodeSkulptor can't import other modules, so there PowerDrift.py draws every segment within the render
+# depth. As PowerDrift.py imports this module, it can't import PowerDrift in return, so it is given the
+# track, its scenery and the near and far planes, and uses the camera's world_to_view().
+
+import math
+
+class TrackCuller:
+ CHUNK_SIZE = 16
+
+ def __init__(self, track, track_objects, near, far):
+  self.near = near
+  self.far = far
+  self.chunks = []
+  for start in range(0, len(track), TrackCuller.CHUNK_SIZE):
+   positions = []
+   sizes = []
+   for pos in range(start, min(start + TrackCuller.CHUNK_SIZE, len(track))):
+    for sprite in [track[pos].sprite] + (track_objects[pos] or []):
+     positions.append(sprite.position)
+     sizes.append(math.sqrt(sum([s * s for s in sprite.size])) / 2.0)
+   centre = [(min(p[a] for p in positions) + max(p[a] for p in positions)) / 2.0 for a in range(3)]
+
+   # The sphere must contain the whole of each sprite, not just its centre
+   radius = 0
+   for i in range(len(positions)):
+    radius = max(radius, math.sqrt(sum([(positions[i][a] - centre[a]) ** 2 for a in range(3)])) + sizes[i])
+   self.chunks.append((centre, radius))
+  self._visible = {}
+
+ # Starts a frame seen from camera, for which the view extends to x = slope_x * distance and y = slope_y * distance,
+ #   widened by the roll. See Renderer.view_to_canvas() for the aspect ratio.
+ def start_frame(self, camera):
+  self.camera = camera
+  self.slope_x = abs(camera.cosine_roll) + 0.75 * abs(camera.sine_roll)
+  self.slope_y = abs(camera.cosine_roll) + abs(camera.sine_roll) / 0.75
+  self._visible = {}
+
+ # Returns whether the chunk containing the track segment at pos may be in view this frame
+ def is_visible(self, pos):
+  chunk = pos // TrackCuller.CHUNK_SIZE
+  if chunk not in self._visible:
+   self._visible[chunk] = not self._is_outside_view(self.chunks[chunk])
+  return self._visible[chunk]
+
+ def _is_outside_view(self, chunk):
+  centre, radius = chunk
+  vx, vy, vz = self.camera.world_to_view(centre)
+  if vz + radius < self.near or vz - radius >= self.far:
+   return True
+  distance = vz + 0.1
+  slope_x = self.slope_x
+  slope_y = self.slope_y
+  if abs(vx) - slope_x * distance > radius * math.sqrt(1 + slope_x * slope_x):
+   return True
+  return abs(vy) - slope_y * distance > radius * math.sqrt(1 + slope_y * slope_y)
@@ -0,0 +1,218 @@
+# Engine Sound Synthesizer
+#
+# Plays the engine sound at any pitch from a single sample, instead of switching between the twelve
+# samples a semitone apart in fx/. The sample is looped and resampled in blocks of BLOCK_SIZE frames
+# with NumPy, using linear interpolation, and the playback rate glides towards the rate for the
+# current pitch, so that the pitch follows the speed of the car smoothly rather than in steps. The
+# blocks are written into a RingBuffer, from which an audio device's callback can read() whenever it
+# needs more.
+#
+# WAV samples are read with the standard library. Other types of file, such as the OGG samples in
+# fx/, need the soundfile package, and can't be read without it.
+#
+# The synthesizer doesn't depend on the game, so that a backend can use it on its own. Only main(),
+# which renders the engine sound of a race driven by the computer into a WAV file, imports PowerDrift.
+#
+# Usage: python engine_synth.py [--sample FILE] [--track NAME] [--seconds N] [--seed N] FILE
+
+import argparse
+import os
+import random
+import wave
+
+import numpy
+
+try:
+ import soundfile
+except ImportError:
+ soundfile = None
+
+SFX_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fx')
+
+# A fixed amount of mono audio, written and read in order
+class RingBuffer:
+ def __init__(self, capacity):
+  self.data = numpy.zeros(capacity, dtype = numpy.float32)
+  self.start = 0
+  self.length = 0
+
+ def get_free_space(self):
+  return len(self.data) - self.length
+
+ def write(self, frames):
+  capacity = len(self.data)
+  count = len(frames)
+  if count > self.get_free_space():
+   raise ValueError('Ring buffer overflow')
+  end = (self.start + self.length) % capacity
+  first = min(count, capacity - end)
+  self.data[end : end + first] = frames[0 : first]
+  self.data[0 : count - first] = frames[first :]
+  self.length += count
+
+ # Returns up to count frames from the start of the buffer
+ def read(self, count):
+  capacity = len(self.data)
+  count = min(count, self.length)
+  first = min(count, capacity - self.start)
+  frames = numpy.concatenate((self.data[self.start : self.start + first], self.data[0 : count - first]))
+  self.start = (self.start + count) % capacity
+  self.length -= count
+  return frames
+
+class EngineSynthesizer:
+ OUTPUT_RATE = 44100
+ BLOCK_SIZE = 512
+ GLIDE_S = 0.05         # The time taken for the playback rate to move most (63%) of the way to a new pitch
+
+ # sample is an array of mono frames at sample_rate, or None if it will be set later, when it has loaded. A pitch of 1
+ #   plays it (intervals - 1) semitones higher than a pitch of 0.
+ def __init__(self, sample = None, sample_rate = OUTPUT_RATE, intervals = 12, output_rate = OUTPUT_RATE):
+  self.intervals = intervals
+  self.output_rate = output_rate
+  self.buffer = RingBuffer(EngineSynthesizer.BLOCK_SIZE)
+  self.phase = 0.0
+  self.pitch = 0
+  self.playing = False
+  self.volume = 1.0
+  self._glide = numpy.exp(-EngineSynthesizer.BLOCK_SIZE / (EngineSynthesizer.GLIDE_S * output_rate))
+  self.set_sample(sample, sample_rate)
+
+ # Replaces the sample, which is silent until it is set
+ def set_sample(self, sample, sample_rate):
+  self.sample = numpy.asarray(sample, dtype = numpy.float32) if sample is not None else None
+  self.sample_rate = sample_rate
+  self.phase = 0.0
+  self.rate = self._get_rate(self.pitch)
+  self.target_rate = self.rate
+
+ # Sets the pitch, between 0 and 1
+ def set_pitch(self, pitch):
+  self.pitch = pitch
+  self.target_rate = self._get_rate(pitch)
+
+ def set_volume(self, volume):
+  self.volume = volume
+
+ def play(self):
+  self.playing = True
+
+ # Stops playing and starts again from the beginning of the sample next time
+ def rewind(self):
+  self.playing = False
+  self.phase = 0.0
+  self.buffer.read(self.buffer.length)
+
+ # Returns the next count frames of sound. A block is only rendered once the last one has been read, so that a
+ #   change of pitch is heard within a block.
+ def read(self, count):
+  if not self.playing:
+   return numpy.zeros(count, dtype = numpy.float32)
+  parts = []
+  while count > 0:
+   if self.buffer.length == 0:
+    self.buffer.write(self.render_block())
+   part = self.buffer.read(count)
+   parts.append(part)
+   count -= len(part)
+  return numpy.concatenate(parts) if parts else numpy.zeros(0, dtype = numpy.float32)
+
+ # Resamples the next block from the sample, moving the playback rate towards the target across the block
+ def render_block(self):
+  n = EngineSynthesizer.BLOCK_SIZE
+  if self.sample is None:
+   return numpy.zeros(n, dtype = numpy.float32)
+  end_rate = self.target_rate + (self.rate - self.target_rate) * self._glide
+  steps = numpy.linspace(self.rate, end_rate, n, endpoint = False)
+  positions = self.phase + numpy.cumsum(steps) - steps[0]
+  length = len(self.sample)
+  self.phase = float(positions[-1] + steps[-1]) % length
+  self.rate = end_rate
+
+  index = numpy.floor(positions)
+  fraction = (positions - index).astype(numpy.float32)
+  index = index.astype(numpy.int64) % length
+  following = (index + 1) % length
+  sample = self.sample
+  return (sample[index] + (sample[following] - sample[index]) * fraction) * self.volume
+
+ # Returns the number of sample frames to step through for each output frame at a pitch
+ def _get_rate(self, pitch):
+  semitones = max(0, min(pitch * self.intervals, self.intervals - 1))
+  return 2.0 ** (semitones / 12.0) * self.sample_rate / self.output_rate
+
+# Returns True if load_sample() can read the file at path
+def can_load(path):
+ return path.lower().endswith('.wav') or soundfile != None
+
+# Reads a sound file and returns (mono frames between -1 and 1, sample rate)
+def load_sample(path):
+ if path.lower().endswith('.wav'):
+  with wave.open(path, 'rb') as f:
+   width = f.getsampwidth()
+   channels = f.getnchannels()
+   rate = f.getframerate()
+   data = f.readframes(f.getnframes())
+  if width == 1:
+   frames = (numpy.frombuffer(data, dtype = numpy.uint8).astype(numpy.float32) - 128) / 128
+  elif width == 2:
+   frames = numpy.frombuffer(data, dtype = '<i2').astype(numpy.float32) / 32768
+  else:
+   raise ValueError(path + ' is not an 8 or 16-bit WAV file')
+ elif soundfile != None:
+  frames, rate = soundfile.read(path, dtype = 'float32')
+  channels = frames.shape[1] if frames.ndim > 1 else 1
+  frames = frames.reshape(-1)
+ else:
+  raise ValueError('Reading ' + path + ' needs the soundfile package')
+ if channels > 1:
+  frames = frames.reshape((-1, channels)).mean(axis = 1)
+ return numpy.ascontiguousarray(frames, dtype = numpy.float32), rate
+
+def save_wav(path, frames, rate):
+ data = (numpy.clip(frames, -1, 1) * 32767).astype('<i2').tobytes()
+ with wave.open(path, 'wb') as f:
+  f.setnchannels(1)
+  f.setsampwidth(2)
+  f.setframerate(rate)
+  f.writeframes(data)
+
+def main():
+ from PowerDrift import EngineManager, Mechanics, Player
+ from headless import HeadlessRace, create_players, select_tracks
+ parser = argparse.ArgumentParser(description = 'Render the engine sound of a race, driven by the computer, into a WAV file.')
+ parser.add_argument('--sample', default = os.path.join(SFX_DIRECTORY, 'engine-1.ogg'), help = 'engine sample at the lowest pitch (default: fx/engine-1.ogg)')
+ parser.add_argument('--track', help = 'name of the track to race on (default: the first track)')
+ parser.add_argument('--seconds', type = float, default = 30, help = 'length of the race to render')
+ parser.add_argument('--seed', type = int, help = 'random seed, for reproducible races')
+ parser.add_argument('file')
+ args = parser.parse_args()
+
+ track_defs = select_tracks(args.track)
+ if not track_defs:
+  parser.error('unknown track: ' + args.track)
+ if not can_load(args.sample):
+  parser.error('reading ' + args.sample + ' needs the soundfile package; try a WAV sample')
+ if args.seed != None:
+  random.seed(args.seed)
+
+ sample, sample_rate = load_sample(args.sample)
+ synthesizer = EngineSynthesizer(sample, sample_rate, intervals = EngineManager.INTERVALS)
+ synthesizer.play()
+ players = create_players()
+ headless_race = HeadlessRace(track_defs[0], players)
+ race = headless_race.race
+ frames_per_tick = synthesizer.output_rate * headless_race.delta
+ blocks = []
+ frames = 0.0
+ for tick in range(int(args.seconds / headless_race.delta)):
+  race.process_tick(headless_race.delta)
+  synthesizer.set_pitch(players[Player.HUMAN].velocity[1] / Mechanics.CAR_VELOCITY_MAX_MS[1])
+  frames += frames_per_tick
+  blocks.append(synthesizer.read(int(frames)))
+  frames -= int(frames)
+ save_wav(args.file, numpy.concatenate(blocks), synthesizer.output_rate)
+ print('Rendered ' + str(args.seconds) + ' seconds of ' + track_defs[0].name + ' to ' + args.file)
+
+if __name__ == '__main__':
+ main()
@@ -0,0 +1,69 @@
+# Frame Times
+#
+# Counts the time taken by every frame in a histogram with BUCKET_S buckets, from which the distribution
+# of the frame times is summarised: the mean, the median, the 95th and 99th percentiles, the longest
+# frame and the number of stutters, which are frames that took more than STUTTER_FACTOR times the
+# median. Unlike the average shown by the FPS counter, the summary covers every frame since the
+# histogram was last reset, so that changes to the frame pacing show up and not just to the average.
+#
+# The game itself keeps no histogram, to keep PowerDrift.py within CodeSkulptor's size limit; whatever
+# draws the frames adds the time of each one, as raster_backend.py does from the start of the race.
+#
+# Only for use outside CodeSkulptor, which can't import other modules.
+
+class FrameTimeHistogram:
+ BUCKET_S = 0.001
+ BUCKETS = 250           # Intervals beyond the last bucket are counted in it
+ STUTTER_FACTOR = 2
+
+ def __init__(self):
+  self.reset()
+
+ def add(self, interval):
+  self.counts[min(int(interval / FrameTimeHistogram.BUCKET_S), FrameTimeHistogram.BUCKETS - 1)] += 1
+  self.count += 1
+  self.total_time += interval
+  self.max_interval = max(self.max_interval, interval)
+
+ # Returns the interval below which the given proportion of the intervals fell, to the resolution of the histogram
+ def get_percentile(self, proportion):
+  if self.count == 0:
+   return 0
+  target = proportion * self.count
+  total = 0
+  for i in range(FrameTimeHistogram.BUCKETS):
+   total += self.counts[i]
+   if total >= target:
+    return min((i + 1) * FrameTimeHistogram.BUCKET_S, self.max_interval)
+  return self.max_interval
+
+ # Returns the number of intervals that took more than STUTTER_FACTOR times the median
+ def get_stutter_count(self):
+  threshold = self.get_percentile(0.5) * FrameTimeHistogram.STUTTER_FACTOR
+  first_bucket = int(threshold / FrameTimeHistogram.BUCKET_S) + 1
+  return sum(self.counts[first_bucket :])
+
+ def get_summary(self):
+  return FrameTimeSummary(self)
+
+ def reset(self):
+  self.counts = [0] * FrameTimeHistogram.BUCKETS
+  self.count = 0
+  self.total_time = 0
+  self.max_interval = 0
+
+# The distribution of the frame times in a histogram
+class FrameTimeSummary:
+ def __init__(self, histogram):
+  self.frames = histogram.count
+  self.mean = histogram.total_time / histogram.count if histogram.count > 0 else 0
+  self.p50 = histogram.get_percentile(0.5)
+  self.p95 = histogram.get_percentile(0.95)
+  self.p99 = histogram.get_percentile(0.99)
+  self.max = histogram.max_interval
+  self.stutters = histogram.get_stutter_count()
+
+ def __str__(self):
+  ms = lambda t: str(round(t * 1000, 1))
+  percentiles = 'p50 ' + ms(self.p50) + 'ms, p95 ' + ms(self.p95) + 'ms, p99 ' + ms(self.p99) + 'ms'
+  return 'All ' + str(self.frames) + ' frames: mean ' + ms(self.mean) + 'ms, ' + percentiles + ' (to the nearest ' + ms(FrameTimeHistogram.BUCKET_S) + 'ms), max ' + ms(self.max) + 'ms, stutters: ' + str(self.stutters)
@@ -0,0 +1,145 @@
+# Headless Race Runner
+#
+# Steps a Race as quickly as the CPU allows, without simplegui or any renderer, so that races can be
+# batch-simulated for balancing and regression checks. Every car, including the human player's, is
+# driven by the computer.
+#
+# Usage: python headless.py [--track NAME] [--races N] [--players N] [--seed N] [--vectorised]
+
+import argparse
+import random
+
+from PowerDrift import PLAYERS, Game, Player, Race, get_time
+
+# The outcome of a single headless race
+class RaceResult:
+ def __init__(self, track_def, players, delta):
+  self.track_def = track_def
+  self.players = players
+  self.delta = delta
+  self.ticks = 0
+  self.elapsed_time = 0
+  self.finish_ticks = [None] * len(players)
+  self.finishing_order = []
+  self.completed = False
+  self.collisions = 0
+  self.position_changes = 0
+
+ def __str__(self):
+  winner = self.players[self.finishing_order[0]].name if self.finishing_order else 'nobody'
+  return self.track_def.name + ': ' + str(self.ticks) + ' ticks in ' + str(round(self.elapsed_time, 3)) + ' seconds (' + str(int(round(self.get_ticks_per_second()))) + ' ticks/s), won by ' + winner
+
+ def get_ticks_per_second(self):
+  if self.elapsed_time > 0:
+   return self.ticks / self.elapsed_time
+  return 0
+
+ # Returns the race time of a player in simulated seconds, or None if they didn't finish
+ def get_finish_time(self, player_index):
+  ticks = self.finish_ticks[player_index]
+  return ticks * self.delta if ticks != None else None
+
+class HeadlessRace:
+ # Give up on a race that hasn't finished after this much simulated time, in case a car gets stuck
+ MAX_RACE_TIME_S = 3600
+
+ # Set vectorised to run each tick on the whole field at once using NumPy arrays (see vector_mechanics.py)
+ def __init__(self, track_def, players, delta = 1.0 / Game.FPS, vectorised = False):
+  if track_def.track == None:
+   track_def.create_track()
+  self.track_def = track_def
+  self.players = players
+  self.delta = delta
+  if vectorised:
+   from vector_mechanics import VectorRace
+   self.race = VectorRace(players, track_def)
+  else:
+   self.race = Race(players, track_def)
+  self.race.intelligence.autopilot = True
+
+ # Step the race until every player has completed all of the laps. If a Replay is supplied, every tick is recorded in it.
+ def run(self, max_ticks = None, replay = None):
+  race = self.race
+  players = self.players
+  laps = self.track_def.laps
+  delta = self.delta
+  if max_ticks == None:
+   max_ticks = int(HeadlessRace.MAX_RACE_TIME_S / delta)
+
+  result = RaceResult(self.track_def, players, delta)
+  finish_ticks = result.finish_ticks
+  finishing_order = result.finishing_order
+  racing = len(players)
+
+  # Count the number of times that a player's place in the race changes
+  sorted_players = race.sorted_players
+  order = [sorted_player[Race.SORTED_PLAYER_INDEX] for sorted_player in sorted_players]
+  position_changes = 0
+
+  tick = 0
+  start_time = get_time()
+  while racing > 0 and tick < max_ticks:
+   race.process_tick(delta)
+   tick += 1
+   if replay != None:
+    replay.record(players)
+   for i in range(len(order)):
+    index = sorted_players[i][Race.SORTED_PLAYER_INDEX]
+    if order[i] != index:
+     order[i] = index
+     position_changes += 1
+   for i in range(len(players)):
+    if finish_ticks[i] == None and race.get_player_lap(players[i]) > laps:
+     finish_ticks[i] = tick
+     finishing_order.append(i)
+     racing -= 1
+  result.elapsed_time = get_time() - start_time
+  result.ticks = tick
+  result.completed = (racing == 0)
+  result.collisions = race.mechanics.collisions
+  result.position_changes = position_changes
+  return result
+
+# Returns the track definitions with the given name, which is a single track or none, or every track if name is None
+def select_tracks(name = None):
+ return [track_def for track_def in Game._define_tracks() if name == None or track_def.name == name]
+
+# Returns player_count new players, named after PLAYERS in turn
+def create_players(player_count = len(PLAYERS)):
+ return [Player(PLAYERS[p % len(PLAYERS)]) for p in range(player_count)]
+
+# Run a number of races on a track and return a list of RaceResults
+def run_races(track_def, races, player_count = len(PLAYERS), seed = None, vectorised = False):
+ if seed != None:
+  random.seed(seed)
+ results = []
+ for i in range(races):
+  players = create_players(player_count)
+  results.append(HeadlessRace(track_def, players, vectorised = vectorised).run())
+ return results
+
+def main():
+ parser = argparse.ArgumentParser(description = 'Run races without a renderer and report the simulation speed.')
+ parser.add_argument('--track', help = 'name of the track to race on (default: all tracks)')
+ parser.add_argument('--races', type = int, default = 1, help = 'number of races per track')
+ parser.add_argument('--players', type = int, default = len(PLAYERS), help = 'number of cars in each race')
+ parser.add_argument('--seed', type = int, help = 'random seed, for reproducible races')
+ parser.add_argument('--vectorised', action = 'store_true', help = 'run each tick on the whole field at once using NumPy arrays')
+ args = parser.parse_args()
+
+ track_defs = select_tracks(args.track)
+ if not track_defs:
+  parser.error('unknown track: ' + args.track)
+
+ total_ticks = 0
+ total_time = 0
+ for track_def in track_defs:
+  for result in run_races(track_def, args.races, args.players, args.seed, args.vectorised):
+   print(result)
+   total_ticks += result.ticks
+   total_time += result.elapsed_time
+ if total_time > 0:
+  print('Total: ' + str(total_ticks) + ' ticks in ' + str(round(total_time, 3)) + ' seconds (' + str(int(round(total_ticks / total_time))) + ' ticks/s)')
+
+if __name__ == '__main__':
+ main()
@@ -0,0 +1,85 @@
+# Frame Profiler
+#
+# Measures how long each phase of a frame takes, and keeps an average of each over the last FRAMES
+# frames. The game calls start_frame() at the start of each frame, end_phase() after each phase, and
+# end_frame() at the end. Each phase costs a single call to the clock, so profiling can always be left
+# running. Pressing P during a race draws the averages as a stacked bar, with a mark at the frame
+# budget.
+#
+# CodeSkulptor can't import other modules, so there PowerDrift.py uses a Profiler that measures nothing
+# instead. This module is imported by PowerDrift, so it can't import PowerDrift in return, and render()
+# is given what it needs to know about the frame.
+
+import time
+
+class Profiler:
+ FRAMES = 30
+ COLOURS = ("#e41a1c", "#377eb8", "#4daf4a", "#984ea3", "#ff7f00", "#ffff33", "#a65628", "#f781bf", "#999")
+ SCALE = 8              # Pixels per millisecond
+ FONT_STYLE = 'sans-serif'
+
+ def __init__(self):
+  self.phases = []
+  self._frame_times = {}
+  self._history = {}
+  self._totals = {}
+  self._index = 0
+  self._frames = 0
+  self._last_time = 0
+
+ def start_frame(self):
+  self._last_time = time.perf_counter()
+
+ # Adds the time since the last phase ended (or the frame started) to the named phase
+ def end_phase(self, name):
+  current_time = time.perf_counter()
+  frame_times = self._frame_times
+  if name in frame_times:
+   frame_times[name] += current_time - self._last_time
+  else:
+   frame_times[name] = current_time - self._last_time
+   self.phases.append(name)
+   self._history[name] = [0] * Profiler.FRAMES
+   self._totals[name] = 0
+  self._last_time = current_time
+
+ def end_frame(self):
+  i = self._index
+  for name in self.phases:
+   history = self._history[name]
+   time_taken = self._frame_times[name]
+   self._totals[name] += time_taken - history[i]
+   history[i] = time_taken
+   self._frame_times[name] = 0
+  self._index = (i + 1) % Profiler.FRAMES
+  self._frames = min(self._frames + 1, Profiler.FRAMES)
+
+ # Returns the average time, in seconds, that the named phase has taken per frame
+ def get_average_time(self, name):
+  if self._frames == 0 or name not in self._totals:
+   return 0
+  return self._totals[name] / self._frames
+
+ # Returns a list of (name, average time) for every phase, in the order that they were first measured
+ def get_average_times(self):
+  return [(name, self.get_average_time(name)) for name in self.phases]
+
+ # Draws the average time of each phase as a stacked bar from position, with a mark at budget seconds
+ def render(self, canvas, position, budget):
+  scale = Profiler.SCALE * 1000
+  x, y = position
+  colours = Profiler.COLOURS
+  i = 0
+  for name, time_taken in self.get_average_times():
+   # Skip phases that aren't part of the current state, such as the introduction during a race
+   if time_taken == 0:
+    continue
+   colour = colours[i % len(colours)]
+   width = time_taken * scale
+   if width >= 1:
+    canvas.draw_polygon([(x, y), (x + width, y), (x + width, y + 10), (x, y + 10)], 1, colour, colour)
+    x += width
+   canvas.draw_text(name + " " + str(round(time_taken * 1000, 1)), (position[0] + i * 66, y - 6), 11, colour, Profiler.FONT_STYLE)
+   i += 1
+  budget_x = position[0] + scale * budget
+  canvas.draw_line((budget_x, y - 2), (budget_x, y + 12), 2, "#fff")
@@ -0,0 +1,174 @@
+# Race Farm
+#
+# Tunes the computer players by racing them against each other thousands of times. Every combination of the
+# parameter values given on the command line is raced on each track, with the races spread across all of the
+# CPU cores by a process pool, and the finishing times, position changes and collisions are averaged into a
+# table with one row per track and combination.
+#
+# Usage: python race_farm.py [--track NAME] [--races N] [--players N] [--workers N] [--seed N] [--csv FILE]
+#                            [--aggression 0.8,0.9] [--overtaking-distance 4,6,8] [--lateral-shuffle 0.4]
+#                            [--look-ahead 10]
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import random
+
+from PowerDrift import PLAYERS, Game, Intelligence, Mechanics
+from headless import HeadlessRace, create_players
+from track_cache import CachingTrackBuilder
+
+# Functions that apply a value of each of the parameters to the computer players
+def _set_aggression(value):
+ Intelligence.PlayerState.INITIAL_AGGRESSION = value
+
+def _set_overtaking_distance(value):
+ Intelligence.PlayerState.OVERTAKING_DISTANCE_M = value
+
+def _set_lateral_shuffle(value):
+ Intelligence.PlayerState.LATERAL_SHUFFLE_MS = Mechanics.CAR_VELOCITY_MAX_MS[0] * value
+
+def _set_look_ahead(value):
+ Intelligence.TRACK_LOOK_AHEAD = int(value)
+
+# The parameters that can be swept, as (name, default, function that applies a value)
+PARAMETERS = (
+ ('aggression', Intelligence.PlayerState.INITIAL_AGGRESSION, _set_aggression),
+ ('overtaking_distance', Intelligence.PlayerState.OVERTAKING_DISTANCE_M, _set_overtaking_distance),
+ ('lateral_shuffle', Intelligence.PlayerState.LATERAL_SHUFFLE_MS / Mechanics.CAR_VELOCITY_MAX_MS[0], _set_lateral_shuffle),
+ ('look_ahead', Intelligence.TRACK_LOOK_AHEAD, _set_look_ahead)
+)
+
+# The races are split into batches of this many, so that the work is shared evenly between the workers
+BATCH_SIZE = 10
+
+# Each worker process builds (or loads from the cache) the tracks once, and reuses them for every batch
+_track_builder = None
+
+# The totals of a set of races run with the same track and parameters
+class FarmResult:
+ COLUMNS = ('races', 'unfinished', 'winning time (s)', 'finish time (s)', 'position changes', 'collisions')
+
+ def __init__(self, track_name, values):
+  self.track_name = track_name
+  self.values = values
+  self.races = 0
+  self.unfinished = 0
+  self.won = 0
+  self.winning_time = 0
+  self.finish_time = 0
+  self.finishers = 0
+  self.position_changes = 0
+  self.collisions = 0
+
+ def add(self, other):
+  self.races += other.races
+  self.unfinished += other.unfinished
+  self.won += other.won
+  self.winning_time += other.winning_time
+  self.finish_time += other.finish_time
+  self.finishers += other.finishers
+  self.position_changes += other.position_changes
+  self.collisions += other.collisions
+
+ # Returns the averages over all of the races, in the order of COLUMNS
+ def get_row(self):
+  races = float(max(self.races, 1))
+  return [self.races, self.unfinished, self.winning_time / max(self.won, 1), self.finish_time / max(self.finishers, 1), self.position_changes / races, self.collisions / races]
+
+# Runs a batch of races in a worker process. task is (track index, parameter values, races, players, seed).
+def run_batch(task):
+ global _track_builder
+ track_index, values, races, player_count, seed = task
+ if _track_builder == None:
+  _track_builder = CachingTrackBuilder(Game._define_tracks())
+ track_def = _track_builder.build(track_index)
+ for i in range(len(PARAMETERS)):
+  PARAMETERS[i][2](values[i])
+
+ random.seed(seed)
+ farm_result = FarmResult(track_def.name, values)
+ for r in range(races):
+  result = HeadlessRace(track_def, create_players(player_count)).run()
+  farm_result.races += 1
+  if result.finishing_order:
+   farm_result.won += 1
+   farm_result.winning_time += result.get_finish_time(result.finishing_order[0])
+  if not result.completed:
+   farm_result.unfinished += 1
+  for p in result.finishing_order:
+   farm_result.finish_time += result.get_finish_time(p)
+   farm_result.finishers += 1
+  farm_result.position_changes += result.position_changes
+  farm_result.collisions += result.collisions
+ return (track_index, values, farm_result)
+
+# Races every combination of parameter values on each of the tracks, and returns a FarmResult for each pair
+def run_farm(track_indices, value_lists, races, player_count = len(PLAYERS), workers = None, seed = 0):
+ # Build the tracks once up front, so that the workers can load them from the cache
+ track_builder = CachingTrackBuilder(Game._define_tracks())
+ for track_index in track_indices:
+  track_builder.build(track_index)
+
+ tasks = []
+ for track_index in track_indices:
+  for values in itertools.product(*value_lists):
+   for start in range(0, races, BATCH_SIZE):
+    tasks.append((track_index, values, min(BATCH_SIZE, races - start), player_count, seed + len(tasks)))
+
+ results = {}
+ pool = multiprocessing.Pool(workers)
+ try:
+  for track_index, values, farm_result in pool.imap_unordered(run_batch, tasks):
+   key = (track_index, values)
+   if key in results:
+    results[key].add(farm_result)
+   else:
+    results[key] = farm_result
+ finally:
+  pool.close()
+  pool.join()
+ return [results[key] for key in sorted(results)]
+
+def _parse_values(text):
+ return [float(value) for value in text.split(',')]
+
+def _format(value):
+ return str(round(value, 2)) if isinstance(value, float) else str(value)
+
+def main():
+ parser = argparse.ArgumentParser(description = 'Race the computer players against each other, sweeping the constants that control them.')
+ parser.add_argument('--track', help = 'name of the track to race on (default: all tracks)')
+ parser.add_argument('--races', type = int, default = 100, help = 'number of races for each track and combination of parameters')
+ parser.add_argument('--players', type = int, default = len(PLAYERS), help = 'number of cars in each race')
+ parser.add_argument('--workers', type = int, help = 'number of worker processes (default: one per CPU core)')
+ parser.add_argument('--seed', type = int, default = 0, help = 'random seed, for reproducible results')
+ parser.add_argument('--csv', help = 'also write the results to this CSV file')
+ for name, default, apply in PARAMETERS:
+  parser.add_argument('--' + name.replace('_', '-'), type = _parse_values, default = [default], help = 'comma separated values of ' + name + ' (default: ' + str(default) + ')')
+ args = parser.parse_args()
+
+ track_defs = Game._define_tracks()
+ track_indices = [i for i in range(len(track_defs)) if args.track == None or track_defs[i].name == args.track]
+ if not track_indices:
+  parser.error('unknown track: ' + args.track)
+ value_lists = [getattr(args, name) for name, default, apply in PARAMETERS]
+
+ results = run_farm(track_indices, value_lists, args.races, args.players, args.workers, args.seed)
+
+ header = ['track'] + [name for name, default, apply in PARAMETERS] + list(FarmResult.COLUMNS)
+ rows = [[result.track_name] + list(result.values) + result.get_row() for result in results]
+ widths = [max(len(header[i]), max(len(_format(row[i])) for row in rows)) for i in range(len(header))]
+ print('  '.join(header[i].rjust(widths[i]) for i in range(len(header))))
+ for row in rows:
+  print('  '.join(_format(row[i]).rjust(widths[i]) for i in range(len(row))))
+
+ if args.csv:
+  with open(args.csv, 'w', newline = '') as f:
+   writer = csv.writer(f)
+   writer.writerow(header)
+   writer.writerows(rows)
+
+if __name__ == '__main__':
+ main()
@@ -0,0 +1,508 @@
+# Offscreen Raster Backend
+#
+# A replacement for simplegui that draws into an array of pixels in memory instead of a browser canvas,
+# so that the whole game - the introduction, the race and every renderer - can be run on a machine
+# without a browser, and its true frame throughput measured. The images and sounds are read from img/,
+# music/ and fx/ rather than downloaded from ASSET_BASE, concurrently by an AssetLoader (see
+# asset_loader.py), the sounds are silent and frames are only drawn when draw() is called, as quickly
+# as they can be. Like simplegui, an image has a width of 0 until it has loaded. If engine_synth.py can
+# read the engine sample, the engine sound is an EngineSynthesizer made from just that sample.
+#
+# Images are drawn with nearest-neighbour sampling and alpha blending, including rotation, and the
+# lines, polygons and circles are drawn with their widths. There is no font to draw text with, so
+# draw_text() shades the box that the text would cover instead. JPEG images can't be decoded, so they
+# are drawn as a flat grey rectangle of the right size.
+#
+# Requires NumPy, so this is only for use outside CodeSkulptor.
+#
+# Usage: python raster_backend.py [--track NAME] [--frames N] [--seed N] [--workers N] [--screenshot FILE]
+
+import argparse
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+
+import numpy
+
+from PowerDrift import ASSET_BASE, Game, set_backend
+from asset_loader import AssetLoader, read_file
+from atlas import Bitmap
+from engine_synth import EngineSynthesizer, can_load, load_sample
+from frame_times import FrameTimeHistogram
+
+ASSET_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# An image read from img/, as planes of red, green and blue values between 0 and 1, premultiplied by alpha, and a
+#   fourth plane of transparency (1 - alpha), which is what blending needs. The planes have a transparent border
+#   of one pixel, so that the pixels that fall outside the image when it is drawn can be sampled from the border
+#   instead of being masked out.
+class RasterImage:
+ def __init__(self, name):
+  self.name = name
+  self.width = 0
+  self.height = 0
+  self.pixels = None
+  self.flat_pixels = None
+
+ def get_width(self):
+  return self.width
+
+ def get_height(self):
+  return self.height
+
+ # Sets the pixels from an array of RGBA bytes, as returned by decode(). The width is set last, since it shows that the image is ready.
+ def set_pixels(self, rgba):
+  planes = rgba.transpose((2, 0, 1)).astype(numpy.float32) / 255
+  planes[0 : 3] *= planes[3]
+  planes[3] = 1 - planes[3]
+  self._set_planes(planes)
+
+ # Returns a copy of part of the image, scaled down by a whole factor by averaging each square of factor x factor pixels.
+ #   The copy is padded with transparent pixels to a whole number of squares.
+ def scale(self, centre, size, factor):
+  left = int(round(centre[0] - size[0] / 2.0))
+  top = int(round(centre[1] - size[1] / 2.0))
+  width = int(round(size[0]))
+  height = int(round(size[1]))
+  scaled_width = (width + factor - 1) // factor
+  scaled_height = (height + factor - 1) // factor
+  planes = numpy.zeros((4, scaled_height * factor, scaled_width * factor), dtype = numpy.float32)
+  planes[3] = 1
+  planes[:, 0 : height, 0 : width] = self.pixels[:, top + 1 : top + 1 + height, left + 1 : left + 1 + width]
+  image = RasterImage(self.name + '@' + str(factor))
+  image._set_planes(planes.reshape((4, scaled_height, factor, scaled_width, factor)).mean(axis = (2, 4)))
+  return image
+
+ def _set_planes(self, planes):
+  height, width = planes.shape[1 : 3]
+  pixels = numpy.zeros((4, height + 2, width + 2), dtype = numpy.float32)
+  pixels[3] = 1
+  pixels[:, 1 : height + 1, 1 : width + 1] = planes
+  self.pixels = pixels
+  self.flat_pixels = pixels.reshape((4, -1))
+  self.height = height
+  self.width = width
+
+ # Reads an image file and returns its pixels as an array of RGBA bytes. Runs on an AssetLoader worker.
+ def decode(path):
+  if path.lower().endswith('.png'):
+   bitmap = Bitmap.read_png(path)
+   pixels = numpy.frombuffer(b''.join(bytes(row) for row in bitmap.rows), dtype = numpy.uint8)
+   return pixels.reshape((bitmap.height, bitmap.width, 4))
+  width, height = RasterImage._read_jpeg_size(path)
+  pixels = numpy.full((height, width, 4), 128, dtype = numpy.uint8)
+  pixels[:, :, 3] = 255
+  return pixels
+
+ # Returns the size of a JPEG image from its start of frame marker
+ def _read_jpeg_size(path):
+  with open(path, 'rb') as f:
+   data = f.read()
+  offset = 2
+  while offset + 9 < len(data):
+   marker, length = struct.unpack_from('>HH', data, offset)
+   if marker in (0xffc0, 0xffc1, 0xffc2):
+    height, width = struct.unpack_from('>HH', data, offset + 5)
+    return width, height
+   offset += length + 2
+  raise ValueError(path + ' is not a JPEG file')
+
+# A sound that is never heard. Its data is the contents of its file, once that has been read.
+class RasterSound:
+ def __init__(self, name):
+  self.name = name
+  self.data = None
+
+ def set_data(self, data):
+  self.data = data
+
+ def play(self):
+  pass
+
+ def pause(self):
+  pass
+
+ def rewind(self):
+  pass
+
+ def set_volume(self, volume):
+  pass
+
+# A canvas that draws into planes of red, green and blue values between 0 and 1
+class RasterCanvas:
+ NAMED_COLOURS = {'black': '#000', 'white': '#fff', 'red': '#f00', 'green': '#008000', 'blue': '#00f', 'yellow': '#ff0', 'grey': '#808080', 'gray': '#808080'}
+ TEXT_WIDTH = 0.55     # The width of a character and the height of a line of text, as proportions of the font size
+ TEXT_HEIGHT = 0.75
+ TEXT_OPACITY = 0.5
+
+ def __init__(self, width, height):
+  self.width = width
+  self.height = height
+  self.pixels = numpy.zeros((3, height, width), dtype = numpy.float32)
+  self._colours = {}
+
+ def clear(self, colour):
+  self.pixels[:] = self._get_colour(colour)[0]
+
+ def draw_image(self, image, centre_source, size_source, centre_dest, size_dest, rotation = 0):
+  if image.width == 0 or size_dest[0] == 0 or size_dest[1] == 0:
+   return
+  half_width = abs(size_dest[0]) / 2.0
+  half_height = abs(size_dest[1]) / 2.0
+  sine = math.sin(rotation)
+  cosine = math.cos(rotation)
+  extent_x = half_width * abs(cosine) + half_height * abs(sine)
+  extent_y = half_width * abs(sine) + half_height * abs(cosine)
+  area = self._get_area(centre_dest[0] - extent_x, centre_dest[1] - extent_y, centre_dest[0] + extent_x, centre_dest[1] + extent_y)
+  if area == None:
+   return
+  x0, y0, x1, y1 = area
+  scale_x = size_source[0] / float(size_dest[0])
+  scale_y = size_source[1] / float(size_dest[1])
+  dx = numpy.arange(x0, x1, dtype = numpy.float32) + 0.5 - centre_dest[0]
+  dy = numpy.arange(y0, y1, dtype = numpy.float32) + 0.5 - centre_dest[1]
+  # The source rectangle, in the coordinates of the bordered image
+  left = max(centre_source[0] - size_source[0] / 2.0, 0) + 1
+  top = max(centre_source[1] - size_source[1] / 2.0, 0) + 1
+  right = min(centre_source[0] + size_source[0] / 2.0, image.width) + 1
+  bottom = min(centre_source[1] + size_source[1] / 2.0, image.height) + 1
+
+  if rotation == 0:
+   # The source of each column and each row can be found separately, and only the columns and rows that fall
+   #   within the source rectangle are drawn
+   sx = numpy.floor(centre_source[0] + 1 + dx * scale_x).astype(numpy.int32)
+   sy = numpy.floor(centre_source[1] + 1 + dy * scale_y).astype(numpy.int32)
+   columns = numpy.flatnonzero((sx >= left) & (sx < right))
+   rows = numpy.flatnonzero((sy >= top) & (sy < bottom))
+   if len(columns) == 0 or len(rows) == 0:
+    return
+   pixels = image.pixels.take(sy[rows[0] : rows[-1] + 1], axis = 1).take(sx[columns[0] : columns[-1] + 1], axis = 2)
+   self._blend_image(x0 + columns[0], y0 + rows[0], x0 + columns[-1] + 1, y0 + rows[-1] + 1, pixels)
+  else:
+   # Rotate each canvas pixel back into the image, the opposite way to the image. The coordinates are truncated
+   #   rather than rounded down, which only differs for those that are outside the image anyway.
+   sx = numpy.add.outer(dy * (sine * scale_x), dx * (cosine * scale_x) + (centre_source[0] + 1)).astype(numpy.int32)
+   sy = numpy.add.outer(dy * (cosine * scale_y) + (centre_source[1] + 1), dx * (-sine * scale_y)).astype(numpy.int32)
+   if left > 1 or top > 1 or right < image.width + 1 or bottom < image.height + 1:
+    # Only part of the image is drawn, so the pixels outside that part are pointed at the border
+    outside = (sx < left) | (sx >= right) | (sy < top) | (sy >= bottom)
+    sx[outside] = 0
+    sy[outside] = 0
+   numpy.clip(sx, 0, image.width + 1, out = sx)
+   numpy.clip(sy, 0, image.height + 1, out = sy)
+   sy *= image.width + 2
+   sy += sx
+   self._blend_image(x0, y0, x1, y1, image.flat_pixels.take(sy, axis = 1))
+
+ def draw_text(self, text, point, font_size, font_color, font_face = 'serif'):
+  width = len(text) * font_size * RasterCanvas.TEXT_WIDTH
+  height = font_size * RasterCanvas.TEXT_HEIGHT
+  area = self._get_area(point[0], point[1] - height, point[0] + width, point[1])
+  if area != None:
+   x0, y0, x1, y1 = area
+   rgb, alpha = self._get_colour(font_color)
+   self._blend(x0, y0, x1, y1, rgb, alpha * RasterCanvas.TEXT_OPACITY)
+
+ def draw_line(self, point1, point2, line_width, line_color):
+  self.draw_polyline((point1, point2), line_width, line_color)
+
+ def draw_polyline(self, point_list, line_width, line_color):
+  rgb, alpha = self._get_colour(line_color)
+  half_width = max(line_width, 1) / 2.0
+  for i in range(len(point_list) - 1):
+   self._draw_segment(point_list[i], point_list[i + 1], half_width, rgb, alpha)
+
+ def draw_polygon(self, point_list, line_width, line_color, fill_color = None):
+  if fill_color != None:
+   xs = [p[0] for p in point_list]
+   ys = [p[1] for p in point_list]
+   area = self._get_area(min(xs), min(ys), max(xs), max(ys))
+   if area != None:
+    x0, y0, x1, y1 = area
+    px = numpy.arange(x0, x1, dtype = numpy.float32)[None, :] + 0.5
+    py = numpy.arange(y0, y1, dtype = numpy.float32)[:, None] + 0.5
+    # Count the edges crossed by a ray to the right of each pixel
+    inside = numpy.zeros((y1 - y0, x1 - x0), dtype = bool)
+    l = len(point_list)
+    for i in range(l):
+     ax, ay = point_list[i]
+     bx, by = point_list[i - 1]
+     if ay != by:
+      crosses = (ay > py) != (by > py)
+      inside ^= crosses & (px < ax + (py - ay) * (bx - ax) / float(by - ay))
+    rgb, alpha = self._get_colour(fill_color)
+    self._blend(x0, y0, x1, y1, rgb, inside * alpha)
+  if line_width > 0:
+   self.draw_polyline(list(point_list) + [point_list[0]], line_width, line_color)
+
+ def draw_circle(self, center_point, radius, line_width, line_color, fill_color = None):
+  outer = radius + line_width / 2.0
+  area = self._get_area(center_point[0] - outer, center_point[1] - outer, center_point[0] + outer, center_point[1] + outer)
+  if area == None:
+   return
+  x0, y0, x1, y1 = area
+  px = numpy.arange(x0, x1, dtype = numpy.float32)[None, :] + 0.5 - center_point[0]
+  py = numpy.arange(y0, y1, dtype = numpy.float32)[:, None] + 0.5 - center_point[1]
+  distance = numpy.sqrt(px * px + py * py)
+  if fill_color != None:
+   rgb, alpha = self._get_colour(fill_color)
+   self._blend(x0, y0, x1, y1, rgb, (distance <= radius) * alpha)
+  if line_width > 0:
+   rgb, alpha = self._get_colour(line_color)
+   self._blend(x0, y0, x1, y1, rgb, (abs(distance - radius) <= line_width / 2.0) * alpha)
+
+ def _draw_segment(self, a, b, half_width, rgb, alpha):
+  area = self._get_area(min(a[0], b[0]) - half_width, min(a[1], b[1]) - half_width, max(a[0], b[0]) + half_width, max(a[1], b[1]) + half_width)
+  if area == None:
+   return
+  x0, y0, x1, y1 = area
+  px = numpy.arange(x0, x1, dtype = numpy.float32)[None, :] + 0.5 - a[0]
+  py = numpy.arange(y0, y1, dtype = numpy.float32)[:, None] + 0.5 - a[1]
+  vx = b[0] - a[0]
+  vy = b[1] - a[1]
+  length_squared = vx * vx + vy * vy
+  if length_squared > 0:
+   t = ((px * vx + py * vy) / length_squared).clip(0, 1)
+   px = px - t * vx
+   py = py - t * vy
+  self._blend(x0, y0, x1, y1, rgb, (px * px + py * py <= half_width * half_width) * alpha)
+
+ # Returns the part of a rectangle that is on the canvas, in whole pixels, or None if none of it is
+ def _get_area(self, left, top, right, bottom):
+  x0 = max(int(math.floor(left)), 0)
+  y0 = max(int(math.floor(top)), 0)
+  x1 = min(int(math.ceil(right)), self.width)
+  y1 = min(int(math.ceil(bottom)), self.height)
+  if x0 >= x1 or y0 >= y1:
+   return None
+  return (x0, y0, x1, y1)
+
+ # Blends a colour, or an array of colours, into an area of the canvas with an array of alpha values
+ def _blend(self, x0, y0, x1, y1, rgb, alpha):
+  area = self.pixels[:, y0 : y1, x0 : x1]
+  area += (rgb - area) * numpy.asarray(alpha, dtype = numpy.float32)
+
+ # Blends the planes of a RasterImage into an area of the canvas
+ def _blend_image(self, x0, y0, x1, y1, pixels):
+  area = self.pixels[:, y0 : y1, x0 : x1]
+  area *= pixels[3]
+  area += pixels[0 : 3]
+
+ # Returns the RGB and alpha values of a colour such as '#fff', '#22470b' or 'rgba(0,0,0,0.5)'
+ def _get_colour(self, colour):
+  if colour in self._colours:
+   return self._colours[colour]
+  text = RasterCanvas.NAMED_COLOURS.get(colour.lower(), colour).strip()
+  alpha = 1.0
+  if text.startswith('#'):
+   digits = text[1 :]
+   if len(digits) == 3:
+    digits = ''.join(d + d for d in digits)
+   rgb = [int(digits[i : i + 2], 16) for i in (0, 2, 4)]
+  else:
+   values = re.findall(r'[\d.]+', text)
+   if not text.startswith('rgb') or len(values) < 3:
+    raise ValueError('Unknown colour: ' + colour)
+   rgb = [float(v) for v in values[0 : 3]]
+   if len(values) > 3:
+    alpha = float(values[3])
+  result = (numpy.array(rgb, dtype = numpy.float32).reshape((3, 1, 1)) / 255, alpha)
+  self._colours[colour] = result
+  return result
+
+ def to_bitmap(self):
+  pixels = (self.pixels.clip(0, 1) * 255 + 0.5).astype(numpy.uint8)
+  pixels = numpy.concatenate((pixels, numpy.full((1, self.height, self.width), 255, dtype = numpy.uint8))).transpose((1, 2, 0))
+  bitmap = Bitmap(self.width, self.height)
+  bitmap.rows = [bytearray(row.tobytes()) for row in pixels]
+  return bitmap
+
+class RasterFrame:
+ def __init__(self, title, width, height, backend = None):
+  self.title = title
+  self.backend = backend
+  self.canvas = RasterCanvas(width, height)
+  self.background = 'Black'
+  self.draw_handler = None
+  self.keydown_handler = None
+  self.keyup_handler = None
+
+ def set_draw_handler(self, handler):
+  self.draw_handler = handler
+
+ def set_keydown_handler(self, handler):
+  self.keydown_handler = handler
+
+ def set_keyup_handler(self, handler):
+  self.keyup_handler = handler
+
+ def set_canvas_background(self, colour):
+  self.background = colour
+
+ # Frames are only drawn when draw() is called
+ def start(self):
+  pass
+
+ def stop(self):
+  pass
+
+ # Calls the load callbacks of the assets that have loaded since the last frame, then clears the canvas to the background
+ #   colour and calls the draw handler
+ def draw(self):
+  if self.backend != None:
+   self.backend.run_load_callbacks()
+  self.canvas.clear(self.background)
+  if self.draw_handler != None:
+   self.draw_handler(self.canvas)
+  return self.canvas
+
+ def key_down(self, name):
+  if self.keydown_handler != None:
+   self.keydown_handler(RasterBackend.KEY_MAP[name])
+
+ def key_up(self, name):
+  if self.keyup_handler != None:
+   self.keyup_handler(RasterBackend.KEY_MAP[name])
+
+ def save_png(self, path):
+  self.canvas.to_bitmap().write_png(path)
+
+# Provides the same create_frame(), load_image(), load_sound() and KEY_MAP as simplegui. See set_backend() in PowerDrift.py.
+class RasterBackend:
+ KEY_MAP = dict([('left', 37), ('up', 38), ('right', 39), ('down', 40), ('space', 32)] + [(chr(ord('a') + c), ord('A') + c) for c in range(26)])
+
+ def __init__(self, directory = ASSET_DIRECTORY, loader = None):
+  self.directory = directory
+  self.loader = loader if loader != None else AssetLoader()
+  self.frames = []
+  self._assets = {}
+  self._lock = threading.Lock()
+  self._loaded = set()          # Names of the assets that have loaded
+  self._load_callbacks = {}     # Asset name : functions to call once it has loaded
+  self._ready_callbacks = []    # (function, asset) to call at the start of the next frame
+
+ def create_frame(self, title, canvas_width, canvas_height, control_width = 200):
+  frame = RasterFrame(title, canvas_width, canvas_height, self)
+  self.frames.append(frame)
+  return frame
+
+ # Returns an image that is loaded in the background, from the file in the asset directory that the URL at ASSET_BASE
+ #   refers to. Each image is only loaded once.
+ def load_image(self, url):
+  return self._load(url, RasterImage, RasterImage.decode, RasterImage.set_pixels)
+
+ def load_sound(self, url):
+  return self._load(url, RasterSound, read_file, RasterSound.set_data)
+
+ # Returns an EngineSynthesizer that plays the sample at any pitch across the given number of intervals, for PowerDrift's
+ #   EngineManager, or None if the sample can't be read. Like the other sounds, it is never heard.
+ def create_engine_sound(self, url, intervals):
+  name = url[len(ASSET_BASE) :] if url.startswith(ASSET_BASE) else url.split('/')[-1]
+  if not can_load(name):
+   return None
+  synthesizer = EngineSynthesizer(intervals = intervals)
+  def on_loaded(future):
+   if future.exception() != None:
+    print('Unable to load ' + name + ': ' + str(future.exception()))
+   else:
+    synthesizer.set_sample(*future.result())
+  self.loader.load(load_sample, (os.path.join(self.directory, name),), on_loaded)
+  return synthesizer
+
+ # Calls function(asset) once an image or sound from load_image() or load_sound() has loaded, for PowerDrift's
+ #   ImageManager. Like the game's other handlers, it is called on the thread that draws the frames, at the start of a
+ #   frame, rather than on the loader's thread. It isn't called for an asset that fails to load.
+ def add_load_callback(self, asset, function):
+  with self._lock:
+   if asset.name in self._loaded:
+    self._ready_callbacks.append((function, asset))
+   else:
+    self._load_callbacks.setdefault(asset.name, []).append(function)
+
+ def run_load_callbacks(self):
+  with self._lock:
+   callbacks = self._ready_callbacks
+   self._ready_callbacks = []
+  for function, asset in callbacks:
+   function(asset)
+
+ # Returns a copy of part of an image scaled down by a whole factor, for the SpriteCache in sprite_cache.py
+ def scale_image(self, image, centre, size, factor):
+  return image.scale(centre, size, factor)
+
+ # Waits until every image and sound has loaded or failed, and returns False if the timeout expired first
+ def wait_until_ready(self, timeout = None):
+  return self.loader.wait(timeout)
+
+ # Creates an asset of asset_type, and loads it by calling function with its path and then setter with the asset and the result
+ def _load(self, url, asset_type, function, setter):
+  name = url[len(ASSET_BASE) :] if url.startswith(ASSET_BASE) else url.split('/')[-1]
+  if name not in self._assets:
+   asset = asset_type(name)
+   self._assets[name] = asset
+   def on_loaded(future):
+    if future.exception() != None:
+     print('Unable to load ' + name + ': ' + str(future.exception()))
+    else:
+     setter(asset, future.result())
+     with self._lock:
+      self._loaded.add(name)
+      for callback in self._load_callbacks.pop(name, []):
+       self._ready_callbacks.append((callback, asset))
+   self.loader.load(function, (os.path.join(self.directory, name),), on_loaded)
+  return self._assets[name]
+
+# Plays the game on a RasterBackend with the computer driving every car. Returns a FrameTimeSummary of the frames of the
+#   race, the time taken to draw the frames and the time taken to load the assets.
+def run_game(track_name = None, frames = 600, screenshot = None, workers = None):
+ backend = RasterBackend(loader = AssetLoader(workers))
+ set_backend(backend)
+ game = Game()
+ backend.wait_until_ready()
+ frame = backend.frames[0]
+ frame.draw()
+ if track_name != None:
+  names = [track_def.name for track_def in game.track_defs]
+  game._set_selected_track_index(names.index(track_name))
+ frame.key_down('space')
+ frame.key_up('space')
+ game.race.intelligence.autopilot = True
+
+ histogram = FrameTimeHistogram()
+ start_time = time.perf_counter()
+ frame_start_time = start_time
+ for i in range(frames):
+  frame.draw()
+  frame_end_time = time.perf_counter()
+  histogram.add(frame_end_time - frame_start_time)
+  frame_start_time = frame_end_time
+ elapsed_time = frame_start_time - start_time
+ if screenshot != None:
+  frame.save_png(screenshot)
+ backend.loader.shutdown()
+ return histogram.get_summary(), elapsed_time, backend.loader.get_ready_time()
+
+def main():
+ parser = argparse.ArgumentParser(description = 'Play the game offscreen, without a browser, and report how quickly frames are drawn.')
+ parser.add_argument('--track', help = 'name of the track to race on (default: the first track)')
+ parser.add_argument('--frames', type = int, default = 600, help = 'number of frames to draw, from the start of the race')
+ parser.add_argument('--seed', type = int, help = 'random seed, for reproducible races')
+ parser.add_argument('--workers', type = int, help = 'number of processes that load the assets (default: one per CPU core)')
+ parser.add_argument('--screenshot', help = 'save the last frame to this PNG file')
+ args = parser.parse_args()
+
+ if args.track != None and args.track not in [track_def.name for track_def in Game._define_tracks()]:
+  parser.error('unknown track: ' + args.track)
+ if args.seed != None:
+  random.seed(args.seed)
+ summary, elapsed_time, ready_time = run_game(args.track, args.frames, args.screenshot, args.workers)
+ print('Assets loaded in ' + str(round(ready_time, 3)) + ' seconds')
+ print(str(args.frames) + ' frames in ' + str(round(elapsed_time, 3)) + ' seconds (' + str(round(args.frames / elapsed_time, 1)) + ' fps)')
+ print(summary)
+
+if __name__ == '__main__':
+ main()
@@ -0,0 +1,51 @@
+# Render Depth Controller
+#
+# Chooses how many track segments to render, so that each frame takes about target_frame_time. The time
+# taken to render each segment and the time spent on everything else are measured, so that the depth
+# which fits the budget can be predicted and jumped to directly, and the draw distance settles within a
+# few frames of a change of scene. A slowly accumulating correction takes up any error that remains in
+# the prediction, and small changes are ignored so that the depth doesn't oscillate.
+#
+# CodeSkulptor can't import other modules, so there PowerDrift.py moves the depth a segment at a time
+# towards 30fps instead. As PowerDrift.py imports this module, it can't import PowerDrift in return, so
+# it is given the least depth that may be rendered.
+
+class RenderDepthController:
+ TARGET_FRAME_TIME_S = 1.0 / 30   # Aim for 30fps
+ SMOOTHING = 0.3                  # The weight of the latest measurement in the running averages
+ CORRECTION_GAIN = 0.1            # The proportion of each frame's error that is added to the correction
+ HYSTERESIS = 0.08                # Predicted changes smaller than this proportion of the depth are ignored
+
+ def __init__(self, min_depth, target_frame_time = TARGET_FRAME_TIME_S):
+  self.min_depth = min_depth
+  self.target_frame_time = target_frame_time
+  self.segment_time = 0
+  self.other_time = 0
+  self.correction = 0
+
+ # Returns the depth at which to render the next frame, given the time taken by the last frame, the part of it that was
+ #   spent rendering the track, the depth at which the track was rendered, and the greatest depth that can be rendered
+ def update(self, frame_time, track_time, depth, max_depth):
+  if frame_time <= 0 or track_time <= 0 or depth <= 0:
+   return depth
+  segment_time = track_time / depth
+  other_time = max(frame_time - track_time, 0)
+  if self.segment_time == 0:
+   self.segment_time = segment_time
+   self.other_time = other_time
+  else:
+   self.segment_time += RenderDepthController.SMOOTHING * (segment_time - self.segment_time)
+   self.other_time += RenderDepthController.SMOOTHING * (other_time - self.other_time)
+
+  # Only accumulate the correction while the depth can still move in the direction that it asks for
+  target = self.target_frame_time
+  error = target - frame_time
+  min_depth = self.min_depth
+  if (error > 0 and depth < max_depth) or (error < 0 and depth > min_depth):
+   self.correction = max(-target / 2, min(target / 2, self.correction + RenderDepthController.CORRECTION_GAIN * error))
+
+  predicted = int((target - self.other_time + self.correction) / self.segment_time)
+  predicted = max(min_depth, min(max_depth, predicted))
+  if abs(predicted - depth) > depth * RenderDepthController.HYSTERESIS:
+   return predicted
+  return depth
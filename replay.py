@@ -0,0 +1,324 @@
+# Race Replays
+#
+# Records the state of every player on every tick of a race, so that the race can be watched again or
+# examined afterwards. The position, velocity and acceleration of the players are stored in columns, one
+# array per component. Every KEYFRAME_INTERVAL ticks, a keyframe stores the full state in double
+# precision, and every tick stores its difference from the latest keyframe in single precision. This
+# halves the size of a replay without losing precision as the distance travelled grows, and any tick can
+# be read directly from its keyframe, so seeking takes the same time wherever it is in the race. The
+# human player's input is stored too, as a byte of INPUT_ flags per tick, and shown while the replay plays.
+#
+# A 5 lap race with 20 cars takes a few megabytes, and loading it is little more than a read.
+#
+# PowerDrift.py records each race when it can import this module. When the race finishes, it is saved
+# in DEFAULT_DIRECTORY on another thread, so that the game doesn't pause while it is written, and only
+# the MAX_SAVED most recent replays are kept there. The game also draws the recorded keys with
+# render_input() while the replay plays. As PowerDrift.py imports this module, only record_race() and
+# main() import PowerDrift, when they are called.
+#
+# Usage: python replay.py record [--track NAME] [--laps N] [--players N] [--seed N] FILE
+#        python replay.py info [--tick N] FILE
+
+import argparse
+import array
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+
+class Replay:
+ DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.replays')
+ FILE_TYPE = '.rpl'
+ MAX_SAVED = 10              # The number of replays kept in DEFAULT_DIRECTORY
+ KEYFRAME_INTERVAL = 60
+
+ INPUT_UP = 1
+ INPUT_DOWN = 2
+ INPUT_LEFT = 4
+ INPUT_RIGHT = 8
+
+ # The appearance of the cursor keys drawn by render_input()
+ COLOUR_KEY = "rgba(0, 0, 0, 0.5)"
+ COLOUR_KEY_PRESSED = "#ff0"
+ KEY_SIZE = 24
+
+ # Each player's state is position[0], position[1], velocity[0], velocity[1], acceleration[0], acceleration[1]
+ COMPONENTS = 6
+
+ # File layout: header, track name, player names, inputs, then the keyframes and the offsets of each component,
+ #   then a checksum. Values are stored little-endian, so that replays can be shared between machines.
+ MAGIC = b'RRPL'
+ VERSION = 1
+ HEADER = struct.Struct('<4sHHIId')
+ NAME_LENGTH = struct.Struct('<H')
+ CHECKSUM = struct.Struct('<I')
+
+ def __init__(self, track_name, player_names, delta, keyframe_interval = KEYFRAME_INTERVAL):
+  self.track_name = track_name
+  self.player_names = list(player_names)
+  self.delta = delta
+  self.keyframe_interval = keyframe_interval
+  self.ticks = 0
+  self.playback_time = 0   # In seconds, from the start of the recording
+  self.inputs = array.array('B')
+  self.keyframes = [array.array('d') for c in range(Replay.COMPONENTS)]
+  self.offsets = [array.array('f') for c in range(Replay.COMPONENTS)]
+
+ def get_duration(self):
+  return self.ticks * self.delta
+
+ # Advances playback by interval seconds, starting again when it reaches the end, and returns the tick to show
+ def advance(self, interval):
+  self.playback_time = (self.playback_time + interval) % self.get_duration()
+  return self.playback_time / self.delta
+
+ # Moves playback forwards, or backwards if seconds is negative, without leaving the recording
+ def skip(self, seconds):
+  self.playback_time = max(0, min(self.playback_time + seconds, self.get_duration()))
+
+ # Appends the state of the players after a tick
+ def record(self, players, input_flags = 0):
+  n = len(players)
+  if self.ticks % self.keyframe_interval == 0:
+   for c in range(Replay.COMPONENTS):
+    keyframes = self.keyframes[c]
+    for player in players:
+     keyframes.append(Replay._get_component(player, c))
+  base = (self.ticks // self.keyframe_interval) * n
+  for c in range(Replay.COMPONENTS):
+   keyframes = self.keyframes[c]
+   offsets = self.offsets[c]
+   for p in range(n):
+    offsets.append(Replay._get_component(players[p], c) - keyframes[base + p])
+  self.inputs.append(input_flags)
+  self.ticks += 1
+
+ # Sets the state of the players to their state after a tick, which is clamped to the recording
+ def apply(self, tick, players):
+  tick = max(0, min(int(tick), self.ticks - 1))
+  n = len(players)
+  base = (tick // self.keyframe_interval) * n
+  offset = tick * n
+  for c in range(Replay.COMPONENTS):
+   keyframes = self.keyframes[c]
+   offsets = self.offsets[c]
+   for p in range(n):
+    Replay._set_component(players[p], c, keyframes[base + p] + offsets[offset + p])
+
+ def get_input(self, tick):
+  return self.inputs[max(0, min(int(tick), self.ticks - 1))]
+
+ # Returns the INPUT_ flags of the cursor keys that are held down, given the game's is_key_pressed() and Key class
+ def get_input_flags(is_key_pressed, key):
+  flags = 0
+  if is_key_pressed(key.UP):
+   flags |= Replay.INPUT_UP
+  if is_key_pressed(key.DOWN):
+   flags |= Replay.INPUT_DOWN
+  if is_key_pressed(key.LEFT):
+   flags |= Replay.INPUT_LEFT
+  if is_key_pressed(key.RIGHT):
+   flags |= Replay.INPUT_RIGHT
+  return flags
+
+ # Draws the cursor keys that the human player was holding down at the playback time, laid out as they are on a
+ #   keyboard, from the top left corner at position
+ def render_input(self, canvas, position):
+  flags = self.get_input(self.playback_time / self.delta)
+  size = Replay.KEY_SIZE
+  spacing = size + 4
+  keys = ((Replay.INPUT_UP, 1, 0), (Replay.INPUT_LEFT, 0, 1), (Replay.INPUT_DOWN, 1, 1), (Replay.INPUT_RIGHT, 2, 1))
+  for flag, column, row in keys:
+   x = position[0] + column * spacing
+   y = position[1] + row * spacing
+   colour = Replay.COLOUR_KEY_PRESSED if flags & flag else Replay.COLOUR_KEY
+   canvas.draw_polygon([(x, y), (x + size, y), (x + size, y + size), (x, y + size)], 2, "Black", colour)
+
+ def _get_component(player, c):
+  if c < 2:
+   return player.position[c]
+  if c < 4:
+   return player.velocity[c - 2]
+  return player.acceleration[c - 4]
+
+ def _set_component(player, c, value):
+  if c < 2:
+   player.position[c] = value
+  elif c < 4:
+   player.velocity[c - 2] = value
+  else:
+   player.acceleration[c - 4] = value
+
+ # Returns a path in DEFAULT_DIRECTORY, named after the track and the current time to the millisecond, and numbered if a
+ #   replay with that name already exists
+ def get_default_path(self):
+  now = time.time()
+  name = self.track_name + '-' + time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + '-%03d' % (int(now * 1000) % 1000)
+  path = os.path.join(Replay.DEFAULT_DIRECTORY, name + Replay.FILE_TYPE)
+  count = 1
+  while os.path.exists(path):
+   count += 1
+   path = os.path.join(Replay.DEFAULT_DIRECTORY, name + '-' + str(count) + Replay.FILE_TYPE)
+  return path
+
+ # Writes the replay to a file, or to DEFAULT_DIRECTORY if no path is given, discarding the oldest replays there beyond
+ #   MAX_SAVED. Returns False if it couldn't be written.
+ def save(self, path = None):
+  if path == None:
+   return self._save_and_prune(self.get_default_path())
+  temp_path = path + '.tmp'
+  try:
+   directory = os.path.dirname(path)
+   if directory and not os.path.isdir(directory):
+    os.makedirs(directory)
+   with open(temp_path, 'wb') as f:
+    f.write(self._encode())
+   os.replace(temp_path, path)
+  except (IOError, OSError):
+   return False
+  return True
+
+ # Writes the replay to a path in DEFAULT_DIRECTORY, then discards the oldest replays there beyond MAX_SAVED
+ def _save_and_prune(self, path):
+  if not self.save(path):
+   return False
+  Replay.prune(Replay.DEFAULT_DIRECTORY, Replay.MAX_SAVED)
+  return True
+
+ # Saves the replay to DEFAULT_DIRECTORY on another thread, so that the frame in which a race finishes isn't held up
+ #   while it is written. The path is chosen straight away. The replay mustn't be changed until the thread finishes.
+ def save_in_background(self):
+  thread = threading.Thread(target = self._save_and_prune, args = (self.get_default_path(),))
+  thread.start()
+  return thread
+
+ # Deletes the oldest replays in a directory, leaving the newest keep of them
+ def prune(directory, keep):
+  try:
+   paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(Replay.FILE_TYPE)]
+   paths.sort(key = os.path.getmtime)
+   for path in paths[0 : max(len(paths) - keep, 0)]:
+    os.remove(path)
+  except (IOError, OSError):
+   pass
+
+ def load(path):
+  with open(path, 'rb') as f:
+   return Replay._decode(f.read())
+
+ def _encode(self):
+  parts = [Replay._encode_name(self.track_name)]
+  for name in self.player_names:
+   parts.append(Replay._encode_name(name))
+  for a in [self.inputs] + self.keyframes + self.offsets:
+   parts.append(Replay._to_little_endian(a).tobytes())
+  payload = b''.join(parts)
+  header = Replay.HEADER.pack(Replay.MAGIC, Replay.VERSION, len(self.player_names), self.ticks, self.keyframe_interval, self.delta)
+  return header + payload + Replay.CHECKSUM.pack(zlib.crc32(payload) & 0xffffffff)
+
+ def _decode(data):
+  magic, version, player_count, ticks, keyframe_interval, delta = Replay.HEADER.unpack_from(data)
+  if magic != Replay.MAGIC or version != Replay.VERSION:
+   raise ValueError('Not a replay file')
+  end = len(data) - Replay.CHECKSUM.size
+  payload = data[Replay.HEADER.size : end]
+  if end < Replay.HEADER.size or Replay.CHECKSUM.unpack_from(data, end)[0] != zlib.crc32(payload) & 0xffffffff:
+   raise ValueError('Corrupt replay file')
+
+  offset = 0
+  names = []
+  for i in range(player_count + 1):
+   length = Replay.NAME_LENGTH.unpack_from(payload, offset)[0]
+   offset += Replay.NAME_LENGTH.size
+   names.append(payload[offset : offset + length].decode('utf-8'))
+   offset += length
+  replay = Replay(names[0], names[1 :], delta, keyframe_interval)
+  replay.ticks = ticks
+
+  keyframe_count = ((ticks + keyframe_interval - 1) // keyframe_interval) * player_count
+  offset = Replay._read_array(replay.inputs, payload, offset, ticks)
+  for keyframes in replay.keyframes:
+   offset = Replay._read_array(keyframes, payload, offset, keyframe_count)
+  for offsets in replay.offsets:
+   offset = Replay._read_array(offsets, payload, offset, ticks * player_count)
+  if offset != len(payload):
+   raise ValueError('Corrupt replay file')
+  return replay
+
+ def _encode_name(name):
+  encoded = name.encode('utf-8')
+  return Replay.NAME_LENGTH.pack(len(encoded)) + encoded
+
+ # Reads count items into an empty array from data at offset, and returns the offset after them
+ def _read_array(a, data, offset, count):
+  end = offset + count * a.itemsize
+  if end > len(data):
+   raise ValueError('Corrupt replay file')
+  a.frombytes(data[offset : end])
+  if sys.byteorder != 'little':
+   a.byteswap()
+  return end
+
+ def _to_little_endian(a):
+  if sys.byteorder == 'little':
+   return a
+  a = array.array(a.typecode, a)
+  a.byteswap()
+  return a
+
+# Records a race with every car driven by the computer
+def record_race(track_def, player_count, laps = None):
+ from headless import HeadlessRace, create_players
+ if laps != None:
+  track_def.laps = laps
+ players = create_players(player_count)
+ headless_race = HeadlessRace(track_def, players)
+ replay = Replay(track_def.name, [player.name for player in players], headless_race.delta)
+ result = headless_race.run(replay = replay)
+ return replay, result
+
+def main():
+ from PowerDrift import PLAYERS, Player
+ from headless import select_tracks
+ parser = argparse.ArgumentParser(description = 'Record races, or show what a recorded race contains.')
+ commands = parser.add_subparsers(dest = 'command')
+ record = commands.add_parser('record', help = 'record a race with every car driven by the computer')
+ record.add_argument('--track', help = 'name of the track to race on (default: the first track)')
+ record.add_argument('--laps', type = int, help = "number of laps (default: the track's own)")
+ record.add_argument('--players', type = int, default = len(PLAYERS), help = 'number of cars in the race')
+ record.add_argument('--seed', type = int, help = 'random seed, for reproducible races')
+ record.add_argument('file')
+ info = commands.add_parser('info', help = 'describe a recorded race')
+ info.add_argument('--tick', type = int, help = 'also show the state of the players at this tick')
+ info.add_argument('file')
+ args = parser.parse_args()
+
+ if args.command == 'record':
+  track_defs = select_tracks(args.track)
+  if not track_defs:
+   parser.error('unknown track: ' + args.track)
+  if args.seed != None:
+   random.seed(args.seed)
+  replay, result = record_race(track_defs[0], args.players, args.laps)
+  if not replay.save(args.file):
+   parser.error('unable to write ' + args.file)
+  print(result)
+  print('Recorded ' + str(replay.ticks) + ' ticks in ' + str(os.path.getsize(args.file)) + ' bytes')
+ elif args.command == 'info':
+  start_time = time.time()
+  replay = Replay.load(args.file)
+  load_time = time.time() - start_time
+  print(replay.track_name + ': ' + str(len(replay.player_names)) + ' players, ' + str(replay.ticks) + ' ticks (' + str(round(replay.get_duration(), 1)) + ' seconds), loaded in ' + str(round(load_time * 1000, 1)) + ' ms')
+  if args.tick != None:
+   players = [Player(name) for name in replay.player_names]
+   replay.apply(args.tick, players)
+   for player in players:
+    print('  ' + player.name + ': position ' + str(player.position) + ', velocity ' + str(player.velocity))
+ else:
+  parser.print_help()
+
+if __name__ == '__main__':
+ main()
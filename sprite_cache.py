@@ -0,0 +1,81 @@
+# Sprite Cache
+#
+# Keeps copies of the sprite images scaled down by powers of two, so that a distant sprite is drawn from
+# a copy close to the size that it appears, rather than by resampling the full-size image every frame.
+# A copy is never smaller than the sprite, so they are only scaled down when drawn. The least recently
+# used copies are discarded once they take more than budget_bytes, counting each pixel as
+# BYTES_PER_PIXEL.
+#
+# The copies are made by scale_image(image, source centre, source size, factor), which only some
+# backends provide (see raster_backend.py). simplegui can't create images, so PowerDrift.py only uses
+# this module outside CodeSkulptor, when its backend provides scale_image().
+
+class SpriteCache:
+ BUDGET_BYTES = 32 * 1024 * 1024
+ BYTES_PER_PIXEL = 4
+ MAX_LEVEL = 6          # The smallest copy is scaled down by 2 ** MAX_LEVEL
+
+ def __init__(self, scale_image, budget_bytes = BUDGET_BYTES):
+  self.scale_image = scale_image
+  self.budget_bytes = budget_bytes
+  self.entries = {}     # (IMG_ constant, level) : [source, bytes, last use]
+  self.bytes = 0
+  self.clock = 0        # Counts every use, to order the entries by when they were last used
+  self.reset_statistics()
+
+ # Returns the (image, source centre, source size) from which to draw the image of the IMG_ constant index at size_dest,
+ #   given its full-size source
+ def get_source(self, index, source, size_dest):
+  width = abs(size_dest[0])
+  height = abs(size_dest[1])
+  if width == 0 or height == 0:
+   return source
+  ratio = min(source[2][0] / width, source[2][1] / height)
+  level = 0
+  while ratio >= 2 and level < SpriteCache.MAX_LEVEL:
+   ratio /= 2
+   level += 1
+  if level == 0:
+   return source
+
+  self.uses += 1
+  self.clock += 1
+  key = (index, level)
+  entry = self.entries.get(key)
+  if entry != None:
+   self.hits += 1
+   entry[2] = self.clock
+   return entry[0]
+
+  self.misses += 1
+  factor = 2 ** level
+  image = self.scale_image(source[0], source[1], source[2], factor)
+  size = (source[2][0] / float(factor), source[2][1] / float(factor))
+  entry = [(image, (size[0] / 2.0, size[1] / 2.0), size), image.get_width() * image.get_height() * SpriteCache.BYTES_PER_PIXEL, self.clock]
+  self.entries[key] = entry
+  self.bytes += entry[1]
+  while self.bytes > self.budget_bytes and len(self.entries) > 1:
+   self._evict_least_recently_used()
+  return entry[0]
+
+ def _evict_least_recently_used(self):
+  oldest = None
+  for key in self.entries:
+   if oldest == None or self.entries[key][2] < self.entries[oldest][2]:
+    oldest = key
+  self.bytes -= self.entries.pop(oldest)[1]
+  self.evictions += 1
+
+ # Empties the cache and resets its statistics
+ def clear(self):
+  self.entries = {}
+  self.bytes = 0
+  self.clock = 0
+  self.reset_statistics()
+
+ # Resets the statistics, so that they only cover what is drawn from now on, but keeps the copies
+ def reset_statistics(self):
+  self.uses = 0
+  self.hits = 0
+  self.misses = 0
+  self.evictions = 0
@@ -0,0 +1,146 @@
+# Track Cache
+#
+# Stores built tracks in compact binary files, so that the game doesn't need to rebuild every track each
+# time it starts. Each file is named after a hash of TrackDef.get_cache_key(), which covers the control
+# points, the distance between segments and the rules for choosing images, so editing a track simply
+# misses the cache. A file that is stale, truncated or corrupt is ignored and the track is rebuilt.
+# CachingTrackBuilder uses the cache, and builds the tracks that the game is likely to need next on a
+# worker thread.
+#
+# The file system isn't available inside CodeSkulptor, so PowerDrift.py only uses this module when it
+# can import it. As PowerDrift.py imports this module, it can't import PowerDrift in return, so it
+# only relies on the get_cache_key() and restore_track() methods of the TrackDefs it is given.
+
+import array
+import hashlib
+import os
+import struct
+import threading
+import zlib
+
+class TrackCache:
+ DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.track_cache')
+ FILE_TYPE = '.trk'
+
+ # File layout: header, bounding box, then the positions, orientations and images of every segment, then a checksum.
+ # Values are stored in the machine's native byte order, since the cache is never shared between machines.
+ MAGIC = b'RRTK'
+ VERSION = 1
+ HEADER = struct.Struct('=4sHI')
+ BOX = struct.Struct('=6d')
+ CHECKSUM = struct.Struct('=I')
+ SEGMENT_SIZE = 3 * 8 + 8 + 1
+
+ def __init__(self, directory = DEFAULT_DIRECTORY):
+  self.directory = directory
+
+ def _get_path(self, track_def):
+  key = hashlib.sha1(track_def.get_cache_key().encode('utf-8')).hexdigest()
+  return os.path.join(self.directory, key + TrackCache.FILE_TYPE)
+
+ # Restores a track from the cache. Returns False if there is no valid entry for it.
+ def load(self, track_def):
+  try:
+   with open(self._get_path(track_def), 'rb') as f:
+    data = f.read()
+   segments, box = TrackCache._decode(data)
+  except (IOError, OSError, ValueError, struct.error):
+   return False
+  track_def.restore_track(segments, box)
+  return True
+
+ # Writes a built track to the cache. Failing to write is not an error, since the track can always be rebuilt.
+ def save(self, track_def):
+  path = self._get_path(track_def)
+  temp_path = path + '.tmp'
+  try:
+   if not os.path.isdir(self.directory):
+    os.makedirs(self.directory)
+   with open(temp_path, 'wb') as f:
+    f.write(TrackCache._encode(track_def))
+   os.replace(temp_path, path)
+  except (IOError, OSError):
+   pass
+
+ def _encode(track_def):
+  track = track_def.track
+  positions = array.array('d')
+  orientations = array.array('d')
+  images = array.array('B')
+  for segment in track:
+   positions.extend(segment.position)
+   orientations.append(segment.orientation)
+   images.append(segment.sprite.image)
+  box = track_def.bounding_box.box
+  payload = TrackCache.BOX.pack(*(box[0] + box[1])) + positions.tobytes() + orientations.tobytes() + images.tobytes()
+  header = TrackCache.HEADER.pack(TrackCache.MAGIC, TrackCache.VERSION, len(track))
+  return header + payload + TrackCache.CHECKSUM.pack(zlib.crc32(payload))
+
+ def _decode(data):
+  magic, version, count = TrackCache.HEADER.unpack_from(data)
+  if magic != TrackCache.MAGIC or version != TrackCache.VERSION:
+   raise ValueError('Not a track cache file')
+  offset = TrackCache.HEADER.size
+  end = len(data) - TrackCache.CHECKSUM.size
+  payload = data[offset : end]
+  if end - offset != TrackCache.BOX.size + count * TrackCache.SEGMENT_SIZE or TrackCache.CHECKSUM.unpack_from(data, end)[0] != zlib.crc32(payload):
+   raise ValueError('Corrupt track cache file')
+
+  b = TrackCache.BOX.unpack_from(payload)
+  box = [list(b[0 : 3]), list(b[3 : 6])]
+  offset = TrackCache.BOX.size
+  positions = array.array('d', payload[offset : offset + count * 24])
+  offset += count * 24
+  orientations = array.array('d', payload[offset : offset + count * 8])
+  offset += count * 8
+  images = array.array('B', payload[offset : offset + count])
+
+  segments = []
+  for i in range(count):
+   segments.append((tuple(positions[i * 3 : i * 3 + 3]), orientations[i], images[i]))
+  return segments, box
+
+# Builds tracks on demand, like PowerDrift's TrackBuilder, but restores them from a TrackCache when it can and saves the
+#   ones that it builds. The tracks that may be needed soon are built in advance on a worker thread.
+class CachingTrackBuilder:
+ def __init__(self, track_defs, track_cache = None):
+  self.track_defs = track_defs
+  self.track_cache = track_cache if track_cache != None else TrackCache()
+  self._queue = []
+  self._queue_lock = threading.Lock()    # Held while the queue or the worker are changed
+  self._build_lock = threading.Lock()    # Held while a track is built, so that it is never built twice at once
+  self._worker = None
+
+ # Returns the track definition at index, first building the track if it isn't ready yet
+ def build(self, index):
+  track_def = self.track_defs[index]
+  with self._build_lock:
+   if track_def.track == None and not self.track_cache.load(track_def):
+    track_def.create_track()
+    self.track_cache.save(track_def)
+  return track_def
+
+ # Sets which tracks should be built next, most important first, and starts the worker if it isn't running
+ def prefetch(self, indices):
+  with self._queue_lock:
+   self._queue[:] = [index % len(self.track_defs) for index in indices]
+   if self._worker == None:
+    self._worker = threading.Thread(target = self._run)
+    self._worker.daemon = True
+    self._worker.start()
+
+ # Called once per frame, but the worker builds the tracks, so there is nothing to do
+ def process(self):
+  pass
+
+ # Builds the queued tracks until none are left. The worker only stops while holding _queue_lock, so anything that
+ #   prefetch() queues is either taken by this worker or by a new one.
+ def _run(self):
+  while True:
+   with self._queue_lock:
+    if not self._queue:
+     self._worker = None
+     return
+    index = self._queue.pop(0)
+   if self.track_defs[index].track == None:
+    self.build(index)
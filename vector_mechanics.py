@@ -0,0 +1,316 @@
+# Vectorised Race
+#
+# Keeps the position, velocity and acceleration of every player in a single NumPy array each (a
+# "struct of arrays"), along with the state of the computer players, and runs the whole of a tick on
+# them at once: the movement, the collision sweep, the track edges, the ordering of the players and
+# the computer players' decisions. Only the few pairs of cars that actually collide, and the computer
+# players that make a new decision on a tick, are handled one at a time. The time taken by a tick
+# therefore grows very little with the size of the field, whereas the scalar Mechanics and
+# Intelligence in PowerDrift.py visit every player several times a tick. The scalar ones are quicker
+# for a handful of cars, and the arrays only pay off with larger fields (see the README).
+#
+# The players' decisions draw on the random module in the same order as Intelligence, so a race
+# follows the same course as it does with the scalar classes, apart from rounding.
+#
+# The arrays hold the state of the race. The Player objects are brought up to date at the end of each
+# tick, so that the rest of the game can read them, but changes made to them between ticks are not
+# seen, apart from the acceleration of the human player, which is where the game's input goes.
+#
+# Requires NumPy, so this is only for use outside CodeSkulptor, e.g. by headless.py.
+
+import math
+import random
+
+import numpy
+
+from PowerDrift import X, Z, Intelligence, Math, Mechanics, Player, Race, TrackDef
+
+# Array-backed store for the state of all players in a race
+class PlayerArrays:
+ def __init__(self, players):
+  l = len(players)
+  self.position = numpy.zeros((l, 2))
+  self.velocity = numpy.zeros((l, 2))
+  self.acceleration = numpy.zeros((l, 2))
+  self.load(players)
+
+ # Copy each player's current state into the arrays
+ def load(self, players):
+  self.position[:] = [player.position for player in players]
+  self.velocity[:] = [player.velocity for player in players]
+  self.acceleration[:] = [player.acceleration for player in players]
+
+ # Give each player a copy of their state in the arrays
+ def store(self, players):
+  for player, position, velocity, acceleration in zip(players, self.position.tolist(), self.velocity.tolist(), self.acceleration.tolist()):
+   player.position = position
+   player.velocity = velocity
+   player.acceleration = acceleration
+
+class VectorMechanics(Mechanics):
+ def __init__(self, race):
+  Mechanics.__init__(self, race)
+  self.arrays = race.arrays
+  car_vel_max = Mechanics.CAR_VELOCITY_MAX_MS
+  self._velocity_min = numpy.array((-car_vel_max[0], 0))
+  self._velocity_max = numpy.array(car_vel_max, dtype = float)
+  self._velocity_dampen = numpy.array(Mechanics.CAR_VELOCITY_DAMPEN)
+  self._acc_factor = numpy.zeros((len(race.players), 2))
+
+ # Simulate centrifugal force being applied to the human player as they take corners
+ def apply_force(self):
+  pos = self.arrays.position
+  vel = self.arrays.velocity
+  acc = self.arrays.acceleration
+  h = Player.HUMAN
+  track_angle = self.race.track_def.get_track_angle(pos[h, 1])
+  acc[h, 0] -= vel[h, 1] * track_angle * Mechanics.CAR_CENTRIFUGAL_MSS
+
+ def move_players(self, delta):
+  pos = self.arrays.position
+  vel = self.arrays.velocity
+  acc = self.arrays.acceleration
+  vel_z = vel[:, 1]
+
+  # Update Position. pos[:, 1] is measured in track segments rather than metres
+  pos += vel * (delta, delta / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M)
+
+  # Lateral acceleration strength is based on forward velocity. Forward acceleration is greater at lower speeds and deceleration is boosted.
+  acc_factor = self._acc_factor
+  numpy.minimum(2 * vel_z / Mechanics.CAR_VELOCITY_MAX_MS[1], 1, out = acc_factor[:, 0])
+  numpy.cos(vel_z / Mechanics.CAR_VELOCITY_MAX_MS[1] * math.pi / 2, out = acc_factor[:, 1])
+  acc_factor[acc[:, 1] <= 0, 1] = Mechanics.CAR_DECELERATION_FACTOR
+
+  # Update and Constrain Velocity
+  vel += acc * delta * acc_factor
+  numpy.minimum(numpy.maximum(vel, self._velocity_min, out = vel), self._velocity_max, out = vel)
+
+  # Dampen velocity
+  dampen = numpy.where(acc == 0, self._velocity_dampen, 1.0)
+  dampen[vel_z < 10, 0] = Mechanics.CAR_VELOCITY_DAMPEN[0]
+  vel *= dampen
+
+ def process_collisions(self):
+  pos = self.arrays.position
+  vel = self.arrays.velocity
+  l = len(pos)
+
+  # The 2d 'track space' bounding boxes of all players
+  hx = Mechanics.CAR_SIZE_M[X] / 2.0
+  hz = Mechanics.CAR_SIZE_M[Z] / 2.0
+  cz = pos[:, 1] * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
+  min_x = pos[:, 0] - hx
+  max_x = pos[:, 0] + hx
+  min_z = cz - hz
+  max_z = cz + hz
+
+  # Broad Phase - Sort and Sweep
+  # Sort the boxes by where they start along the track. The boxes that overlap one along the track are the ones that
+  #   start after it and no later than it ends, which are found for every box at once by a binary search.
+  order = min_z.argsort(kind = 'stable')
+  ends = numpy.searchsorted(min_z[order], max_z[order], side = 'right')
+  counts = ends - numpy.arange(1, l + 1)
+  total = int(counts.sum())
+  if total == 0:
+   return
+  first = numpy.repeat(numpy.arange(l), counts)
+  second = first + 1 + numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+  a = order[first]
+  b = order[second]
+
+  # Narrow Phase - The boxes already overlap along the track, so only their sides need testing
+  i = numpy.minimum(a, b)
+  j = numpy.maximum(a, b)
+  dx0 = max_x[j] - min_x[i]
+  dx1 = max_x[i] - min_x[j]
+  hit = (dx0 >= 0) & (dx1 >= 0)
+  if not hit.any():
+   return
+
+  # Resolve the collisions in the same order as Mechanics does
+  i = i[hit]
+  j = j[hit]
+  resolve_order = (i * l + j).argsort(kind = 'stable')
+  i = i[resolve_order]
+  j = j[resolve_order]
+  dx0 = dx0[hit][resolve_order]
+  dx1 = dx1[hit][resolve_order]
+  dz0 = max_z[j] - min_z[i]
+  dz1 = max_z[i] - min_z[j]
+  self.collisions += len(i)
+  mtd_x = numpy.where(dx0 < dx1, dx0, -dx1)
+  mtd_z = numpy.where(dz0 < dz1, dz0, -dz1)
+  sideways = numpy.abs(mtd_x) < numpy.abs(mtd_z)
+  mtd_x = numpy.where(sideways, mtd_x, 0)
+  mtd_z = numpy.where(sideways, 0, mtd_z)
+
+  # Intersection Response - Separate the objects so that they just touch each other. The moves are added to each
+  #   player in turn, since a player can be in more than one collision.
+  relaxation = Mechanics.COLLISION_RELAXATION
+  fx = mtd_x * 0.5 * relaxation
+  fz = mtd_z * 0.5 * relaxation / TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
+  players = numpy.column_stack((i, j)).ravel()
+  numpy.add.at(pos[:, 0], players, numpy.column_stack((fx, -fx)).ravel())
+  numpy.add.at(pos[:, 1], players, numpy.column_stack((fz, -fz)).ravel())
+
+  # Swap and dampen velocities if hitting back to front
+  vel_z = vel[:, 1]
+  dampen = Mechanics.COLLISION_DAMPEN
+  rear = mtd_z != 0
+  for p1, p2 in zip(i[rear].tolist(), j[rear].tolist()):
+   v = vel_z[p1]
+   vel_z[p1] = vel_z[p2] * dampen
+   vel_z[p2] = v * 0.9
+
+ def constrain_players_to_track(self):
+  car_half_width = Mechanics.CAR_SIZE_M[0] / 2
+  track_half_width = TrackDef.TRACK_SIZE_M[0] / 2
+  x = self.arrays.position[:, 0]
+  vel = self.arrays.velocity
+  if x.min() - car_half_width >= -track_half_width and x.max() + car_half_width <= track_half_width:
+   return
+
+  # Find the players that are touching either edge of the track and push them back onto it
+  left = x - car_half_width < -track_half_width
+  right = (x + car_half_width > track_half_width) & ~left
+  x[left] = car_half_width - track_half_width
+  x[right] = track_half_width - car_half_width
+  hit = left | right
+  vel[hit, 0] = 0
+  vel[hit, 1] *= Mechanics.CAR_VELOCITY_DAMPEN_TRACK_EDGE
+
+# Makes the same decisions as Intelligence, for every computer player at once
+class VectorIntelligence:
+ # Takes over the state of the players from the race's Intelligence
+ def __init__(self, race, intelligence):
+  self.race = race
+  self.arrays = race.arrays
+  self.autopilot = intelligence.autopilot
+  states = intelligence.player_states
+  self.target_x = numpy.array([state.target_x for state in states], dtype = float)
+  self.aggression = numpy.array([state.aggression for state in states], dtype = float)
+  self.evaluate_count = numpy.array([state.evaluate_count for state in states])
+  self._ahead = numpy.zeros(len(states), dtype = int)
+  self._behind = numpy.zeros(len(states), dtype = int)
+
+  # The velocity that suits the bend ahead of each segment of track, before it is scaled by a player's aggression
+  track = race.track_def.track
+  track_length = len(track)
+  bend_speeds = []
+  for i in range(track_length):
+   track_angle = Math.get_angle_between_orientations(track[i].orientation, track[(i + Intelligence.TRACK_LOOK_AHEAD) % track_length].orientation)
+   bend_speeds.append(Mechanics.CAR_VELOCITY_MAX_MS[1] * math.cos(min(abs(track_angle) * 1.4, 1)))
+  self.bend_speeds = numpy.array(bend_speeds)
+
+ def process_players(self):
+  pos = self.arrays.position
+  vel = self.arrays.velocity
+  acc = self.arrays.acceleration
+  x = pos[:, 0]
+  z = pos[:, 1]
+  vel_z = vel[:, 1]
+  track_length = len(self.bend_speeds)
+
+  # The players in order of their position on the track, which the Race sorts each tick, and who is ahead of and behind each of them
+  order = self.race.track_order
+  ahead = self._ahead
+  ahead[order[: -1]] = order[1 :]
+  ahead[order[-1]] = order[0]
+  behind = self._behind
+  behind[order[1 :]] = order[: -1]
+  behind[order[0]] = order[-1]
+  thinking = None
+  if not self.autopilot:
+   thinking = numpy.ones(len(pos), dtype = bool)
+   thinking[Player.HUMAN] = False
+
+  # See how close each player is to the car in front and the car behind
+  distance = ((z[ahead] - z).astype(int) % track_length) * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
+  close_ahead = distance <= Intelligence.PlayerState.OVERTAKING_DISTANCE_M
+  distance = ((z - z[behind]).astype(int) % track_length) * TrackDef.DISTANCE_BETWEEN_SEGMENTS_M
+  close_behind = distance <= Mechanics.CAR_SIZE_M[Z] * 2
+
+  # Players that are faster than the car ahead, close to it and clear of the car behind position themselves to overtake
+  target_x = self.target_x
+  overtaking = (vel_z > vel_z[ahead]) & close_ahead & ~close_behind
+  if thinking is not None:
+   overtaking &= thinking
+  if overtaking.any():
+   opponent_x = x[ahead]
+   car_double_width = 2 * Mechanics.CAR_SIZE_M[X]
+   overtaking_x = numpy.where(opponent_x >= 0, numpy.minimum(target_x, opponent_x - car_double_width), numpy.maximum(target_x, opponent_x + car_double_width))
+   numpy.copyto(target_x, overtaking_x, where = overtaking)
+
+  # Accelerate towards the velocity that suits the bend ahead, and move sideways towards the target
+  target_velocity = self.bend_speeds[z.astype(int) % track_length] * self.aggression
+  forward = numpy.where(target_velocity > vel_z, Mechanics.CAR_ACCELERATION_MSS[1], Mechanics.CAR_ACCELERATION_MSS[1] * -Mechanics.CAR_DECELERATION_FACTOR)
+  difference = target_x - x
+  lateral = numpy.where(numpy.abs(difference) > 0.1, numpy.copysign(Intelligence.PlayerState.LATERAL_SHUFFLE_MS, difference), 0)
+  count = self.evaluate_count
+  if thinking is None:
+   acc[:, 1] = forward
+   vel[:, 0] = lateral
+   count -= 1
+  else:
+   numpy.copyto(acc[:, 1], forward, where = thinking)
+   numpy.copyto(vel[:, 0], lateral, where = thinking)
+   count[thinking] -= 1
+
+  # Players whose time is up choose a new line and aggression, in the order that Intelligence visits them
+  if count.min() <= 0:
+   due = count <= 0
+   if thinking is not None:
+    due &= thinking
+   aggression = self.aggression
+   available_width = (TrackDef.TRACK_SIZE_M[X] - Mechanics.CAR_SIZE_M[X]) * 0.4
+   for p in order[due[order]].tolist():
+    if not close_behind[p] and not close_ahead[p]:
+     target_x[p] = (random.random() * available_width) - (available_width / 2.0)
+    aggression[p] = max(min(float(aggression[p]) + random.random() * 0.04 - 0.02, 1), 0)
+    count[p] = random.randrange(60) + 60
+
+# A Race that runs its ticks on PlayerArrays, with VectorMechanics and VectorIntelligence
+class VectorRace(Race):
+ def __init__(self, players, track_def):
+  self.arrays = None
+  Race.__init__(self, players, track_def)
+  self._sorted_entries = VectorRace._get_entries(self.sorted_players)
+  self._track_entries = VectorRace._get_entries(self.track_players)
+  self.track_order = None
+  self.arrays = PlayerArrays(players)
+  self.mechanics = VectorMechanics(self)
+  self.intelligence = VectorIntelligence(self, self.intelligence)
+
+ # Returns the [position, index, player] entries of a sorted list in the order of the players
+ def _get_entries(sorted_list):
+  entries = [None] * len(sorted_list)
+  for entry in sorted_list:
+   entries[entry[Race.SORTED_PLAYER_INDEX]] = entry
+  return entries
+
+ # Sorts sorted_players and track_players as Race does, but from the arrays. The positions in their entries aren't updated.
+ def _sort_players(self):
+  if self.arrays == None:
+   Race._sort_players(self)
+   return
+  z = self.arrays.position[:, 1]
+  sorted_entries = self._sorted_entries
+  self.sorted_players[:] = [sorted_entries[i] for i in (-z).argsort(kind = 'stable').tolist()]
+
+  track_length = len(self.track_def.track)
+  self.track_order = (z - track_length * (1 + z // track_length)).argsort(kind = 'stable')
+  track_entries = self._track_entries
+  self.track_players[:] = [track_entries[i] for i in self.track_order.tolist()]
+
+ def process_tick(self, delta):
+  arrays = self.arrays
+  arrays.acceleration[Player.HUMAN] = self.players[Player.HUMAN].acceleration
+  self._previous_positions = arrays.position.tolist()
+  m = self.mechanics
+  m.apply_force()
+  m.move_players(delta)
+  m.process_collisions()
+  m.constrain_players_to_track()
+  self._sort_players()
+  self.intelligence.process_players()
+  arrays.store(self.players)